@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+API администратора
+Управление событиями, метрики, выгрузка транзакций и ставок
+"""
+
+import hmac
+from datetime import datetime
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from config.settings import settings
+from services.avatar_service import avatar_service
+from services.betting_service import betting_service
+from services.cluster_bus import cluster_bus
+from services.deposit_ingestor import deposit_ingestor
+from services.event_feed import event_feed
+from services.invoice_service import invoice_service
+from services.message_scheduler import MAX_MESSAGE_LENGTH, message_scheduler
+from services.outbox_dispatcher import outbox_dispatcher
+from services.update_dispatcher import update_dispatcher
+from services.withdrawal_worker import withdrawal_worker
+from services.ws_hub import ws_hub
+from utils.bot_api import bot_api
+from utils.telegram_pool import telegram_pool
+from services.export_service import export_service, EXPORT_DATASETS, EXPORT_FORMATS
+
+async def require_admin(x_admin_password: Optional[str] = Header(None)):
+    """
+    Проверка пароля администратора из заголовка X-Admin-Password
+    Пароль не задан или взят из примера - админка отключена (503), а не открыта
+    """
+    if not settings.admin_password_configured():
+        raise HTTPException(status_code=503, detail="Админка отключена: не задан ADMIN_PASSWORD")
+        
+    if not x_admin_password or not hmac.compare_digest(
+        x_admin_password.encode(), settings.ADMIN_PASSWORD.encode()
+    ):
+        raise HTTPException(status_code=401, detail="Требуется авторизация администратора")
+
+router = APIRouter(prefix="/api/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+@router.post("/events")
+async def create_event(request: Request):
+    """Создание события (сразу попадает в кэш ленты событий)"""
+    try:
+        body = await request.json()
+        
+        title = body.get("title")
+        outcomes = body.get("outcomes")
+        coefficients = body.get("coefficients")
+        end_time = body.get("endTime")
+        
+        if not all([title, outcomes, coefficients, end_time]):
+            raise HTTPException(status_code=400, detail="Отсутствуют обязательные параметры")
+            
+        try:
+            end_time = datetime.fromisoformat(end_time)
+            start_time = datetime.fromisoformat(body["startTime"]) if body.get("startTime") else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный формат даты")
+            
+        if end_time.tzinfo is None or (start_time and start_time.tzinfo is None):
+            raise HTTPException(status_code=400, detail="Дата должна содержать часовой пояс")
+            
+        result = await betting_service.create_event(
+            title, outcomes, coefficients, end_time,
+            description=body.get("description"), start_time=start_time
+        )
+        
+        if not result["success"]:
+            raise HTTPException(status_code=400, detail=result["error"])
+            
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[API] ❌ Ошибка создания события: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка сервера")
+
+@router.post("/events/{event_id}/result")
+async def set_event_result(event_id: int, request: Request):
+    """Фиксация результата события и расчет ставок"""
+    try:
+        body = await request.json()
+        winner_index = body.get("winnerIndex")
+        result_outcome = body.get("resultOutcome")
+        
+        if winner_index is None or not result_outcome:
+            raise HTTPException(status_code=400, detail="Отсутствуют обязательные параметры")
+            
+        result = await betting_service.process_event_result(event_id, winner_index, result_outcome)
+        
+        if not result["success"]:
+            raise HTTPException(status_code=400, detail=result["error"])
+            
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[API] ❌ Ошибка обработки результата события: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка сервера")
+
+@router.post("/broadcast")
+async def broadcast(request: Request):
+    """
+    Рассылка сообщения пользователям (userIds - список получателей, по умолчанию все)
+    Идет через outbox с низким приоритетом: подтверждения и результаты ставок не задерживает
+    """
+    try:
+        body = await request.json()
+        text = (body.get("text") or "").strip()
+        user_ids = body.get("userIds")
+        
+        if not text:
+            raise HTTPException(status_code=400, detail="Отсутствует текст рассылки")
+            
+        if len(text) > MAX_MESSAGE_LENGTH:
+            raise HTTPException(status_code=400, detail="Слишком длинный текст рассылки")
+            
+        if user_ids is not None and (
+            not isinstance(user_ids, list) or not all(isinstance(i, int) for i in user_ids)
+        ):
+            raise HTTPException(status_code=400, detail="userIds должен быть списком чисел")
+            
+        queued = await outbox_dispatcher.broadcast(text, user_ids)
+        print(f"[API] ✅ Рассылка поставлена в очередь: {queued} сообщений")
+        
+        return {"success": True, "queued": queued}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[API] ❌ Ошибка рассылки: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка сервера")
+
+@router.get("/metrics")
+async def get_metrics():
+    """Метрики очередей и кэшей процесса"""
+    return {
+        "success": True,
+        "bet_acceptor": betting_service.acceptor.get_metrics(),
+        "events_cache": betting_service.events_cache.get_metrics(),
+        "deposit_ingestor": deposit_ingestor.get_metrics(),
+        "outbox": outbox_dispatcher.get_metrics(),
+        "messages": message_scheduler.get_metrics(),
+        "withdrawals": withdrawal_worker.get_metrics(),
+        "bot_api": bot_api.get_metrics(),
+        "avatars": avatar_service.get_metrics(),
+        "invoices": invoice_service.get_metrics(),
+        "webhook": update_dispatcher.get_metrics(),
+        "telegram": telegram_pool.get_metrics(),
+        "websocket": ws_hub.get_metrics(),
+        "event_feed": event_feed.get_metrics(),
+        "cluster_bus": cluster_bus.get_metrics()
+    }
+
+@router.get("/export/{dataset}")
+async def export_dataset(dataset: str, format: str = "ndjson",
+                         user_id: Optional[int] = None, type: Optional[str] = None,
+                         date_from: Optional[datetime] = None,
+                         date_to: Optional[datetime] = None):
+    """
+    Потоковая выгрузка transactions / bets в NDJSON или CSV
+    type - тип транзакции (для bets - статус ставки), даты - по created_at
+    """
+    if dataset not in EXPORT_DATASETS:
+        raise HTTPException(status_code=404, detail="Неизвестный набор данных")
+        
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Формат должен быть ndjson или csv")
+        
+    filename = f"{dataset}_{datetime.utcnow():%Y%m%d_%H%M%S}.{format}"
+    
+    return StreamingResponse(
+        export_service.stream(
+            dataset, format,
+            user_id=user_id, type_filter=type,
+            date_from=date_from, date_to=date_to
+        ),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -4,24 +4,38 @@ API для беттинга - ставки на события
 НОВЫЙ функционал для беттинг платформы
 """
 
-from fastapi import APIRouter, HTTPException, Request
-from typing import List, Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from typing import List, Dict, Any, Optional
+from config.settings import settings
 from services.betting_service import betting_service
 from services.gift_service import gift_service
+from services.avatar_service import avatar_service
+from services.leaderboard_service import leaderboard_service
+from utils.auth import ensure_user, get_current_user
 
 router = APIRouter(prefix="/api/betting", tags=["betting"])
 
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Совпадение If-None-Match с текущим ETag (список через запятую, W/ и *)"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
 @router.get("/events")
-async def get_active_events() -> Dict:
-    """Получение активных событий для ставок"""
+async def get_active_events(request: Request) -> Response:
+    """
+    Получение активных событий для ставок
+    Тело берется из кэша готовым; при совпадении ETag - 304 без тела
+    """
     try:
-        events = await betting_service.get_active_events()
+        body, etag = await betting_service.get_active_events_response()
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
         
-        return {
-            "success": True,
-            "events": events,
-            "count": len(events)
-        }
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+            
+        return Response(content=body, media_type="application/json", headers=headers)
         
     except Exception as e:
         print(f"[API] ❌ Ошибка получения событий: {e}")
@@ -58,7 +72,8 @@ async def get_event_details(event_id: int) -> Dict:
         raise HTTPException(status_code=500, detail="Ошибка сервера")
 
 @router.post("/bet")
-async def place_bet(request: Request) -> Dict:
+async def place_bet(request: Request,
+                    current_user: Optional[Dict] = Depends(get_current_user)) -> Dict:
     """Размещение ставки пользователем"""
     try:
         body = await request.json()
@@ -71,6 +86,8 @@ async def place_bet(request: Request) -> Dict:
         
         if not all([user_id, event_id, outcome, outcome_index is not None, gift_ids]):
             raise HTTPException(status_code=400, detail="Отсутствуют обязательные параметры")
+            
+        ensure_user(current_user, user_id)
         
         # Проверяем баланс пользователя
         balance = await gift_service.get_user_balance(user_id)
@@ -93,17 +110,22 @@ async def place_bet(request: Request) -> Dict:
         raise HTTPException(status_code=500, detail="Ошибка сервера")
 
 @router.get("/bets/{user_id}")
-async def get_user_bets(user_id: int, limit: int = 20) -> Dict:
-    """Получение ставок пользователя"""
+async def get_user_bets(user_id: int, limit: int = 20, cursor: Optional[str] = None,
+                        current_user: Optional[Dict] = Depends(get_current_user)) -> Dict:
+    """Получение ставок пользователя (постранично, cursor из next_cursor)"""
+    ensure_user(current_user, user_id)
     try:
-        bets = await betting_service.get_user_bets(user_id, limit)
+        page = await betting_service.get_user_bets(user_id, limit, cursor)
         
         return {
             "success": True,
-            "bets": bets,
-            "count": len(bets)
+            "bets": page["items"],
+            "count": len(page["items"]),
+            "next_cursor": page["next_cursor"]
         }
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"[API] ❌ Ошибка получения ставок: {e}")
         raise HTTPException(status_code=500, detail="Ошибка сервера")
@@ -149,35 +171,57 @@ async def get_user_betting_stats(user_id: int) -> Dict:
         raise HTTPException(status_code=500, detail="Ошибка сервера")
 
 @router.get("/leaderboard")
-async def get_betting_leaderboard(limit: int = 10) -> Dict:
-    """Топ игроков по выигрышам"""
+async def get_betting_leaderboard(limit: int = 10, period: str = "all") -> Dict:
+    """Топ игроков по выигрышам за день (day), неделю (week) или все время (all)"""
     try:
-        from models.database import execute_query
+        leaderboard = await leaderboard_service.get_leaderboard(period, limit)
         
-        leaderboard = await execute_query("""
-            SELECT 
-                b.user_id,
-                up.first_name,
-                up.username,
-                COUNT(*) as total_bets,
-                COUNT(CASE WHEN b.status = 'won' THEN 1 END) as won_bets,
-                COALESCE(SUM(CASE WHEN b.status = 'won' THEN b.actual_payout ELSE 0 END), 0) as total_winnings,
-                COALESCE(SUM(b.total_value), 0) as total_wagered
-            FROM bets b
-            LEFT JOIN user_profiles up ON b.user_id = up.user_id
-            WHERE b.status IN ('won', 'lost')
-            GROUP BY b.user_id, up.first_name, up.username
-            HAVING COUNT(*) >= 3
-            ORDER BY total_winnings DESC
-            LIMIT $1
-        """, limit)
+        # Аватары всего топа - одним пакетом через кэш
+        avatars = await avatar_service.get_avatars(row["user_id"] for row in leaderboard)
+        leaderboard = [
+            {**row, "photo_file_id": avatars.get(row["user_id"])} for row in leaderboard
+        ]
         
         return {
             "success": True,
+            "period": period,
             "leaderboard": leaderboard
         }
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"[API] ❌ Ошибка получения лидерборда: {e}")
         raise HTTPException(status_code=500, detail="Ошибка сервера")
 
+@router.get("/avatars")
+async def get_avatars(user_ids: str,
+                      current_user: Optional[Dict] = Depends(get_current_user)) -> Dict:
+    """
+    file_id аватаров списка пользователей (user_ids=1,2,3), из кэша или Bot API
+    Только с токеном сессии и не больше AVATAR_BATCH_MAX_IDS пользователей за запрос
+    """
+    if current_user is None:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+        
+    try:
+        ids = [int(user_id) for user_id in user_ids.split(",") if user_id.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="user_ids - список чисел через запятую")
+        
+    if len(ids) > settings.AVATAR_BATCH_MAX_IDS:
+        raise HTTPException(
+            status_code=400, detail=f"Не больше {settings.AVATAR_BATCH_MAX_IDS} пользователей"
+        )
+        
+    try:
+        avatars = await avatar_service.get_avatars(ids)
+        
+        return {
+            "success": True,
+            "avatars": {str(user_id): file_id for user_id, file_id in avatars.items()}
+        }
+        
+    except Exception as e:
+        print(f"[API] ❌ Ошибка получения аватаров: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка сервера")
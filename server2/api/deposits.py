@@ -4,30 +4,55 @@ API для работы с депозитами подарков
 Вынесено из main.py для лучшей организации
 """
 
-from fastapi import APIRouter, HTTPException, Request
-from typing import List, Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, Request
+from typing import List, Dict, Any, Optional
+from config.settings import settings
 from services.gift_service import gift_service
-from utils.telegram import create_payment_invoice
+from services.invoice_service import invoice_service
+from utils.auth import ensure_user, get_current_user
+from utils.rate_limit import RateLimiter
 
 router = APIRouter(prefix="/api/deposits", tags=["deposits"])
 
+# Не больше WITHDRAWAL_RATE_LIMIT заявок на вывод от пользователя за RATE_LIMIT_PERIOD
+withdrawal_request_limiter = RateLimiter(
+    global_rate=0,
+    key_rate=settings.WITHDRAWAL_RATE_LIMIT / settings.RATE_LIMIT_PERIOD,
+    key_capacity=settings.WITHDRAWAL_RATE_LIMIT
+)
+
 @router.get("/{user_id}")
-async def get_user_deposits(user_id: int) -> List[Dict]:
+async def get_user_deposits(user_id: int, limit: int = None, cursor: Optional[str] = None,
+                            current_user: Optional[Dict] = Depends(get_current_user)) -> Any:
     """
     Получение депозитов пользователя
+    Без limit и cursor - весь список массивом, как раньше; с ними - страница
+    {"deposits": [...], "next_cursor": ...}
     Адаптировано из main.py строки 680-684
     """
+    ensure_user(current_user, user_id)
     try:
-        deposits = await gift_service.get_user_deposits(user_id)
-        return deposits
+        page = await gift_service.get_user_deposits(user_id, limit, cursor)
+        if limit is None and not cursor:
+            return page["items"]
+        
+        return {
+            "success": True,
+            "deposits": page["items"],
+            "next_cursor": page["next_cursor"]
+        }
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"[API] ❌ Ошибка получения депозитов: {e}")
         raise HTTPException(status_code=500, detail="Ошибка сервера")
 
 @router.get("/{user_id}/balance")
-async def get_user_balance(user_id: int) -> Dict:
+async def get_user_balance(user_id: int,
+                           current_user: Optional[Dict] = Depends(get_current_user)) -> Dict:
     """Получение баланса пользователя"""
+    ensure_user(current_user, user_id)
     try:
         balance = await gift_service.get_user_balance(user_id)
         return {
@@ -40,26 +65,34 @@ async def get_user_balance(user_id: int) -> Dict:
         raise HTTPException(status_code=500, detail="Ошибка сервера")
 
 @router.get("/withdrawable/{user_id}")
-async def get_withdrawable_deposits(user_id: int) -> Dict:
+async def get_withdrawable_deposits(user_id: int, limit: int = None,
+                                    cursor: Optional[str] = None,
+                                    current_user: Optional[Dict] = Depends(get_current_user)) -> Dict:
     """
-    Депозиты доступные для вывода
+    Депозиты доступные для вывода (постранично; без limit и cursor - все)
     Адаптировано из main.py строки 747-761
     """
+    ensure_user(current_user, user_id)
     try:
-        deposits = await gift_service.get_user_deposits(user_id)
+        page = await gift_service.get_user_deposits(user_id, limit, cursor)
+        deposits = page["items"]
         
         return {
             "success": True,
             "deposits": deposits,
-            "withdrawable_count": len(deposits)
+            "withdrawable_count": sum(1 for deposit in deposits if deposit["can_withdraw"]),
+            "next_cursor": page["next_cursor"]
         }
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"[API] ❌ Ошибка получения депозитов для вывода: {e}")
         raise HTTPException(status_code=500, detail="Ошибка сервера")
 
 @router.post("/withdrawal/process")
-async def process_withdrawal(request: Request) -> Dict:
+async def process_withdrawal(request: Request,
+                             current_user: Optional[Dict] = Depends(get_current_user)) -> Dict:
     """
     Обработка вывода подарка
     Адаптировано из main.py строки 726-745
@@ -68,12 +101,17 @@ async def process_withdrawal(request: Request) -> Dict:
         body = await request.json()
         deposit_id = body.get("depositId")
         recipient_user_id = body.get("recipientUserId")
-        owner_user_id = body.get("ownerUserId", recipient_user_id)
+        # Владелец - из токена сессии; для клиентов без токена - из тела запроса
+        default_owner = current_user["user_id"] if current_user else recipient_user_id
+        owner_user_id = body.get("ownerUserId", default_owner)
         
         if not deposit_id or not recipient_user_id:
             raise HTTPException(status_code=400, detail="Отсутствуют обязательные параметры")
         
-        # TODO: Добавить rate limiting
+        ensure_user(current_user, owner_user_id)
+        
+        if not withdrawal_request_limiter.try_acquire(owner_user_id):
+            raise HTTPException(status_code=429, detail="Слишком много заявок на вывод, попробуйте позже")
         
         result = await gift_service.process_withdrawal(
             deposit_id, recipient_user_id, owner_user_id
@@ -91,21 +129,35 @@ async def process_withdrawal(request: Request) -> Dict:
         raise HTTPException(status_code=500, detail="Ошибка сервера")
 
 @router.get("/withdrawal/history/{user_id}")
-async def get_withdrawal_history(user_id: int) -> List[Dict]:
+async def get_withdrawal_history(user_id: int, limit: int = None, cursor: Optional[str] = None,
+                                 current_user: Optional[Dict] = Depends(get_current_user)) -> Any:
     """
     История выводов пользователя
+    Без limit и cursor - вся история массивом, как раньше; с ними - страница
+    {"history": [...], "next_cursor": ...}
     Адаптировано из main.py строки 763-767
     """
+    ensure_user(current_user, user_id)
     try:
-        history = await gift_service.get_withdrawal_history(user_id)
-        return history
+        page = await gift_service.get_withdrawal_history(user_id, limit, cursor)
+        if limit is None and not cursor:
+            return page["items"]
         
+        return {
+            "success": True,
+            "history": page["items"],
+            "next_cursor": page["next_cursor"]
+        }
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"[API] ❌ Ошибка получения истории выводов: {e}")
         raise HTTPException(status_code=500, detail="Ошибка сервера")
 
 @router.post("/payment/create-invoice")
-async def create_withdrawal_invoice(request: Request) -> Dict:
+async def create_withdrawal_invoice(request: Request,
+                                    current_user: Optional[Dict] = Depends(get_current_user)) -> Dict:
     """
     Создание invoice для оплаты вывода
     Адаптировано из main.py строки 802-868
@@ -118,7 +170,13 @@ async def create_withdrawal_invoice(request: Request) -> Dict:
         if not gift_ids or not user_id:
             raise HTTPException(status_code=400, detail="Отсутствуют giftIds или userId")
         
-        result = await create_payment_invoice(gift_ids, user_id)
+        if not isinstance(gift_ids, list) or not all(isinstance(i, int) for i in gift_ids):
+            raise HTTPException(status_code=400, detail="giftIds должен быть списком чисел")
+            
+        ensure_user(current_user, user_id)
+        
+        # Повторное нажатие и ретраи клиента получают ту же ссылку, пока она действительна
+        result = await invoice_service.get_invoice(user_id, gift_ids)
         
         if not result["success"]:
             raise HTTPException(status_code=500, detail=result["error"])
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Webhook Bot API
+Запрос Telegram подтверждается сразу после постановки обновления в очередь,
+обработка - в пуле services/update_dispatcher.py
+"""
+
+import hmac
+from fastapi import APIRouter, Header, HTTPException, Request
+from typing import Optional
+from config.settings import settings
+from services.update_dispatcher import update_dispatcher
+
+router = APIRouter(tags=["webhook"])
+
+@router.post("/webhook")
+async def telegram_webhook(request: Request,
+                           x_telegram_bot_api_secret_token: Optional[str] = Header(None)):
+    """Прием обновления: проверка секрета, постановка в очередь, немедленный ответ"""
+    # Без WEBHOOK_SECRET webhook выключен: иначе обновления мог бы прислать кто угодно
+    if not settings.WEBHOOK_SECRET or not x_telegram_bot_api_secret_token or not hmac.compare_digest(
+        x_telegram_bot_api_secret_token.encode(), settings.WEBHOOK_SECRET.encode()
+    ):
+        raise HTTPException(status_code=401, detail="Неверный секрет webhook")
+        
+    try:
+        update = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректное обновление")
+        
+    if not isinstance(update, dict):
+        raise HTTPException(status_code=400, detail="Некорректное обновление")
+        
+    if not update_dispatcher.submit(update):
+        # Очередь заполнена: Telegram повторит доставку позже
+        raise HTTPException(status_code=503, detail="Очередь обновлений заполнена")
+        
+    return {"ok": True}
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+WebSocket /ws: подписки на обновления событий, ставок и баланса
+Клиент шлет {"type": "subscribe" | "unsubscribe", "topic": ...}, {"type": "snapshot", "event_id": ...}
+и {"type": "ping"}; темы - events, event:<id>, balance (свой баланс, нужен ?token=<JWT>).
+Банк и счетчики событий приходят дельтами с seq; после подписки на event:<id> сразу
+отправляется snapshot, по разрыву seq клиент запрашивает его сам
+"""
+
+import time
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from typing import Optional
+from services.event_feed import event_feed
+from services.ws_hub import ws_hub
+from utils.auth import decode_access_token
+
+router = APIRouter(tags=["websocket"])
+
+# Закрытие при неверном токене (policy violation)
+CLOSE_INVALID_TOKEN = 1008
+
+def parse_event_topic(topic: str) -> Optional[int]:
+    """ID события из темы event:<id>"""
+    kind, _, key = topic.partition(":")
+    return int(key) if kind == "event" else None
+
+async def send_snapshot(connection, event_id: int):
+    """Полное состояние события с seq, от которого клиент применяет дельты"""
+    snapshot = await event_feed.snapshot(event_id)
+    if snapshot is None:
+        ws_hub.send(connection, {"type": "error", "error": "Событие не найдено", "event_id": event_id})
+    else:
+        ws_hub.send(connection, snapshot)
+
+@router.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket, token: Optional[str] = None):
+    """WebSocket для реал-тайм обновлений"""
+    user_id = None
+    if token:
+        claims = decode_access_token(token)
+        if not claims:
+            await websocket.close(code=CLOSE_INVALID_TOKEN)
+            return
+        user_id = claims["user_id"]
+        
+    await websocket.accept()
+    connection = ws_hub.connect(websocket, user_id)
+    
+    try:
+        while True:
+            data = await websocket.receive_json()
+            kind = data.get("type") if isinstance(data, dict) else None
+            
+            if kind == "ping":
+                ws_hub.send(connection, {"type": "pong", "timestamp": time.time()})
+                
+            elif kind in ("subscribe", "unsubscribe"):
+                topic = ws_hub.resolve_topic(connection, data.get("topic"))
+                if topic is None:
+                    ws_hub.send(connection, {"type": "error", "error": "Неизвестная или недоступная тема",
+                                             "topic": data.get("topic")})
+                elif kind == "unsubscribe":
+                    ws_hub.unsubscribe(connection, topic)
+                    ws_hub.send(connection, {"type": "unsubscribed", "topic": topic})
+                elif ws_hub.subscribe(connection, topic):
+                    ws_hub.send(connection, {"type": "subscribed", "topic": topic})
+                    event_id = parse_event_topic(topic)
+                    if event_id is not None:
+                        await send_snapshot(connection, event_id)
+                else:
+                    ws_hub.send(connection, {"type": "error", "error": "Слишком много подписок",
+                                             "topic": topic})
+                                             
+            elif kind == "snapshot":
+                event_id = data.get("event_id")
+                if isinstance(event_id, int) and not isinstance(event_id, bool):
+                    await send_snapshot(connection, event_id)
+                else:
+                    ws_hub.send(connection, {"type": "error", "error": "Нужен event_id"})
+                    
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"[WS] Ошибка WebSocket: {e}")
+    finally:
+        await ws_hub.disconnect(connection)
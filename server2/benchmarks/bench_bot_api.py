@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк вызовов Bot API: новый httpx.AsyncClient на вызов vs общий пул соединений
+Запуск: python -m benchmarks.bench_bot_api [--calls 200] [--rtt-ms 40] [--concurrency 1 10]
+
+Поднимает локальный мок Bot API. Сеть до api.telegram.org имитируется задержками:
+установка соединения стоит --handshake-rtts RTT (TCP + TLS), каждый запрос - один RTT.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import httpx
+from utils.bot_api import BotAPIClient
+
+TOKEN = "123:bench"
+
+class MockBotAPI:
+    """Минимальный HTTP/1.1 сервер с keep-alive, отвечающий как Bot API"""
+    
+    def __init__(self, rtt: float, handshake_rtts: int):
+        self.rtt = rtt
+        self.handshake_rtts = handshake_rtts
+        self.connections = 0
+        self.requests = 0
+        self._server = None
+    
+    async def start(self) -> str:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+    
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        await asyncio.sleep(self.rtt * self.handshake_rtts)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode().split("\r\n")
+                method_name = lines[0].split(" ")[1].rsplit("/", 1)[-1]
+                headers = dict(line.split(": ", 1) for line in lines[1:] if ": " in line)
+                length = int(headers.get("Content-Length", headers.get("content-length", 0)))
+                body = json.loads(await reader.readexactly(length) or b"{}")
+                
+                await asyncio.sleep(self.rtt)
+                self.requests += 1
+                payload = json.dumps({"ok": True, "result": self._result(method_name, body)}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: " + str(len(payload)).encode() + b"\r\n\r\n" + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+    
+    def _result(self, method_name: str, body: dict):
+        if method_name == "getUserProfilePhotos":
+            return {"total_count": 1, "photos": [[{"file_id": f"photo_{body.get('user_id')}"}]]}
+        if method_name == "createInvoiceLink":
+            return "https://t.me/$bench"
+        return True
+    
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+async def per_call_client(base_url: str, user_id: int):
+    """Прежний вариант: новый клиент (и соединение) на каждый вызов"""
+    async with httpx.AsyncClient() as client:
+        response = await client.post(
+            f"{base_url}/bot{TOKEN}/getUserProfilePhotos", json={"user_id": user_id, "limit": 1}
+        )
+        return response.json()["result"]
+
+async def measure(call, calls: int, concurrency: int) -> dict:
+    """calls вызовов не больше concurrency одновременно"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def one(index: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await call(index)
+            latencies.append(time.perf_counter() - started)
+            
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(calls)))
+    total = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p95": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000,
+        "rps": calls / total
+    }
+
+async def run(args):
+    mock = MockBotAPI(args.rtt_ms / 1000, args.handshake_rtts)
+    base_url = await mock.start()
+    
+    print(f"вызовов: {args.calls}, RTT: {args.rtt_ms} мс, установка соединения: "
+          f"{args.handshake_rtts} RTT")
+    print(f"{'client':>10} | {'conc':>4} | {'p50, ms':>8} | {'p95, ms':>8} | "
+          f"{'calls/s':>8} | {'connections':>11}")
+    print("-" * 64)
+    
+    for concurrency in args.concurrency:
+        mock.connections = 0
+        fresh = await measure(lambda i: per_call_client(base_url, i), args.calls, concurrency)
+        fresh_connections = mock.connections
+        
+        mock.connections = 0
+        client = BotAPIClient(base_url=base_url, concurrency=max(concurrency, 1), http2=False)
+        await client.start()
+        shared = await measure(
+            lambda i: client.call("getUserProfilePhotos", {"user_id": i, "limit": 1}, TOKEN),
+            args.calls, concurrency
+        )
+        await client.close()
+        shared_connections = mock.connections
+        
+        for name, result, connections in (("per-call", fresh, fresh_connections),
+                                          ("shared", shared, shared_connections)):
+            print(f"{name:>10} | {concurrency:>4} | {result['p50']:8.1f} | {result['p95']:8.1f} | "
+                  f"{result['rps']:8.1f} | {connections:>11}")
+                  
+    await mock.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк клиента Bot API")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--rtt-ms", type=float, default=40)
+    parser.add_argument("--handshake-rtts", type=int, default=3,
+                        help="RTT на установку соединения: TCP + TLS 1.2 = 3, TLS 1.3 = 2")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10])
+    args = parser.parse_args()
+    
+    asyncio.run(run(args))
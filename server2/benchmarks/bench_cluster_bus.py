@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк шины между воркерами: NOTIFY на каждое сообщение vs пачки cluster_bus
+Запуск: DATABASE_URL=... python -m benchmarks.bench_cluster_bus [--messages 20000] [--rate 0]
+
+Отправитель и получатель - два экземпляра ClusterBus в одном процессе на отдельном канале
+(разные node_id, получатель слушает через LISTEN-соединение DatabaseManager), поэтому
+задержка доставки меряется одними часами. Сообщение по размеру как рассылка ставок события.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import asyncpg
+from config.settings import settings
+from models.database import db_manager
+from services.cluster_bus import ClusterBus, encode_part
+
+CHANNEL = f"bench_bus_{os.getpid()}"
+KIND = "bench"
+
+def percentile(values, share: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)] if values else 0.0
+
+def make_message(index: int) -> dict:
+    """Сообщение ~300 байт: тема события и пара ставок"""
+    return {
+        "topic": "event:42", "sent_at": time.perf_counter(), "index": index,
+        "message": {"type": "bets", "event_id": 42, "bets": [
+            {"user_id": 100000 + index, "outcome_index": index % 2, "total_value": 250},
+            {"user_id": 200000 + index, "outcome_index": 1 - index % 2, "total_value": 1200}
+        ]}
+    }
+
+async def naive_publish(pool, node_id: str, data: dict):
+    """Прежний способ: отдельный pg_notify на каждое сообщение"""
+    payload = f'{{"node":"{node_id}","messages":[{encode_part(KIND, data)}]}}'
+    async with pool.acquire() as conn:
+        await conn.execute("SELECT pg_notify($1, $2)", CHANNEL, payload)
+
+async def run_case(name: str, args) -> dict:
+    latencies = []
+    receiver = ClusterBus(backend="postgres", channel=CHANNEL)
+    receiver.subscribe(KIND, lambda data: latencies.append(time.perf_counter() - data["sent_at"]))
+    sender = ClusterBus(backend="postgres", channel=CHANNEL, flush_ms=args.flush_ms)
+    await receiver.start()
+    await sender.start()
+    
+    interval = 1 / args.rate if args.rate > 0 else 0
+    pending = []
+    started = time.perf_counter()
+    
+    for index in range(args.messages):
+        if name == "naive":
+            pending.append(asyncio.create_task(naive_publish(db_manager.pool, sender.node_id, make_message(index))))
+        else:
+            sender.publish(KIND, make_message(index))
+        if interval:
+            # Темп по расписанию: неточность sleep не накапливается
+            delay = started + (index + 1) * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif index % 100 == 99:
+            # Отправитель уступает циклу, как обработчики запросов между публикациями
+            await asyncio.sleep(0)
+            
+    await asyncio.gather(*pending)
+    deadline = time.perf_counter() + 60
+    while len(latencies) < args.messages and time.perf_counter() < deadline:
+        await asyncio.sleep(0.005)
+    total = time.perf_counter() - started
+    
+    payloads = sender.payloads_sent if name == "batched" else args.messages
+    await sender.close()
+    await receiver.close()
+    return {
+        "total": total,
+        "throughput": len(latencies) / total,
+        "payloads": payloads,
+        "p50": percentile(latencies, 0.5) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "received": len(latencies)
+    }
+
+async def run(args):
+    db_manager.pool = await asyncpg.create_pool(settings.DATABASE_URL, min_size=2, max_size=10)
+    print(f"сообщений: {args.messages}, темп: {args.rate or 'без пауз'}/с, тик шины: {args.flush_ms} мс")
+    print(f"{'mode':>8} | {'total, s':>8} | {'msgs/s':>9} | {'NOTIFY':>7} | {'p50, ms':>8} | "
+          f"{'p99, ms':>8} | {'received':>8}")
+    print("-" * 76)
+    
+    try:
+        for name in ("naive", "batched"):
+            result = await run_case(name, args)
+            print(f"{name:>8} | {result['total']:8.2f} | {result['throughput']:9.0f} | "
+                  f"{result['payloads']:>7} | {result['p50']:8.1f} | {result['p99']:8.1f} | "
+                  f"{result['received']:>8}")
+    finally:
+        await db_manager.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк шины между воркерами")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--rate", type=float, default=0, help="сообщений в секунду (0 - без пауз)")
+    parser.add_argument("--flush-ms", type=int, default=settings.CLUSTER_BUS_FLUSH_MS)
+    args = parser.parse_args()
+    
+    asyncio.run(run(args))
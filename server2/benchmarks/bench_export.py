@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк потоковой выгрузки: строк в секунду и пик памяти
+Запуск: DATABASE_URL=... python -m benchmarks.bench_export [--rows 1000000] [--format ndjson]
+
+Работает в отдельной временной схеме, рабочие таблицы не затрагиваются.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import tracemalloc
+import asyncpg
+from config.settings import settings
+from models.database import db_manager
+from models.migrations import migration_runner
+from services.export_service import export_service
+
+SCHEMA = f"bench_export_{os.getpid()}"
+
+async def seed_transactions(conn, rows: int):
+    """rows транзакций от 10 000 пользователей за последний год"""
+    await conn.execute("""
+        INSERT INTO transactions (
+            user_id, type, gift_title, gift_slug, gift_value, stars_paid,
+            status, telegram_message_id, notes, created_at
+        )
+        SELECT 1000 + g % 10000,
+               CASE WHEN g % 3 = 0 THEN 'withdrawal' ELSE 'deposit' END,
+               'Gift ' || (g % 50), 'gift-' || (g % 50), 100, 100,
+               'completed', g, 'bench row ' || g,
+               NOW() - (g % 525600) * INTERVAL '1 minute'
+        FROM generate_series(1, $1) AS g
+    """, rows)
+    await conn.execute("ANALYZE transactions")
+
+async def run(rows: int, export_format: str):
+    admin = await asyncpg.connect(settings.DATABASE_URL)
+    await admin.execute(f"CREATE SCHEMA {SCHEMA}")
+    try:
+        db_manager.pool = await asyncpg.create_pool(
+            settings.DATABASE_URL,
+            server_settings={"search_path": SCHEMA}
+        )
+        await migration_runner.migrate(db_manager.pool)
+        await migration_runner.apply_concurrent(db_manager.pool)
+        
+        async with db_manager.pool.acquire() as conn:
+            await seed_transactions(conn, rows)
+        
+        # Проход 1: пропускная способность (без трассировки памяти)
+        started = time.perf_counter()
+        exported_bytes = 0
+        chunks = 0
+        
+        async for chunk in export_service.stream("transactions", export_format):
+            exported_bytes += len(chunk)
+            chunks += 1
+        
+        elapsed = time.perf_counter() - started
+        
+        # Проход 2: пик памяти Python-кучи (tracemalloc заметно замедляет)
+        tracemalloc.start()
+        async for chunk in export_service.stream("transactions", export_format):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        
+        print(f"format:       {export_format}")
+        print(f"rows:         {rows}")
+        print(f"chunks:       {chunks}")
+        print(f"output:       {exported_bytes / 1024 / 1024:.1f} MiB")
+        print(f"elapsed:      {elapsed:.2f} s")
+        print(f"throughput:   {rows / elapsed:,.0f} rows/s")
+        print(f"peak memory:  {peak / 1024 / 1024:.1f} MiB (Python heap)")
+        
+        await db_manager.pool.close()
+    finally:
+        await admin.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+        await admin.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк выгрузки транзакций")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    args = parser.parse_args()
+    
+    asyncio.run(run(args.rows, args.format))
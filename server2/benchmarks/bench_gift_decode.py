@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк разбора входящих подарков: прежний путь (filters.service, str(message.service),
+json.loads(str(message.gift))) vs gift_filter + decode_gift
+Запуск: python -m benchmarks.bench_gift_decode [--messages 20000] [--gift-share 0.05] [--service-share 0.2]
+
+Корпус синтетический: текстовые сообщения, прочие служебные и подарки. Подарок собран
+из объектов pyrogram.types.Object с полями types.Gift, поэтому str() стоит столько же,
+сколько у настоящего объекта. raw-действие имитируется классами с полями
+MessageActionStarGiftUnique/StarGiftUnique (конструкторы raw-типов меняются от слоя к слою).
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+from enum import Enum
+from pyrogram import filters, types
+from utils import gift_updates
+from utils.gift_updates import decode_gift, gift_filter
+
+class ServiceType(Enum):
+    """Значения message.service, как в enums.MessageServiceType"""
+    GIFT = 1
+    PINNED_MESSAGE = 2
+    NEW_CHAT_MEMBERS = 3
+    
+    def __str__(self) -> str:
+        return f"MessageServiceType.{self.name}"
+
+class StubStarGiftUnique:
+    """Поля raw.types.StarGiftUnique, которые читает decode_gift"""
+    
+    __slots__ = ("id", "title", "slug", "num")
+    
+    def __init__(self, id: int, title: str, slug: str, num: int):
+        self.id = id
+        self.title = title
+        self.slug = slug
+        self.num = num
+
+class StubMessageActionStarGiftUnique:
+    """Поля raw.types.MessageActionStarGiftUnique, которые читает decode_gift"""
+    
+    __slots__ = ("gift", "transfer_stars")
+    
+    def __init__(self, gift, transfer_stars: int):
+        self.gift = gift
+        self.transfer_stars = transfer_stars
+
+class Message:
+    """Минимальное подобие types.Message: только поля, которые читают обработчики"""
+    
+    def __init__(self, id: int, service=None, gift=None, raw_message=None, text=None):
+        self.id = id
+        self.service = service
+        self.gift = gift
+        self.raw = raw_message
+        self.text = text
+        self.from_user = types.User(id=1000 + id % 97, first_name="Bench")
+
+def make_gift_object(gift_id: int, slug: str, title: str, num: int, transfer_stars: int):
+    """types.Gift в том виде, в каком его сериализует str(): стикер, атрибуты, даты"""
+    sticker = types.Object()
+    sticker.__dict__.update(
+        file_id="CAACAgIAAxUAAWd" + "x" * 60, file_unique_id="AgADx" + "y" * 10,
+        width=512, height=512, is_animated=True, is_video=False, emoji="🎁",
+        set_name="GiftsCollection", mime_type="application/x-tgsticker",
+        file_size=34567, date=datetime(2025, 1, 1), thumbs=[]
+    )
+    attributes = []
+    for kind, name in (("model", "Model"), ("backdrop", "Backdrop"), ("symbol", "Symbol")):
+        attribute = types.Object()
+        attribute.__dict__.update(name=f"{name} {num % 50}", rarity=num % 1000, type=kind)
+        attributes.append(attribute)
+        
+    gift = types.Object()
+    gift.__dict__.update(
+        id=gift_id, sticker=sticker, date=datetime(2025, 6, 1), name=slug, title=title,
+        collectible_id=num, attributes=attributes, transfer_price=transfer_stars,
+        is_upgraded=True, is_transferred=True, message_id=num, upgrade_message_id=num
+    )
+    return gift
+
+def build_corpus(size: int, gift_share: float, service_share: float, seed: int):
+    """Сообщения в случайном порядке: подарки, прочие служебные, текст"""
+    rng = random.Random(seed)
+    corpus = []
+    for index in range(size):
+        roll = rng.random()
+        if roll < gift_share:
+            num = rng.randint(1, 100000)
+            slug, title, price = f"PlushPepe-{num}", "Plush Pepe", rng.randint(25, 5000)
+            corpus.append(Message(
+                index, ServiceType.GIFT,
+                gift=make_gift_object(5000 + num, slug, title, num, price),
+                raw_message=types.Object(),
+            ))
+            corpus[-1].raw.action = StubMessageActionStarGiftUnique(
+                StubStarGiftUnique(5000 + num, title, slug, num), price
+            )
+        elif roll < gift_share + service_share:
+            corpus.append(Message(index, rng.choice((ServiceType.PINNED_MESSAGE, ServiceType.NEW_CHAT_MEMBERS))))
+        else:
+            corpus.append(Message(index, text="привет " * rng.randint(1, 20)))
+    return corpus
+
+async def legacy_pass(corpus) -> tuple:
+    """Прежний обработчик: фильтр filters.service, проверка по строке, JSON туда и обратно"""
+    handled = decoded = 0
+    for message in corpus:
+        if not await filters.service(None, message):
+            continue
+        handled += 1
+        if (hasattr(message, 'service') and message.service and
+                str(message.service) == "MessageServiceType.GIFT" and
+                hasattr(message, 'gift') and message.gift):
+            gift_data = json.loads(str(message.gift))
+            if gift_data.get("name") and gift_data.get("transfer_price"):
+                decoded += 1
+    return handled, decoded
+
+async def fast_pass(corpus) -> tuple:
+    """Новый обработчик: gift_filter до запуска, decode_gift из raw-сообщения"""
+    handled = decoded = 0
+    for message in corpus:
+        if not await gift_filter(None, message):
+            continue
+        handled += 1
+        gift = decode_gift(message)
+        if gift and gift.slug and gift.transfer_price:
+            decoded += 1
+    return handled, decoded
+
+async def measure(name: str, run_pass, corpus, repeats: int) -> dict:
+    """Лучшее время из repeats прогонов по корпусу"""
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        handled, decoded = await run_pass(corpus)
+        best = min(best, time.perf_counter() - started)
+    return {"name": name, "seconds": best, "handled": handled, "decoded": decoded}
+
+async def run(args):
+    corpus = build_corpus(args.messages, args.gift_share, args.service_share, args.seed)
+    gifts = [message for message in corpus if message.service is ServiceType.GIFT]
+    
+    # decode_gift должен узнавать имитацию raw-действия
+    gift_updates.GIFT_ACTIONS += (StubMessageActionStarGiftUnique,)
+    
+    print(f"сообщений: {len(corpus)}, подарков: {len(gifts)}, повторов: {args.repeats}")
+    print(f"{'path':>8} | {'ns/msg':>8} | {'us/gift':>8} | {'handler calls':>13} | {'gifts':>6}")
+    print("-" * 56)
+    
+    for name, run_pass in (("legacy", legacy_pass), ("fast", fast_pass)):
+        result = await measure(name, run_pass, corpus, args.repeats)
+        gift_only = await measure(name, run_pass, gifts, args.repeats)
+        print(f"{name:>8} | {result['seconds'] / len(corpus) * 1e9:8.0f} | "
+              f"{gift_only['seconds'] / max(len(gifts), 1) * 1e6:8.2f} | "
+              f"{result['handled']:>13} | {result['decoded']:>6}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора подарков")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--gift-share", type=float, default=0.05)
+    parser.add_argument("--service-share", type=float, default=0.2,
+                        help="доля прочих служебных сообщений (закрепления, вступления)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    
+    asyncio.run(run(args))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк расчета ставок: построчный цикл vs set-based движок
+Запуск: DATABASE_URL=... python -m benchmarks.bench_settlement [--sizes 1000 10000 100000]
+
+Работает в отдельной временной схеме, рабочие таблицы не затрагиваются.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import asyncpg
+from config.settings import settings
+from models.database import db_manager
+from models.migrations import migration_runner
+from services.settlement_service import settlement_service
+
+SCHEMA = f"bench_settlement_{os.getpid()}"
+
+async def seed_event(conn, bets_count: int) -> int:
+    """Событие с bets_count ставками от ~bets_count/5 пользователей"""
+    event_id = await conn.fetchval("""
+        INSERT INTO events (title, outcomes, coefficients, status, end_time)
+        VALUES ('bench', '["A", "B"]', '[1.9, 1.9]', 'active', NOW() + INTERVAL '1 hour')
+        RETURNING id
+    """)
+    await conn.execute("""
+        INSERT INTO bets (
+            user_id, event_id, outcome, outcome_index, gift_ids,
+            total_value, coefficient, potential_payout
+        )
+        SELECT 1000 + (g % GREATEST($2 / 5, 1)), $1,
+               CASE WHEN g % 2 = 0 THEN 'A' ELSE 'B' END, g % 2,
+               '[]', 100, 1.9, 190
+        FROM generate_series(1, $2) AS g
+    """, event_id, bets_count)
+    await conn.execute("ANALYZE bets")
+    return event_id
+
+async def legacy_settle(conn, event_id: int, winner_index: int) -> dict:
+    """Прежняя реализация: UPDATE на каждую ставку в одной транзакции"""
+    async with conn.transaction():
+        await conn.execute("""
+            UPDATE events SET status = 'finished', winner_index = $1,
+                   result_outcome = 'A', updated_at = NOW()
+            WHERE id = $2
+        """, winner_index, event_id)
+        
+        all_bets = await conn.fetch("""
+            SELECT id, user_id, outcome_index, total_value, potential_payout
+            FROM bets WHERE event_id = $1 AND status = 'pending'
+        """, event_id)
+        
+        winners_count = losers_count = total_payouts = 0
+        for bet in all_bets:
+            if bet['outcome_index'] == winner_index:
+                await conn.execute("""
+                    UPDATE bets SET status = 'won', actual_payout = potential_payout,
+                           updated_at = NOW()
+                    WHERE id = $1
+                """, bet['id'])
+                winners_count += 1
+                total_payouts += bet['potential_payout']
+            else:
+                await conn.execute("""
+                    UPDATE bets SET status = 'lost', actual_payout = 0, updated_at = NOW()
+                    WHERE id = $1
+                """, bet['id'])
+                losers_count += 1
+                
+    return {"winners_count": winners_count, "losers_count": losers_count,
+            "total_payouts": total_payouts}
+
+async def run(sizes, chunk_size: int, skip_legacy_above: int):
+    admin = await asyncpg.connect(settings.DATABASE_URL)
+    await admin.execute(f"CREATE SCHEMA {SCHEMA}")
+    try:
+        db_manager.pool = await asyncpg.create_pool(
+            settings.DATABASE_URL,
+            server_settings={"search_path": SCHEMA}
+        )
+        await migration_runner.migrate(db_manager.pool)
+            
+        print(f"{'bets':>8} | {'legacy, s':>10} | {'set-based, s':>12} | "
+              f"{'chunked, s':>10} | {'speedup':>7}")
+        print("-" * 62)
+        
+        for size in sizes:
+            async with db_manager.pool.acquire() as conn:
+                legacy_time = None
+                if size <= skip_legacy_above:
+                    event_id = await seed_event(conn, size)
+                    started = time.perf_counter()
+                    legacy = await legacy_settle(conn, event_id, 0)
+                    legacy_time = time.perf_counter() - started
+                    
+                event_id = await seed_event(conn, size)
+                
+            started = time.perf_counter()
+            bulk = await settlement_service.settle_event(event_id, 0, "A", chunk_size=0)
+            bulk_time = time.perf_counter() - started
+            
+            async with db_manager.pool.acquire() as conn:
+                event_id = await seed_event(conn, size)
+                
+            started = time.perf_counter()
+            chunked = await settlement_service.settle_event(
+                event_id, 0, "A", chunk_size=chunk_size
+            )
+            chunked_time = time.perf_counter() - started
+            
+            assert bulk == chunked, (bulk, chunked)
+            if legacy_time is not None:
+                assert legacy == bulk, (legacy, bulk)
+                
+            legacy_cell = f"{legacy_time:10.3f}" if legacy_time is not None else f"{'skipped':>10}"
+            speedup = f"{legacy_time / bulk_time:6.1f}x" if legacy_time else f"{'-':>7}"
+            print(f"{size:>8} | {legacy_cell} | {bulk_time:12.3f} | "
+                  f"{chunked_time:10.3f} | {speedup}")
+                  
+        await db_manager.pool.close()
+    finally:
+        await admin.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+        await admin.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк расчета ставок")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--chunk-size", type=int, default=settings.SETTLEMENT_CHUNK_SIZE)
+    parser.add_argument("--skip-legacy-above", type=int, default=100000,
+                        help="Не запускать построчный цикл для больших событий")
+    args = parser.parse_args()
+    
+    asyncio.run(run(args.sizes, args.chunk_size, args.skip_legacy_above))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пула выводов на локальном фейковом бэкенде передачи
+Запуск: DATABASE_URL=... python -m benchmarks.bench_withdrawals [--count 500] [--workers 1 4 16]
+
+Работает в отдельной временной схеме, рабочие таблицы не затрагиваются.
+Пропускная способность - выводов в секунду от постановки первого до завершения последнего,
+задержка - от created_at до completed_at каждого вывода.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from typing import Dict, List, Optional
+import asyncpg
+from pyrogram.errors import FloodWait
+from config.settings import settings
+from models.database import db_manager
+from models.migrations import migration_runner
+from services.balance_service import balance_service
+from services.gift_service import gift_service
+from services.withdrawal_worker import WithdrawalWorker
+
+SCHEMA = f"bench_withdrawals_{os.getpid()}"
+
+class FakeTransferBackend:
+    """
+    Локальная имитация Telegram для прогонов пула выводов:
+    задержка сети, доля FloodWait и временных ошибок
+    """
+    
+    name = "fake"
+    
+    def __init__(self, latency_ms: float = 200, jitter_ms: float = 0, flood_rate: float = 0,
+                 flood_seconds: int = 1, error_rate: float = 0, seed: int = None):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        
+        # Выполненные передачи (deposit_id) и счетчики исходов
+        self.transferred: List[int] = []
+        self.floods = 0
+        self.errors = 0
+    
+    async def transfer(self, withdrawal: Dict) -> Optional[str]:
+        """Имитация вызова: пауза, затем успех, FloodWait или временная ошибка"""
+        await asyncio.sleep(self.latency + self._random.uniform(0, self.jitter))
+        
+        roll = self._random.random()
+        if roll < self.flood_rate:
+            self.floods += 1
+            raise FloodWait(value=self.flood_seconds)
+        if roll < self.flood_rate + self.error_rate:
+            self.errors += 1
+            raise ConnectionError("Имитация сетевой ошибки")
+            
+        self.transferred.append(withdrawal["deposit_id"])
+        return "[FAKE]"
+
+async def seed_deposits(conn, count: int, owners: int) -> list:
+    """count депозитов, разложенных по owners владельцам"""
+    rows = await conn.fetch("""
+        INSERT INTO deposits (telegram_user_id, title, slug, num, message_id)
+        SELECT 1000 + g % $2, 'bench', 'bench', 100,
+               g + COALESCE((SELECT MAX(message_id) FROM deposits), 0)
+        FROM generate_series(1, $1) AS g
+        RETURNING id, telegram_user_id
+    """, count, owners)
+    await conn.execute("""
+        INSERT INTO user_balances (user_id, total_deposited)
+        SELECT telegram_user_id, SUM(num) FROM deposits GROUP BY telegram_user_id
+        ON CONFLICT (user_id) DO UPDATE SET total_deposited = EXCLUDED.total_deposited
+    """)
+    return rows
+
+def percentile(values: list, share: float) -> float:
+    """Перцентиль отсортированного списка"""
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+async def run_once(args, workers: int) -> dict:
+    """Постановка count выводов и их обработка пулом из workers воркеров"""
+    async with db_manager.pool.acquire() as conn:
+        deposits = await seed_deposits(conn, args.count, args.owners)
+        
+    backend = FakeTransferBackend(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        flood_rate=args.flood_rate, flood_seconds=args.flood_seconds,
+        error_rate=args.error_rate, seed=42
+    )
+    pool = WithdrawalWorker(backend=backend, workers=workers,
+                            global_rate=args.global_rate, recipient_rate=args.recipient_rate)
+    # Временные ошибки бэкенда повторяем быстро, чтобы прогон не ждал минутами
+    settings.WITHDRAWAL_RETRY_BASE_SECONDS = 0.1
+    
+    started = time.perf_counter()
+    pool.start()
+    
+    enqueue_started = time.perf_counter()
+    for index, deposit in enumerate(deposits):
+        result = await gift_service.process_withdrawal(
+            deposit["id"], 5000 + index % args.recipients, deposit["telegram_user_id"]
+        )
+        assert result["success"], result
+        pool.wake()
+    enqueue_time = time.perf_counter() - enqueue_started
+    
+    ids = [deposit["id"] for deposit in deposits]
+    while True:
+        async with db_manager.pool.acquire() as conn:
+            open_count = await conn.fetchval("""
+                SELECT COUNT(*) FROM withdrawals
+                WHERE deposit_id = ANY($1) AND status IN ('pending', 'sending')
+            """, ids)
+        if not open_count:
+            break
+        await asyncio.sleep(0.05)
+        
+    total_time = time.perf_counter() - started
+    await pool.close()
+    
+    async with db_manager.pool.acquire() as conn:
+        latencies = sorted(await conn.fetchval("""
+            SELECT array_agg(EXTRACT(EPOCH FROM completed_at - created_at))
+            FROM withdrawals WHERE deposit_id = ANY($1) AND status = 'completed'
+        """, ids) or [])
+        failed = await conn.fetchval("""
+            SELECT COUNT(*) FROM withdrawals WHERE deposit_id = ANY($1) AND status = 'failed'
+        """, ids)
+        
+    return {
+        "workers": workers,
+        "enqueue_per_s": args.count / enqueue_time,
+        "throughput": len(latencies) / total_time,
+        "p50": percentile(latencies, 0.5) if latencies else 0,
+        "p95": percentile(latencies, 0.95) if latencies else 0,
+        "failed": failed,
+        "floods": backend.floods,
+        "duplicates": len(backend.transferred) - len(set(backend.transferred))
+    }
+
+async def run(args):
+    admin = await asyncpg.connect(settings.DATABASE_URL)
+    await admin.execute(f"CREATE SCHEMA {SCHEMA}")
+    try:
+        db_manager.pool = await asyncpg.create_pool(
+            settings.DATABASE_URL,
+            server_settings={"search_path": SCHEMA}
+        )
+        await migration_runner.migrate(db_manager.pool)
+        
+        print(f"выводов: {args.count}, задержка бэкенда: {args.latency_ms} мс, "
+              f"лимиты: {args.global_rate}/с всего, {args.recipient_rate}/с на получателя")
+        print(f"{'workers':>7} | {'enqueue/s':>9} | {'done/s':>7} | {'p50, s':>7} | "
+              f"{'p95, s':>7} | {'failed':>6} | {'floods':>6} | {'dups':>4}")
+        print("-" * 74)
+        
+        for workers in args.workers:
+            r = await run_once(args, workers)
+            print(f"{r['workers']:>7} | {r['enqueue_per_s']:9.0f} | {r['throughput']:7.1f} | "
+                  f"{r['p50']:7.2f} | {r['p95']:7.2f} | {r['failed']:>6} | "
+                  f"{r['floods']:>6} | {r['duplicates']:>4}")
+                  
+        drift = await balance_service.reconcile()
+        assert drift["drift_count"] == 0, drift
+        
+        await db_manager.pool.close()
+    finally:
+        await admin.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+        await admin.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк пула выводов")
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--owners", type=int, default=50)
+    parser.add_argument("--recipients", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--flood-rate", type=float, default=0.0,
+                        help="Доля вызовов, на которые бэкенд отвечает FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--global-rate", type=float, default=settings.WITHDRAWAL_GLOBAL_RATE)
+    parser.add_argument("--recipient-rate", type=float, default=settings.WITHDRAWAL_RECIPIENT_RATE)
+    args = parser.parse_args()
+    
+    asyncio.run(run(args))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк рассылки WebSocket: стоимость publish и время доставки до всех подписчиков
+Запуск: python -m benchmarks.bench_ws_fanout [--clients 1000 10000] [--messages 300] [--rate 20]
+
+Клиенты локальные: объект с send_text/close, как у starlette WebSocket, в одном процессе
+с хабом - измеряется работа сервера (сериализация, очереди, задачи отправки), без сети.
+Доля --slow-share клиентов "читает" медленно (--slow-ms на сообщение) и должна
+отключаться по переполнению очереди, не задерживая остальных.
+"""
+
+import argparse
+import asyncio
+import time
+from services.ws_hub import TOPIC_EVENTS, WebSocketHub
+
+class LocalWebSocket:
+    """Клиент в процессе: считает полученные сообщения и отмечает доставку"""
+    
+    def __init__(self, tracker: "DeliveryTracker", delay: float = 0):
+        self.tracker = tracker
+        self.delay = delay
+        self.received = 0
+        self.close_code = None
+    
+    async def send_text(self, text: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        # Очередь клиента FIFO: n-е полученное сообщение - n-я публикация
+        self.tracker.delivered(self.received)
+        self.received += 1
+    
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.close_code = code
+
+class DeliveryTracker:
+    """Момент, когда публикацию получили все быстрые клиенты"""
+    
+    def __init__(self, messages: int, clients: int):
+        self.remaining = [clients] * messages
+        self.published_at = [0.0] * messages
+        self.completed_at = [0.0] * messages
+    
+    def delivered(self, index: int):
+        if index >= len(self.remaining):
+            return
+        self.remaining[index] -= 1
+        if self.remaining[index] == 0:
+            self.completed_at[index] = time.perf_counter()
+
+def percentile(values, share: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)] if values else 0.0
+
+async def run_case(clients: int, args) -> dict:
+    hub = WebSocketHub(queue_size=args.queue_size)
+    slow_count = int(clients * args.slow_share)
+    tracker = DeliveryTracker(args.messages, clients - slow_count)
+    
+    sockets = []
+    for index in range(clients):
+        slow = index < slow_count
+        # Медленные клиенты не участвуют в подсчете доставки до "всех"
+        websocket = LocalWebSocket(DeliveryTracker(0, 0) if slow else tracker,
+                                   args.slow_ms / 1000 if slow else 0)
+        connection = hub.connect(websocket)
+        hub.subscribe(connection, TOPIC_EVENTS)
+        sockets.append(websocket)
+        
+    message = {"type": "bank", "event_id": 1, "total_bank": 0, "status": "active"}
+    publish_time = 0.0
+    interval = 1 / args.rate if args.rate > 0 else 0
+    started = time.perf_counter()
+    
+    for index in range(args.messages):
+        message["total_bank"] = index
+        tracker.published_at[index] = time.perf_counter()
+        hub.publish(TOPIC_EVENTS, message)
+        publish_time += time.perf_counter() - tracker.published_at[index]
+        # Между публикациями цикл событий раздает очереди
+        await asyncio.sleep(interval)
+        
+    deadline = time.perf_counter() + 30
+    while tracker.remaining[-1] > 0 and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    total = time.perf_counter() - started
+    
+    latencies = [
+        (done - published) * 1000
+        for published, done in zip(tracker.published_at, tracker.completed_at) if done
+    ]
+    metrics = hub.get_metrics()
+    await hub.close()
+    return {
+        "publish_us": publish_time / args.messages * 1e6,
+        "per_client_ns": publish_time / args.messages / clients * 1e9,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "deliveries": metrics["sent"] / total,
+        "evicted": metrics["evicted"],
+        "slow": slow_count,
+        "complete": len(latencies)
+    }
+
+async def run(args):
+    print(f"сообщений: {args.messages}, темп: {args.rate}/с, очередь клиента: {args.queue_size}, "
+          f"медленных: {args.slow_share:.0%} ({args.slow_ms} мс на сообщение)")
+    print(f"{'clients':>8} | {'publish, us':>11} | {'ns/client':>9} | {'p50, ms':>8} | "
+          f"{'p99, ms':>8} | {'msgs/s':>9} | {'evicted':>10} | {'complete':>8}")
+    print("-" * 92)
+    
+    for clients in args.clients:
+        result = await run_case(clients, args)
+        print(f"{clients:>8} | {result['publish_us']:11.0f} | {result['per_client_ns']:9.0f} | "
+              f"{result['p50']:8.1f} | {result['p99']:8.1f} | {result['deliveries']:9.0f} | "
+              f"{result['evicted']:>4}/{result['slow']:<5} | {result['complete']:>8}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк рассылки WebSocket")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=20, help="публикаций в секунду (0 - без пауз)")
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument("--slow-share", type=float, default=0.01)
+    parser.add_argument("--slow-ms", type=float, default=1000)
+    args = parser.parse_args()
+    
+    asyncio.run(run(args))
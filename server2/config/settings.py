@@ -10,6 +10,10 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Значения-заглушки из примеров конфигурации: с ними секрет считается не заданным
+PLACEHOLDER_JWT_SECRETS = {"your-secret-key", "your-random-jwt-secret-key", "random-secret-key"}
+PLACEHOLDER_ADMIN_PASSWORDS = {"admin123", "your-admin-password"}
+
 class Settings:
     """Настройки приложения"""
     
@@ -21,16 +25,75 @@ class Settings:
     # База данных
     DATABASE_URL: str = os.getenv("DATABASE_URL", "")
     
+    # Миграции схемы при старте (false - только python -m models.migrations)
+    DB_AUTO_MIGRATE: bool = os.getenv("DB_AUTO_MIGRATE", "true").lower() == "true"
+    
+    # Отдельное LISTEN-соединение: проверка раз в N секунд, первая пауза переподключения
+    # (удваивается до 30 секунд)
+    DB_LISTEN_PING_INTERVAL: float = float(os.getenv("DB_LISTEN_PING_INTERVAL", "15"))
+    DB_LISTEN_RECONNECT_DELAY: float = float(os.getenv("DB_LISTEN_RECONNECT_DELAY", "1"))
+    
+    # Месячные партиции transactions/bets и архивирование старых партиций
+    PARTITION_MONTHS_AHEAD: int = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+    PARTITION_RETENTION_MONTHS: int = int(os.getenv("PARTITION_RETENTION_MONTHS", "12"))
+    PARTITION_MAINTENANCE_INTERVAL: int = int(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "86400"))  # секунды
+    ARCHIVE_AUTO: bool = os.getenv("ARCHIVE_AUTO", "false").lower() == "true"
+    ARCHIVE_SCHEMA: str = os.getenv("ARCHIVE_SCHEMA", "archive")
+    ARCHIVE_TABLESPACE: str = os.getenv("ARCHIVE_TABLESPACE", "")
+    
     # Telegram API
     API_ID: int = int(os.getenv("API_ID", "0"))
     API_HASH: str = os.getenv("API_HASH", "")
     BOT_TOKEN: str = os.getenv("BOT_TOKEN", "")
     PYROGRAM_SESSION_STRING: str = os.getenv("PYROGRAM_SESSION_STRING", "")
+    # Дополнительные сессии Pyrogram через запятую (только исходящие вызовы, без обновлений),
+    # обработчики обновлений основной сессии, одновременные загрузки/выгрузки файлов на сессию
+    PYROGRAM_EXTRA_SESSION_STRINGS: list = [
+        session.strip() for session in os.getenv("PYROGRAM_EXTRA_SESSION_STRINGS", "").split(",")
+        if session.strip()
+    ]
+    PYROGRAM_WORKERS: int = int(os.getenv("PYROGRAM_WORKERS", "4"))
+    PYROGRAM_MAX_TRANSMISSIONS: int = int(os.getenv("PYROGRAM_MAX_TRANSMISSIONS", "1"))
+    
+    # Клиент Bot API: адрес (можно направить на локальный мок), таймауты (секунды),
+    # повторы временных ошибок, одновременные запросы/соединения, HTTP/2 (нужен пакет h2)
+    BOT_API_URL: str = os.getenv("BOT_API_URL", "https://api.telegram.org")
+    BOT_API_TIMEOUT: float = float(os.getenv("BOT_API_TIMEOUT", "10"))
+    BOT_API_CONNECT_TIMEOUT: float = float(os.getenv("BOT_API_CONNECT_TIMEOUT", "5"))
+    BOT_API_RETRIES: int = int(os.getenv("BOT_API_RETRIES", "2"))
+    BOT_API_CONCURRENCY: int = int(os.getenv("BOT_API_CONCURRENCY", "20"))
+    BOT_API_KEEPALIVE_EXPIRY: float = float(os.getenv("BOT_API_KEEPALIVE_EXPIRY", "60"))
+    BOT_API_HTTP2: bool = os.getenv("BOT_API_HTTP2", "true").lower() == "true"
+    
+    # Invoice на оплату вывода: срок повторного использования ссылки (секунды) и размер кэша
+    INVOICE_TTL: int = int(os.getenv("INVOICE_TTL", "900"))
+    INVOICE_CACHE_SIZE: int = int(os.getenv("INVOICE_CACHE_SIZE", "10000"))
+    
+    # Webhook Bot API: публичный URL (пусто - не регистрировать), секрет заголовка,
+    # очередь обновлений, пул обработчиков, окно дедупликации update_id, соединений от Telegram
+    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_QUEUE_SIZE: int = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+    WEBHOOK_WORKERS: int = int(os.getenv("WEBHOOK_WORKERS", "4"))
+    WEBHOOK_DEDUP_SIZE: int = int(os.getenv("WEBHOOK_DEDUP_SIZE", "10000"))
+    WEBHOOK_MAX_CONNECTIONS: int = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    
+    # WebSocket /ws: очередь исходящих сообщений клиента (переполнена - клиент отключается),
+    # подписок на соединение
+    WS_SEND_QUEUE_SIZE: int = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+    WS_MAX_SUBSCRIPTIONS: int = int(os.getenv("WS_MAX_SUBSCRIPTIONS", "100"))
     
     # JWT и безопасность
-    JWT_SECRET: str = os.getenv("JWT_SECRET", "your-secret-key")
+    # JWT_SECRET обязателен: без него приложение не стартует, токены не выдаются и не принимаются
+    JWT_SECRET: str = os.getenv("JWT_SECRET", "")
+    # Срок жизни токена сессии и максимальный возраст initData, секунды;
+    # AUTH_REQUIRED=true - запросы от имени пользователя без токена отклоняются
+    JWT_TTL: int = int(os.getenv("JWT_TTL", "3600"))
+    INIT_DATA_MAX_AGE: int = int(os.getenv("INIT_DATA_MAX_AGE", "86400"))
+    AUTH_REQUIRED: bool = os.getenv("AUTH_REQUIRED", "false").lower() == "true"
     ADMIN_JWT_SECRET: str = os.getenv("ADMIN_JWT_SECRET", "admin-secret")
-    ADMIN_PASSWORD: str = os.getenv("ADMIN_PASSWORD", "admin123")
+    # Без ADMIN_PASSWORD (или с паролем из примера) админские endpoints отвечают 503
+    ADMIN_PASSWORD: str = os.getenv("ADMIN_PASSWORD", "")
     
     # CORS
     FRONTEND_URL: str = os.getenv("FRONTEND_URL", "http://localhost:3000")
@@ -41,10 +104,79 @@ class Settings:
         "http://localhost:3001"
     ]
     
+    # Пагинация списков
+    DEFAULT_PAGE_SIZE: int = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+    MAX_PAGE_SIZE: int = int(os.getenv("MAX_PAGE_SIZE", "200"))
+    
+    # Выгрузка данных: строк на чанк ответа и на fetch серверного курсора
+    EXPORT_CHUNK_ROWS: int = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+    EXPORT_PREFETCH: int = int(os.getenv("EXPORT_PREFETCH", "2000"))
+    
     # Rate Limiting
     WITHDRAWAL_RATE_LIMIT: int = int(os.getenv("WITHDRAWAL_RATE_LIMIT", "10"))
     RATE_LIMIT_PERIOD: int = int(os.getenv("RATE_LIMIT_PERIOD", "300"))  # 5 минут
     
+    # Пул выводов: воркеры, лимиты Telegram (передач в секунду всего и на получателя),
+    # аренда и ретраи (секунды), бэкенд передачи: simulated
+    WITHDRAWAL_WORKERS: int = int(os.getenv("WITHDRAWAL_WORKERS", "4"))
+    WITHDRAWAL_GLOBAL_RATE: float = float(os.getenv("WITHDRAWAL_GLOBAL_RATE", "20"))
+    WITHDRAWAL_RECIPIENT_RATE: float = float(os.getenv("WITHDRAWAL_RECIPIENT_RATE", "1"))
+    WITHDRAWAL_POLL_INTERVAL: float = float(os.getenv("WITHDRAWAL_POLL_INTERVAL", "5"))
+    WITHDRAWAL_LEASE_SECONDS: int = int(os.getenv("WITHDRAWAL_LEASE_SECONDS", "300"))
+    WITHDRAWAL_MAX_ATTEMPTS: int = int(os.getenv("WITHDRAWAL_MAX_ATTEMPTS", "5"))
+    WITHDRAWAL_RETRY_BASE_SECONDS: float = float(os.getenv("WITHDRAWAL_RETRY_BASE_SECONDS", "10"))
+    WITHDRAWAL_RETRY_MAX_SECONDS: float = float(os.getenv("WITHDRAWAL_RETRY_MAX_SECONDS", "900"))
+    WITHDRAWAL_BACKEND: str = os.getenv("WITHDRAWAL_BACKEND", "simulated")
+    
+    # Пакетный прием депозитов: размер очереди (backpressure), пачка, тик и повторы записи
+    DEPOSIT_QUEUE_SIZE: int = int(os.getenv("DEPOSIT_QUEUE_SIZE", "1000"))
+    DEPOSIT_BATCH_MAX_SIZE: int = int(os.getenv("DEPOSIT_BATCH_MAX_SIZE", "100"))
+    DEPOSIT_BATCH_TICK_MS: int = int(os.getenv("DEPOSIT_BATCH_TICK_MS", "20"))
+    DEPOSIT_WRITE_RETRIES: int = int(os.getenv("DEPOSIT_WRITE_RETRIES", "3"))
+    
+    # Outbox уведомлений: пачка, сообщений в доставке одновременно, опрос и ретраи (секунды)
+    OUTBOX_BATCH_SIZE: int = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+    OUTBOX_CONCURRENCY: int = int(os.getenv("OUTBOX_CONCURRENCY", "200"))
+    OUTBOX_POLL_INTERVAL: float = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+    OUTBOX_LEASE_SECONDS: int = int(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+    OUTBOX_RETRY_BASE_SECONDS: float = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "5"))
+    OUTBOX_RETRY_MAX_SECONDS: float = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "600"))
+    
+    # Планировщик сообщений Telegram: лимиты (сообщений в секунду) и параллельность отправки
+    MESSAGE_GLOBAL_RATE: float = float(os.getenv("MESSAGE_GLOBAL_RATE", "25"))
+    MESSAGE_CHAT_RATE: float = float(os.getenv("MESSAGE_CHAT_RATE", "1"))
+    MESSAGE_SEND_CONCURRENCY: int = int(os.getenv("MESSAGE_SEND_CONCURRENCY", "8"))
+    # Уведомления о результатах ставок при расчете события
+    BET_RESULT_NOTIFICATIONS: bool = os.getenv("BET_RESULT_NOTIFICATIONS", "true").lower() == "true"
+    
+    # Прием ставок: пачка на событие за одну транзакцию
+    BET_BATCH_MAX_SIZE: int = int(os.getenv("BET_BATCH_MAX_SIZE", "200"))
+    BET_BATCH_TICK_MS: int = int(os.getenv("BET_BATCH_TICK_MS", "5"))
+    BET_WORKER_IDLE_TIMEOUT: float = float(os.getenv("BET_WORKER_IDLE_TIMEOUT", "30"))
+    
+    # Кэш ленты активных событий: максимальный возраст снимка, секунды
+    EVENTS_CACHE_TTL: float = float(os.getenv("EVENTS_CACHE_TTL", "10"))
+    # Зеркало счетчиков событий в памяти: сколько событий держать (LRU)
+    EVENT_STATS_CACHE_SIZE: int = int(os.getenv("EVENT_STATS_CACHE_SIZE", "1000"))
+    # Дельты банков и счетчиков событий по WebSocket: изменения за тик склеиваются в одно сообщение
+    EVENT_DELTA_TICK_MS: int = int(os.getenv("EVENT_DELTA_TICK_MS", "100"))
+    
+    # Кэш аватаров: записей в памяти, срок жизни file_id (секунды), параллельных запросов к Bot API,
+    # пользователей в одном запросе /api/betting/avatars
+    AVATAR_CACHE_SIZE: int = int(os.getenv("AVATAR_CACHE_SIZE", "10000"))
+    AVATAR_CACHE_TTL: float = float(os.getenv("AVATAR_CACHE_TTL", "86400"))
+    AVATAR_FETCH_CONCURRENCY: int = int(os.getenv("AVATAR_FETCH_CONCURRENCY", "10"))
+    AVATAR_BATCH_MAX_IDS: int = int(os.getenv("AVATAR_BATCH_MAX_IDS", "50"))
+    
+    # Лидерборд: размер топа в памяти, возраст снимка (секунды), хранение дневных/недельных окон (дни)
+    LEADERBOARD_TOP_K: int = int(os.getenv("LEADERBOARD_TOP_K", "100"))
+    LEADERBOARD_CACHE_TTL: float = float(os.getenv("LEADERBOARD_CACHE_TTL", "60"))
+    LEADERBOARD_KEEP_DAYS: int = int(os.getenv("LEADERBOARD_KEEP_DAYS", "14"))
+    
+    # Расчет ставок: размер пачки на одну транзакцию (0 - все событие за раз)
+    SETTLEMENT_CHUNK_SIZE: int = int(os.getenv("SETTLEMENT_CHUNK_SIZE", "5000"))
+    
     # Цены подарков
     PRICE_UPDATE_INTERVAL: int = int(os.getenv("PRICE_UPDATE_INTERVAL", "30"))  # минуты
     PORTAL_API_URL: str = os.getenv("PORTAL_API_URL", "")
@@ -53,6 +185,14 @@ class Settings:
     # Redis (опционально)
     REDIS_URL: Optional[str] = os.getenv("REDIS_URL")
     
+    # Шина между воркерами: postgres - LISTEN/NOTIFY, redis - pub/sub через REDIS_URL,
+    # off - один процесс. Сообщения за тик (мс) уходят пачкой; переполнение буфера -
+    # остальные воркеры сбрасывают кэши
+    CLUSTER_BUS_BACKEND: str = os.getenv("CLUSTER_BUS_BACKEND", "postgres").lower()
+    CLUSTER_BUS_CHANNEL: str = os.getenv("CLUSTER_BUS_CHANNEL", "gift_zona_bus")
+    CLUSTER_BUS_FLUSH_MS: int = int(os.getenv("CLUSTER_BUS_FLUSH_MS", "5"))
+    CLUSTER_BUS_QUEUE_SIZE: int = int(os.getenv("CLUSTER_BUS_QUEUE_SIZE", "10000"))
+    
     # Логирование
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     
@@ -77,7 +217,22 @@ class Settings:
             print(f"❌ Отсутствуют обязательные настройки: {', '.join(missing)}")
             return False
             
+        if not self.jwt_secret_configured():
+            print("❌ JWT_SECRET не задан или взят из примера: токены сессий можно подделать")
+            return False
+            
+        if not self.admin_password_configured():
+            print("⚠️ ADMIN_PASSWORD не задан или взят из примера: админские endpoints отключены")
+            
         return True
+    
+    def jwt_secret_configured(self) -> bool:
+        """Секрет токенов задан и не совпадает с примером"""
+        return bool(self.JWT_SECRET) and self.JWT_SECRET not in PLACEHOLDER_JWT_SECRETS
+    
+    def admin_password_configured(self) -> bool:
+        """Пароль администратора задан и не совпадает с примером"""
+        return bool(self.ADMIN_PASSWORD) and self.ADMIN_PASSWORD not in PLACEHOLDER_ADMIN_PASSWORDS
 
 # Глобальный экземпляр настроек
 settings = Settings()
@@ -10,7 +10,7 @@ import signal
 import logging
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
@@ -20,18 +20,34 @@ from models.database import db_manager
 
 # Сервисы
 from services.gift_service import gift_service
+from services.cluster_bus import (CACHE_EVENTS, CACHE_EVENT_FEED, CACHE_EVENT_STATS, CACHE_LEADERBOARD,
+                                  KIND_EVENT_FIELDS, KIND_EVENT_STATE, KIND_WS, cluster_bus)
 from services.betting_service import betting_service
+from services.deposit_ingestor import deposit_ingestor
+from services.event_feed import event_feed
+from services.event_stats_service import event_stats_service
+from services.leaderboard_service import leaderboard_service
+from services.invoice_service import invoice_service
+from services.message_scheduler import message_scheduler
+from services.outbox_dispatcher import outbox_dispatcher
+from services.update_dispatcher import update_dispatcher
+from services.withdrawal_worker import withdrawal_worker
+from services.ws_hub import ws_hub
 
 # API роутеры
 from api.deposits import router as deposits_router
 from api.betting import router as betting_router
+from api.admin import router as admin_router
+from api.webhook import router as webhook_router
+from api.ws import router as ws_router
 
 # Утилиты
-from utils.telegram import validate_telegram_init_data
+from utils.auth import create_access_token, profile_hash
+from utils.gift_updates import decode_gift, gift_filter
+from utils.bot_api import bot_api
+from utils.telegram import set_webhook, validate_telegram_init_data
+from utils.telegram_pool import telegram_pool
 
-# Telegram клиент (из оригинального main.py)
-from pyrogram import Client, filters
-import json
 import time
 
 # Настройка логирования
@@ -46,7 +62,6 @@ logging.getLogger("pyrogram.session.session").setLevel(logging.ERROR)
 logging.getLogger("pyrogram.connection.connection").setLevel(logging.ERROR)
 
 # Глобальные переменные
-telegram_client = None
 telegram_client_available = False
 shutdown_requested = False
 
@@ -73,13 +88,45 @@ async def lifespan(app: FastAPI):
     print("[STARTUP] 📊 Инициализация базы данных...")
     await db_manager.initialize()
     
+    # Шина между воркерами: рассылки WebSocket, состояние событий, сброс кэшей
+    cluster_bus.subscribe(KIND_WS, ws_hub.publish_remote)
+    cluster_bus.subscribe(KIND_EVENT_STATE, betting_service.apply_event_state)
+    cluster_bus.subscribe(KIND_EVENT_FIELDS, event_feed.update_remote)
+    cluster_bus.register_cache(CACHE_EVENTS, betting_service.events_cache.invalidate)
+    cluster_bus.register_cache(CACHE_EVENT_STATS, event_stats_service.invalidate)
+    cluster_bus.register_cache(CACHE_EVENT_FEED, event_feed.invalidate)
+    cluster_bus.register_cache(CACHE_LEADERBOARD, leaderboard_service.invalidate)
+    await cluster_bus.start()
+    
+    # Общий пул соединений к Bot API
+    await bot_api.start()
+    
     # Инициализация Telegram клиента
     print("[STARTUP] 📱 Инициализация Telegram клиента...")
     await init_telegram_client()
     
     # Инициализация сервисов
     print("[STARTUP] 🛠️ Инициализация сервисов...")
-    gift_service.telegram_client = telegram_client
+    gift_service.telegram_client = telegram_pool.primary
+    
+    # Доставка уведомлений из outbox через планировщик сообщений
+    message_scheduler.start(send_chat_message)
+    outbox_dispatcher.start(send_outbox_message)
+    
+    # Пакетная запись депозитов из обработчика Telegram
+    deposit_ingestor.start()
+    
+    # Склейка дельт банков и счетчиков событий для WebSocket
+    event_feed.start()
+    
+    # Передача выведенных подарков
+    withdrawal_worker.start()
+    
+    # Обновления Bot API из webhook: оплата invoice
+    update_dispatcher.register("pre_checkout_query", invoice_service.handle_pre_checkout)
+    update_dispatcher.register("message", invoice_service.handle_payment_message)
+    update_dispatcher.start()
+    await init_webhook()
     
     print(f"[STARTUP] ✅ {settings.APP_NAME} успешно запущен!")
     
@@ -88,87 +135,102 @@ async def lifespan(app: FastAPI):
     # Shutdown
     print("[SHUTDOWN] 🛑 Graceful shutdown...")
     
-    # Остановка Telegram клиента
-    if telegram_client and telegram_client.is_connected:
-        try:
-            await telegram_client.stop()
-            print("[SHUTDOWN] ✅ Telegram клиент остановлен")
-        except Exception as e:
-            print(f"[SHUTDOWN] ⚠️ Ошибка остановки Telegram: {e}")
+    # Отключаем клиентов WebSocket (накопленные дельты уходят до отключения)
+    # и дорабатываем принятые обновления webhook
+    await event_feed.close()
+    await ws_hub.close()
+    await update_dispatcher.close()
+    
+    # Дорабатываем ставки, уже стоящие в очередях событий
+    await betting_service.acceptor.close()
+    
+    # Дописываем депозиты из очереди и доделываем начатые выводы
+    # (их уведомления попадут в outbox)
+    await deposit_ingestor.close()
+    await withdrawal_worker.close()
+    
+    # Отправляем другим воркерам последние сообщения
+    await cluster_bus.close()
+    
+    # Останавливаем доставку уведомлений до остановки клиента
+    await outbox_dispatcher.close()
+    await message_scheduler.close()
+    
+    # Остановка сессий Telegram
+    await telegram_pool.stop()
+    
+    await bot_api.close()
     
     # Закрытие базы данных
     await db_manager.close()
     print("[SHUTDOWN] ✅ Shutdown завершен")
 
+async def send_outbox_message(chat_id: int, payload: dict, priority: int):
+    """Доставка сообщения из outbox через планировщик сообщений"""
+    await message_scheduler.send(chat_id, payload["text"], priority)
+
+async def send_chat_message(chat_id: int, text: str):
+    """
+    Отправка сообщения планировщиком через сессию пула для исходящих.
+    Ошибки (в т.ч. FloodWait) пробрасываются, чтобы outbox запланировал повтор
+    """
+    await telegram_pool.send_message(chat_id, text)
+
+async def init_webhook():
+    """Регистрация webhook бота, если задан WEBHOOK_URL"""
+    if not settings.WEBHOOK_URL:
+        return
+        
+    if not settings.WEBHOOK_SECRET:
+        print("[WEBHOOK] ⚠️ WEBHOOK_SECRET не задан, webhook не зарегистрирован")
+        return
+    
+    try:
+        await set_webhook(
+            settings.WEBHOOK_URL, settings.WEBHOOK_SECRET,
+            allowed_updates=list(update_dispatcher.handlers),
+            max_connections=settings.WEBHOOK_MAX_CONNECTIONS
+        )
+        print(f"[WEBHOOK] ✅ Webhook зарегистрирован: {settings.WEBHOOK_URL}")
+    except Exception as e:
+        print(f"[WEBHOOK] ❌ Ошибка регистрации webhook: {e}")
+
 async def init_telegram_client():
-    """Инициализация Telegram клиента"""
-    global telegram_client, telegram_client_available
+    """Запуск пула сессий Telegram: обработчики подарков - на основной сессии"""
+    global telegram_client_available
     
     try:
-        if not settings.PYROGRAM_SESSION_STRING:
-            print("[TELEGRAM] ⚠️ PYROGRAM_SESSION_STRING не настроен")
+        telegram_client_available = await telegram_pool.start()
+        if not telegram_client_available:
             return
         
-        # Создаем клиента
-        telegram_client = Client(
-            name=f"gift_zona_{int(time.time())}",
-            api_id=settings.API_ID,
-            api_hash=settings.API_HASH,
-            session_string=settings.PYROGRAM_SESSION_STRING,
-            workdir="/tmp",
-            no_updates=False,
-            takeout=False,
-            sleep_threshold=60,
-            workers=1,
-            max_concurrent_transmissions=1
-        )
-        
-        # Запускаем клиента
-        await telegram_client.start()
-        telegram_client_available = True
-        
-        # Проверяем подключение
-        me = await telegram_client.get_me()
-        print(f"[TELEGRAM] ✅ Подключен как: {me.first_name} (@{me.username}, ID: {me.id})")
-        
         # Регистрируем обработчики сообщений
-        await setup_telegram_handlers()
+        await setup_telegram_handlers(telegram_pool.primary)
         
     except Exception as e:
         print(f"[TELEGRAM] ❌ Ошибка инициализации: {e}")
         telegram_client_available = False
 
-async def setup_telegram_handlers():
+async def setup_telegram_handlers(telegram_client):
     """Настройка обработчиков Telegram сообщений"""
     
-    @telegram_client.on_message(filters.all)
+    # Сообщения без подарка отсекает фильтр - обработчик для них не запускается
+    @telegram_client.on_message(gift_filter)
     async def handle_gift_deposit(client, message):
         """Обработчик депозитов подарков"""
         try:
-            # Проверяем, что это подарок
-            if (hasattr(message, 'service') and 
-                message.service and 
-                str(message.service) == "MessageServiceType.GIFT" and
-                hasattr(message, 'gift') and 
-                message.gift):
-                
+            gift = decode_gift(message)
+            sender_id = message.from_user.id if message.from_user else None
+            
+            if gift and sender_id:
                 print(f"[TELEGRAM] 🎁 Обнаружен депозит подарка!")
                 
-                # Парсим данные подарка
-                gift_data = json.loads(str(message.gift))
-                sender_id = message.from_user.id if message.from_user else None
-                
-                if sender_id:
-                    # Обрабатываем через сервис
-                    result = await gift_service.process_deposit(
-                        gift_data, sender_id, message.id
-                    )
+                # Ставим в очередь пакетной записи; при заполненной очереди ждем
+                if await deposit_ingestor.submit(gift, sender_id, message.id):
+                    print(f"[TELEGRAM] ✅ Депозит принят в обработку: message_id {message.id}")
+                else:
+                    print(f"[TELEGRAM] ❌ Депозит отклонен: message_id {message.id}")
                     
-                    if result["success"]:
-                        print(f"[TELEGRAM] ✅ Депозит обработан: {result['message']}")
-                    else:
-                        print(f"[TELEGRAM] ❌ Ошибка депозита: {result['error']}")
-                
         except Exception as e:
             print(f"[TELEGRAM] ❌ Ошибка обработки сообщения: {e}")
     
@@ -189,11 +251,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 # Подключение роутеров
 app.include_router(deposits_router)
 app.include_router(betting_router)
+app.include_router(admin_router)
+app.include_router(webhook_router)
+app.include_router(ws_router)
 
 # Базовые endpoints
 @app.get("/")
@@ -203,7 +269,7 @@ async def root():
         "status": f"{settings.APP_NAME} is running!",
         "version": settings.VERSION,
         "telegram_available": telegram_client_available,
-        "telegram_connected": telegram_client_available and telegram_client and telegram_client.is_connected
+        "telegram_connected": telegram_client_available and telegram_pool.is_connected
     }
 
 @app.get("/health")
@@ -214,13 +280,20 @@ async def health_check():
         "timestamp": time.time(),
         "services": {
             "database": db_manager.pool is not None,
-            "telegram": telegram_client_available
+            "telegram": telegram_client_available,
+            "telegram_sessions": {
+                session["name"]: session["connected"]
+                for session in telegram_pool.get_metrics()["sessions"]
+            }
         }
     }
 
 @app.post("/api/auth/telegram")
 async def authenticate_telegram(request: Request):
-    """Аутентификация через Telegram WebApp"""
+    """
+    Аутентификация через Telegram WebApp: проверка подписи initData и выдача токена сессии
+    Токен передается в Authorization: Bearer до истечения, повторный вход не нужен
+    """
     try:
         body = await request.json()
         init_data = body.get("initData")
@@ -239,36 +312,47 @@ async def authenticate_telegram(request: Request):
                 content={"success": False, "error": "Некорректные данные Telegram"}
             )
         
-        # Сохраняем/обновляем профиль пользователя
         user_id = user_data.get('id')
-        if user_id:
-            from models.database import execute_single
+        if not user_id:
+            return JSONResponse(
+                status_code=401,
+                content={"success": False, "error": "Некорректные данные Telegram"}
+            )
             
-            await execute_single("""
-                INSERT INTO user_profiles (
-                    user_id, first_name, last_name, username, 
-                    photo_url, is_premium
-                )
-                VALUES ($1, $2, $3, $4, $5, $6)
-                ON CONFLICT (user_id) DO UPDATE SET
-                    first_name = EXCLUDED.first_name,
-                    last_name = EXCLUDED.last_name,
-                    username = EXCLUDED.username,
-                    photo_url = EXCLUDED.photo_url,
-                    is_premium = EXCLUDED.is_premium,
-                    updated_at = NOW()
-            """, 
-                user_id, 
-                user_data.get('first_name'),
-                user_data.get('last_name'),
-                user_data.get('username'),
-                user_data.get('photo_url'),
-                user_data.get('is_premium', False)
+        # Сохраняем/обновляем профиль пользователя; профиль без изменений
+        # (тот же хэш полей) не перезаписывается
+        from models.database import execute_single
+        
+        await execute_single("""
+            INSERT INTO user_profiles (
+                user_id, first_name, last_name, username, 
+                photo_url, is_premium, profile_hash
             )
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ON CONFLICT (user_id) DO UPDATE SET
+                first_name = EXCLUDED.first_name,
+                last_name = EXCLUDED.last_name,
+                username = EXCLUDED.username,
+                photo_url = EXCLUDED.photo_url,
+                is_premium = EXCLUDED.is_premium,
+                profile_hash = EXCLUDED.profile_hash,
+                updated_at = NOW()
+            WHERE user_profiles.profile_hash IS DISTINCT FROM EXCLUDED.profile_hash
+        """, 
+            user_id, 
+            user_data.get('first_name'),
+            user_data.get('last_name'),
+            user_data.get('username'),
+            user_data.get('photo_url'),
+            user_data.get('is_premium', False),
+            profile_hash(user_data)
+        )
         
         return {
             "success": True,
             "user": user_data,
+            "token": create_access_token(user_id),
+            "expires_in": settings.JWT_TTL,
             "message": "Аутентификация успешна"
         }
         
@@ -279,25 +363,6 @@ async def authenticate_telegram(request: Request):
             content={"success": False, "error": "Ошибка сервера"}
         )
 
-# WebSocket endpoint (упрощенная версия)
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket для реал-тайм обновлений"""
-    await websocket.accept()
-    
-    try:
-        while True:
-            # Простой ping-pong
-            data = await websocket.receive_json()
-            
-            if data.get("type") == "ping":
-                await websocket.send_json({"type": "pong", "timestamp": time.time()})
-            
-    except WebSocketDisconnect:
-        print("[WS] Клиент отключился")
-    except Exception as e:
-        print(f"[WS] Ошибка WebSocket: {e}")
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
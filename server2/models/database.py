@@ -6,15 +6,25 @@
 
 import asyncio
 import asyncpg
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, AsyncIterator, Callable, Tuple
 from datetime import datetime
 from config.settings import settings
+from models.migrations import migration_runner
+from models.partitions import partition_manager
 
 class DatabaseManager:
     """Менеджер подключения к базе данных"""
     
     def __init__(self):
         self.pool: Optional[asyncpg.Pool] = None
+        self.migrations_task: Optional[asyncio.Task] = None
+        self.partitions_task: Optional[asyncio.Task] = None
+        
+        # LISTEN на отдельном соединении вне пула: канал -> [(callback, on_reconnect)]
+        self.listener: Optional[asyncpg.Connection] = None
+        self.listener_task: Optional[asyncio.Task] = None
+        self._listener_lost = asyncio.Event()
+        self._channels: Dict[str, List[Tuple[Callable, Optional[Callable]]]] = {}
     
     async def initialize(self):
         """Инициализация пула соединений"""
@@ -23,191 +33,151 @@ class DatabaseManager:
             self.pool = await asyncpg.create_pool(settings.DATABASE_URL)
             print("[DB] ✅ Пул соединений создан")
             
-            # Создаем таблицы
-            await self.create_tables()
-            print("[DB] ✅ Таблицы проверены/созданы")
+            # Проверяем версию схемы и применяем только недостающие миграции
+            await self.apply_migrations()
+            print("[DB] ✅ Схема БД актуальна")
+            
+            # Партиции на ближайшие месяцы должны существовать до первой вставки
+            await self.ensure_partitions()
+            self.partitions_task = asyncio.create_task(
+                partition_manager.maintenance_loop(self.pool)
+            )
             
         except Exception as e:
             print(f"[DB] ❌ Ошибка инициализации: {e}")
             raise
     
-    async def close(self):
-        """Закрытие пула соединений"""
-        if self.pool:
-            await self.pool.close()
-            print("[DB] Пул соединений закрыт")
-    
-    async def create_tables(self):
-        """Создание всех необходимых таблиц"""
-        async with self.pool.acquire() as conn:
-            # Пользователи (адаптировано из main.py)
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS user_profiles (
-                    user_id BIGINT PRIMARY KEY,
-                    first_name VARCHAR(255),
-                    last_name VARCHAR(255),
-                    username VARCHAR(255),
-                    photo_url TEXT,
-                    photo_file_id VARCHAR(255),
-                    is_premium BOOLEAN DEFAULT FALSE,
-                    role VARCHAR(20) DEFAULT 'USER',
-                    referrer_id BIGINT,
-                    cached_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-            """)
-            
-            # Депозиты подарков (из main.py)
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS deposits (
-                    id SERIAL PRIMARY KEY,
-                    telegram_user_id BIGINT NOT NULL,
-                    title VARCHAR(255) NOT NULL,
-                    slug VARCHAR(255) NOT NULL,
-                    num INTEGER NOT NULL,
-                    message_id INTEGER,
-                    image_document_id VARCHAR(255),
-                    image_access_hash VARCHAR(255),
-                    image_file_name VARCHAR(255),
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-            """)
-            
-            # Транзакции (из main.py)
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    type VARCHAR(50) NOT NULL,
-                    deposit_id INTEGER,
-                    gift_title VARCHAR(255),
-                    gift_slug VARCHAR(255),
-                    gift_value INTEGER,
-                    stars_paid INTEGER,
-                    recipient_user_id BIGINT,
-                    transfer_cost INTEGER,
-                    status VARCHAR(50) DEFAULT 'pending',
-                    telegram_message_id INTEGER,
-                    notes TEXT,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-            """)
+    async def apply_migrations(self):
+        """Блокирующие миграции - сразу, CONCURRENTLY-индексы - в фоне"""
+        if not settings.DB_AUTO_MIGRATE:
+            async with self.pool.acquire() as conn:
+                applied = await migration_runner.applied_versions(conn)
+            pending = migration_runner.pending(applied)
+            if pending:
+                print(f"[DB] ⚠️ Не применены миграции: {[m.version for m in pending]} "
+                      f"(python -m models.migrations)")
+            return
             
-            # НОВОЕ: События для беттинга
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS events (
-                    id SERIAL PRIMARY KEY,
-                    title VARCHAR(255) NOT NULL,
-                    description TEXT,
-                    outcomes JSONB NOT NULL,
-                    coefficients JSONB NOT NULL,
-                    total_bank INTEGER DEFAULT 0,
-                    status VARCHAR(20) DEFAULT 'waiting',
-                    start_time TIMESTAMP WITH TIME ZONE,
-                    end_time TIMESTAMP WITH TIME ZONE NOT NULL,
-                    result_outcome VARCHAR(255),
-                    winner_index INTEGER,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-            """)
-            
-            # НОВОЕ: Ставки
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS bets (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    event_id INTEGER NOT NULL REFERENCES events(id),
-                    outcome VARCHAR(255) NOT NULL,
-                    outcome_index INTEGER NOT NULL,
-                    gift_ids JSONB NOT NULL,
-                    total_value INTEGER NOT NULL,
-                    coefficient DECIMAL(5,3) NOT NULL,
-                    potential_payout INTEGER NOT NULL,
-                    status VARCHAR(20) DEFAULT 'pending',
-                    actual_payout INTEGER,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-            """)
-            
-            # НОВОЕ: Промокоды
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS promocodes (
-                    id SERIAL PRIMARY KEY,
-                    code VARCHAR(50) UNIQUE NOT NULL,
-                    value INTEGER NOT NULL,
-                    creator_id BIGINT NOT NULL,
-                    uses_left INTEGER DEFAULT 1,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-            """)
-            
-            # НОВОЕ: Использование промокодов
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS promocode_uses (
-                    id SERIAL PRIMARY KEY,
-                    promocode_id INTEGER NOT NULL REFERENCES promocodes(id),
-                    user_id BIGINT NOT NULL,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    UNIQUE(promocode_id, user_id)
-                );
-            """)
-            
-            # Цены подарков (из main.py)
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS gift_prices (
-                    id SERIAL PRIMARY KEY,
-                    title VARCHAR(255) UNIQUE NOT NULL,
-                    floor_price_ton DECIMAL(10,4) NOT NULL,
-                    floor_price_usd DECIMAL(10,2) NOT NULL,
-                    ton_usd_rate DECIMAL(10,4) NOT NULL,
-                    last_updated TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-            """)
-            
-            # Логи обновления цен (из main.py)
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS price_update_logs (
-                    id SERIAL PRIMARY KEY,
-                    success BOOLEAN NOT NULL,
-                    duration_seconds DECIMAL(10,2) NOT NULL,
-                    collections_updated INTEGER DEFAULT 0,
-                    deposits_updated INTEGER DEFAULT 0,
-                    ton_usd_rate DECIMAL(10,4) DEFAULT 0,
-                    error_message TEXT,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-            """)
-            
-            # Создаем индексы
-            await self.create_indexes(conn)
+        deferred = await migration_runner.migrate(self.pool)
+        
+        if deferred:
+            self.migrations_task = asyncio.create_task(self._apply_concurrent_migrations())
     
-    async def create_indexes(self, conn):
-        """Создание индексов для производительности"""
-        indexes = [
-            "CREATE INDEX IF NOT EXISTS idx_user_profiles_updated ON user_profiles(updated_at)",
-            "CREATE INDEX IF NOT EXISTS idx_deposits_user_id ON deposits(telegram_user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_deposits_created ON deposits(created_at DESC)",
-            "CREATE INDEX IF NOT EXISTS idx_transactions_user_id ON transactions(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_transactions_type ON transactions(type)",
-            "CREATE INDEX IF NOT EXISTS idx_events_status ON events(status)",
-            "CREATE INDEX IF NOT EXISTS idx_events_end_time ON events(end_time)",
-            "CREATE INDEX IF NOT EXISTS idx_bets_user_id ON bets(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_bets_event_id ON bets(event_id)",
-            "CREATE INDEX IF NOT EXISTS idx_bets_status ON bets(status)",
-            "CREATE INDEX IF NOT EXISTS idx_gift_prices_title ON gift_prices(title)",
-            "CREATE INDEX IF NOT EXISTS idx_gift_prices_updated ON gift_prices(last_updated)",
-        ]
+    async def _apply_concurrent_migrations(self):
+        """Фоновое применение concurrent-миграций вне пути запросов"""
+        try:
+            await migration_runner.apply_concurrent(self.pool)
+        except Exception as e:
+            print(f"[DB] ⚠️ Ошибка фоновой миграции: {e}")
+    
+    async def ensure_partitions(self, months_ahead: int = None) -> List[str]:
+        """Создание недостающих месячных партиций transactions/bets"""
+        return await partition_manager.ensure_partitions(self.pool, months_ahead)
+    
+    async def archive_partitions(self, retention_months: int = None) -> List[Dict]:
+        """Перенос старых завершенных партиций в архивную схему"""
+        return await partition_manager.archive_partitions(self.pool, retention_months)
+    
+    async def listen(self, channel: str, callback: Callable[[str], None],
+                     on_reconnect: Optional[Callable[[], None]] = None):
+        """
+        Подписка на NOTIFY канала через отдельное LISTEN-соединение
+        callback(payload) вызывается на каждое уведомление, on_reconnect - после
+        восстановления соединения: уведомления за время обрыва потеряны
+        """
+        subscribers = self._channels.setdefault(channel, [])
+        subscribers.append((callback, on_reconnect))
         
-        for index_sql in indexes:
+        if self.listener_task is None:
+            # Первое подключение - сразу, чтобы не потерять уведомления сразу после старта
+            try:
+                self.listener = await self._connect_listener()
+            except Exception:
+                subscribers.pop()
+                raise
+            self.listener_task = asyncio.create_task(self._listen_loop())
+            print("[DB] ✅ LISTEN-соединение открыто")
+        elif len(subscribers) == 1 and self.listener is not None:
+            await self.listener.add_listener(channel, self._on_notification)
+    
+    async def unlisten(self, channel: str, callback: Callable[[str], None]):
+        """Отписка callback от канала"""
+        subscribers = [item for item in self._channels.get(channel, []) if item[0] is not callback]
+        if subscribers:
+            self._channels[channel] = subscribers
+            return
+            
+        self._channels.pop(channel, None)
+        if self.listener is not None and not self.listener.is_closed():
+            await self.listener.remove_listener(channel, self._on_notification)
+    
+    async def _connect_listener(self) -> asyncpg.Connection:
+        """Соединение с LISTEN на все каналы подписчиков"""
+        connection = await asyncpg.connect(settings.DATABASE_URL)
+        self._listener_lost.clear()
+        connection.add_termination_listener(lambda _: self._listener_lost.set())
+        for channel in self._channels:
+            await connection.add_listener(channel, self._on_notification)
+        return connection
+    
+    def _on_notification(self, connection, pid: int, channel: str, payload: str):
+        """Уведомление - всем подписчикам канала"""
+        for callback, _ in list(self._channels.get(channel, ())):
+            callback(payload)
+    
+    async def _listen_loop(self):
+        """
+        Проверка LISTEN-соединения и переподключение с растущей паузой
+        Разрыв без закрытия сокета termination listener не видит - раз в
+        DB_LISTEN_PING_INTERVAL соединение проверяется запросом
+        """
+        delay = settings.DB_LISTEN_RECONNECT_DELAY
+        while True:
             try:
-                await conn.execute(index_sql)
+                if self.listener is None:
+                    self.listener = await self._connect_listener()
+                    delay = settings.DB_LISTEN_RECONNECT_DELAY
+                    print("[DB] ✅ LISTEN-соединение восстановлено")
+                    for subscribers in list(self._channels.values()):
+                        for _, on_reconnect in subscribers:
+                            if on_reconnect is not None:
+                                on_reconnect()
+                                
+                try:
+                    await asyncio.wait_for(self._listener_lost.wait(), settings.DB_LISTEN_PING_INTERVAL)
+                    raise ConnectionError("соединение закрыто")
+                except asyncio.TimeoutError:
+                    await self.listener.execute("SELECT 1", timeout=settings.DB_LISTEN_PING_INTERVAL)
+                    
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                print(f"[DB] Предупреждение при создании индекса: {e}")
+                print(f"[DB] ⚠️ LISTEN-соединение потеряно: {e}, переподключение через {delay:.0f} с")
+                self._drop_listener()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+    
+    def _drop_listener(self):
+        """Закрытие LISTEN-соединения без ожидания сервера"""
+        if self.listener is not None:
+            self.listener.terminate()
+            self.listener = None
+    
+    async def close(self):
+        """Закрытие пула соединений"""
+        for task in (self.migrations_task, self.partitions_task, self.listener_task):
+            if task and not task.done():
+                task.cancel()
+                
+        if self.listener_task is not None:
+            await asyncio.gather(self.listener_task, return_exceptions=True)
+            self.listener_task = None
+        self._drop_listener()
+        self._channels.clear()
+        
+        if self.pool:
+            await self.pool.close()
+            print("[DB] Пул соединений закрыт")
 
 # Глобальный менеджер БД
 db_manager = DatabaseManager()
@@ -243,3 +213,12 @@ async def execute_update(query: str, *args) -> bool:
         result = await conn.execute(query, *args)
         return "UPDATE" in result or "DELETE" in result
 
+async def stream_query(query: str, *args, prefetch: int = None) -> AsyncIterator[asyncpg.Record]:
+    """
+    Потоковое чтение через серверный курсор
+    Строки подгружаются пачками по prefetch, в памяти не копится весь результат
+    """
+    async with db_manager.pool.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            async for record in conn.cursor(query, *args, prefetch=prefetch):
+                yield record
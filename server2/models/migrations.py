@@ -0,0 +1,752 @@
+#!/usr/bin/env python3
+"""
+Версионированные миграции схемы БД
+На старте приложения - одна проверка версии и только недостающие миграции.
+Ручной запуск перед деплоем: python -m models.migrations
+"""
+
+import asyncio
+import re
+import asyncpg
+from typing import List, Optional, Set
+from config.settings import settings
+
+# Ключ advisory lock: миграции не выполняются параллельно несколькими процессами
+MIGRATIONS_LOCK_KEY = 7_310_042
+
+SCHEMA_VERSION_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    )
+"""
+
+class Migration:
+    """
+    Одна версия схемы
+    concurrent=True - шаги выполняются вне транзакции (CREATE INDEX CONCURRENTLY)
+    и не блокируют старт приложения
+    """
+    
+    def __init__(self, version: int, name: str, steps: List[str], concurrent: bool = False):
+        self.version = version
+        self.name = name
+        self.steps = steps
+        self.concurrent = concurrent
+    
+    def index_names(self) -> List[str]:
+        """Имена индексов, создаваемых миграцией (для очистки INVALID после сбоя)"""
+        names = []
+        for step in self.steps:
+            match = re.search(r"INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", step, re.I)
+            if match:
+                names.append(match.group(1))
+        return names
+
+def _partition_by_month_sql(table: str) -> str:
+    """
+    Перевод таблицы на RANGE-партиционирование по created_at
+    Старая таблица становится партицией {table}_legacy до начала следующего месяца,
+    ее индексы переименовываются и затем присоединяются к индексам родителя.
+    Старый PK (id) заменяется на (id, created_at) - перестройка индекса при ATTACH
+    """
+    return f"""
+    DO $$
+    DECLARE
+        idx RECORD;
+        seq TEXT;
+        pk_name TEXT;
+        next_month TIMESTAMPTZ := date_trunc('month', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+                                  + INTERVAL '1 month';
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = '{table}'::regclass) THEN
+            RETURN;
+        END IF;
+
+        UPDATE {table} SET created_at = NOW() WHERE created_at IS NULL;
+        ALTER TABLE {table} ALTER COLUMN created_at SET NOT NULL;
+        ALTER TABLE {table} RENAME TO {table}_legacy;
+
+        FOR idx IN
+            SELECT c.relname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = '{table}_legacy'::regclass
+        LOOP
+            EXECUTE format('ALTER INDEX %I RENAME TO %I', idx.relname, left(idx.relname, 55) || '_legacy');
+        END LOOP;
+
+        -- PK партиции должен совпадать с PK родителя (id, created_at)
+        SELECT conname INTO pk_name
+        FROM pg_constraint
+        WHERE conrelid = '{table}_legacy'::regclass AND contype = 'p';
+        IF pk_name IS NOT NULL THEN
+            EXECUTE format('ALTER TABLE {table}_legacy DROP CONSTRAINT %I', pk_name);
+        END IF;
+
+        CREATE TABLE {table} (LIKE {table}_legacy INCLUDING DEFAULTS INCLUDING STORAGE)
+            PARTITION BY RANGE (created_at);
+        ALTER TABLE {table} ADD PRIMARY KEY (id, created_at);
+
+        seq := pg_get_serial_sequence('{table}_legacy', 'id');
+        IF seq IS NOT NULL THEN
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY {table}.id', seq);
+        END IF;
+
+        EXECUTE format(
+            'ALTER TABLE {table} ATTACH PARTITION {table}_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+            next_month
+        );
+    END $$
+    """
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "initial_schema", [
+        # Пользователи (адаптировано из main.py)
+        """
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id BIGINT PRIMARY KEY,
+            first_name VARCHAR(255),
+            last_name VARCHAR(255),
+            username VARCHAR(255),
+            photo_url TEXT,
+            photo_file_id VARCHAR(255),
+            is_premium BOOLEAN DEFAULT FALSE,
+            role VARCHAR(20) DEFAULT 'USER',
+            referrer_id BIGINT,
+            cached_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+        """,
+        # Депозиты подарков (из main.py)
+        """
+        CREATE TABLE IF NOT EXISTS deposits (
+            id SERIAL PRIMARY KEY,
+            telegram_user_id BIGINT NOT NULL,
+            title VARCHAR(255) NOT NULL,
+            slug VARCHAR(255) NOT NULL,
+            num INTEGER NOT NULL,
+            message_id INTEGER,
+            image_document_id VARCHAR(255),
+            image_access_hash VARCHAR(255),
+            image_file_name VARCHAR(255),
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+        """,
+        # Транзакции (из main.py)
+        """
+        CREATE TABLE IF NOT EXISTS transactions (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            type VARCHAR(50) NOT NULL,
+            deposit_id INTEGER,
+            gift_title VARCHAR(255),
+            gift_slug VARCHAR(255),
+            gift_value INTEGER,
+            stars_paid INTEGER,
+            recipient_user_id BIGINT,
+            transfer_cost INTEGER,
+            status VARCHAR(50) DEFAULT 'pending',
+            telegram_message_id INTEGER,
+            notes TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+        """,
+        # НОВОЕ: События для беттинга
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            id SERIAL PRIMARY KEY,
+            title VARCHAR(255) NOT NULL,
+            description TEXT,
+            outcomes JSONB NOT NULL,
+            coefficients JSONB NOT NULL,
+            total_bank INTEGER DEFAULT 0,
+            status VARCHAR(20) DEFAULT 'waiting',
+            start_time TIMESTAMP WITH TIME ZONE,
+            end_time TIMESTAMP WITH TIME ZONE NOT NULL,
+            result_outcome VARCHAR(255),
+            winner_index INTEGER,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+        """,
+        # НОВОЕ: Ставки
+        """
+        CREATE TABLE IF NOT EXISTS bets (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            event_id INTEGER NOT NULL REFERENCES events(id),
+            outcome VARCHAR(255) NOT NULL,
+            outcome_index INTEGER NOT NULL,
+            gift_ids JSONB NOT NULL,
+            total_value INTEGER NOT NULL,
+            coefficient DECIMAL(5,3) NOT NULL,
+            potential_payout INTEGER NOT NULL,
+            status VARCHAR(20) DEFAULT 'pending',
+            actual_payout INTEGER,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+        """,
+        # НОВОЕ: Промокоды
+        """
+        CREATE TABLE IF NOT EXISTS promocodes (
+            id SERIAL PRIMARY KEY,
+            code VARCHAR(50) UNIQUE NOT NULL,
+            value INTEGER NOT NULL,
+            creator_id BIGINT NOT NULL,
+            uses_left INTEGER DEFAULT 1,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+        """,
+        # НОВОЕ: Использование промокодов
+        """
+        CREATE TABLE IF NOT EXISTS promocode_uses (
+            id SERIAL PRIMARY KEY,
+            promocode_id INTEGER NOT NULL REFERENCES promocodes(id),
+            user_id BIGINT NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            UNIQUE(promocode_id, user_id)
+        )
+        """,
+        # Цены подарков (из main.py)
+        """
+        CREATE TABLE IF NOT EXISTS gift_prices (
+            id SERIAL PRIMARY KEY,
+            title VARCHAR(255) UNIQUE NOT NULL,
+            floor_price_ton DECIMAL(10,4) NOT NULL,
+            floor_price_usd DECIMAL(10,2) NOT NULL,
+            ton_usd_rate DECIMAL(10,4) NOT NULL,
+            last_updated TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+        """,
+        # Логи обновления цен (из main.py)
+        """
+        CREATE TABLE IF NOT EXISTS price_update_logs (
+            id SERIAL PRIMARY KEY,
+            success BOOLEAN NOT NULL,
+            duration_seconds DECIMAL(10,2) NOT NULL,
+            collections_updated INTEGER DEFAULT 0,
+            deposits_updated INTEGER DEFAULT 0,
+            ton_usd_rate DECIMAL(10,4) DEFAULT 0,
+            error_message TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+        """,
+        # Резервирование подарков ставками (активный резерв - ставка pending/won)
+        """
+        CREATE TABLE IF NOT EXISTS bet_gifts (
+            bet_id INTEGER NOT NULL REFERENCES bets(id),
+            deposit_id INTEGER NOT NULL REFERENCES deposits(id),
+            is_active BOOLEAN NOT NULL DEFAULT TRUE,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            PRIMARY KEY (bet_id, deposit_id)
+        )
+        """,
+        # Леджер балансов (инкрементально обновляется сервисами)
+        """
+        CREATE TABLE IF NOT EXISTS user_balances (
+            user_id BIGINT PRIMARY KEY,
+            total_deposited BIGINT NOT NULL DEFAULT 0,
+            total_spent BIGINT NOT NULL DEFAULT 0,
+            total_won BIGINT NOT NULL DEFAULT 0,
+            total_withdrawn BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_user_profiles_updated ON user_profiles(updated_at)",
+        "CREATE INDEX IF NOT EXISTS idx_deposits_user_id ON deposits(telegram_user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_deposits_created ON deposits(created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_id ON transactions(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_type ON transactions(type)",
+        "CREATE INDEX IF NOT EXISTS idx_events_status ON events(status)",
+        "CREATE INDEX IF NOT EXISTS idx_events_end_time ON events(end_time)",
+        "CREATE INDEX IF NOT EXISTS idx_bets_user_id ON bets(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_bets_event_id ON bets(event_id)",
+        "CREATE INDEX IF NOT EXISTS idx_bets_status ON bets(status)",
+        "CREATE INDEX IF NOT EXISTS idx_bets_event_pending ON bets(event_id, id) WHERE status = 'pending'",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_bet_gifts_active_deposit ON bet_gifts(deposit_id) WHERE is_active",
+        "CREATE INDEX IF NOT EXISTS idx_gift_prices_title ON gift_prices(title)",
+        "CREATE INDEX IF NOT EXISTS idx_gift_prices_updated ON gift_prices(last_updated)",
+    ]),
+    Migration(2, "user_balances_backfill", [
+        # Первичное заполнение леджера балансов из истории
+        """
+        INSERT INTO user_balances (
+            user_id, total_deposited, total_spent, total_won, total_withdrawn
+        )
+        SELECT user_id,
+               SUM(deposited), SUM(spent), SUM(won), SUM(withdrawn)
+        FROM (
+            SELECT telegram_user_id AS user_id, num AS deposited,
+                   0 AS spent, 0 AS won, 0 AS withdrawn
+            FROM deposits
+            UNION ALL
+            SELECT user_id, 0, total_value, 0, 0
+            FROM bets WHERE status != 'cancelled'
+            UNION ALL
+            SELECT user_id, 0, 0, COALESCE(actual_payout, 0), 0
+            FROM bets WHERE status = 'won'
+            UNION ALL
+            SELECT user_id, 0, 0, 0, COALESCE(gift_value, 0)
+            FROM transactions WHERE type = 'withdrawal' AND status = 'completed'
+        ) AS movements
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO NOTHING
+        """,
+    ]),
+    Migration(3, "bet_gifts_backfill", [
+        # Перенос резервов подарков из bets.gift_ids
+        # (старые двойные резервы пропускаются уникальным индексом)
+        """
+        INSERT INTO bet_gifts (bet_id, deposit_id, is_active, created_at)
+        SELECT b.id, gift.deposit_id::INTEGER, b.status IN ('pending', 'won'), b.created_at
+        FROM bets b
+        CROSS JOIN LATERAL jsonb_array_elements_text(b.gift_ids) AS gift(deposit_id)
+        JOIN deposits d ON d.id = gift.deposit_id::INTEGER
+        ORDER BY b.id
+        ON CONFLICT DO NOTHING
+        """,
+    ]),
+    # Индексы под keyset-пагинацию (created_at, id) - строятся без блокировки записи
+    Migration(4, "deposits_user_keyset_index", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_deposits_user_created_id "
+        "ON deposits(telegram_user_id, created_at DESC, id DESC)",
+    ], concurrent=True),
+    Migration(5, "transactions_user_keyset_index", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transactions_user_type_created_id "
+        "ON transactions(user_id, type, created_at DESC, id DESC)",
+    ], concurrent=True),
+    Migration(6, "bets_user_keyset_index", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bets_user_created_id "
+        "ON bets(user_id, created_at DESC, id DESC)",
+    ], concurrent=True),
+    # Порядок выгрузки (created_at, id) без сортировки всей таблицы
+    Migration(7, "transactions_created_index", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transactions_created_id "
+        "ON transactions(created_at, id)",
+    ], concurrent=True),
+    Migration(8, "bets_created_index", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bets_created_id "
+        "ON bets(created_at, id)",
+    ], concurrent=True),
+    # Месячные партиции transactions и bets по created_at.
+    # bet_gifts теряет FK на bets: внешний ключ на партиционированную таблицу
+    # потребовал бы created_at в bet_gifts
+    Migration(9, "partition_transactions_and_bets", [
+        "ALTER TABLE bet_gifts DROP CONSTRAINT IF EXISTS bet_gifts_bet_id_fkey",
+        _partition_by_month_sql("transactions"),
+        _partition_by_month_sql("bets"),
+        # Индексы родителя; совпадающие индексы legacy-партиции присоединяются без пересборки
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_id ON transactions(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_type ON transactions(type)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_type_created_id "
+        "ON transactions(user_id, type, created_at DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_created_id ON transactions(created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_bets_user_id ON bets(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_bets_event_id ON bets(event_id)",
+        "CREATE INDEX IF NOT EXISTS idx_bets_status ON bets(status)",
+        "CREATE INDEX IF NOT EXISTS idx_bets_event_pending ON bets(event_id, id) WHERE status = 'pending'",
+        "CREATE INDEX IF NOT EXISTS idx_bets_user_created_id ON bets(user_id, created_at DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_bets_created_id ON bets(created_at, id)",
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conrelid = 'bets'::regclass AND contype = 'f'
+            ) THEN
+                ALTER TABLE bets ADD CONSTRAINT bets_event_id_fkey
+                    FOREIGN KEY (event_id) REFERENCES events(id);
+            END IF;
+        END $$
+        """,
+        # Журнал отсоединенных партиций
+        """
+        CREATE TABLE IF NOT EXISTS archived_partitions (
+            partition_name VARCHAR(255) PRIMARY KEY,
+            parent_table VARCHAR(255) NOT NULL,
+            range_end TIMESTAMP WITH TIME ZONE NOT NULL,
+            rows_count BIGINT NOT NULL,
+            archived_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+        """,
+        # Суммы по архивированным строкам - для сверки леджера балансов
+        """
+        CREATE TABLE IF NOT EXISTS archived_balance_totals (
+            user_id BIGINT PRIMARY KEY,
+            total_spent BIGINT NOT NULL DEFAULT 0,
+            total_won BIGINT NOT NULL DEFAULT 0,
+            total_withdrawn BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+    ]),
+    # Агрегаты лидерборда по окнам (day / week / all), обновляются при расчете ставок
+    Migration(10, "leaderboard_stats", [
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_stats (
+            period VARCHAR(10) NOT NULL,
+            period_start DATE NOT NULL,
+            user_id BIGINT NOT NULL,
+            total_bets INTEGER NOT NULL DEFAULT 0,
+            won_bets INTEGER NOT NULL DEFAULT 0,
+            total_winnings BIGINT NOT NULL DEFAULT 0,
+            total_wagered BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, period_start, user_id)
+        )
+        """,
+        # Топ окна читается по индексу; в лидерборд попадают игроки от 3 ставок
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_stats_top "
+        "ON leaderboard_stats(period, period_start, total_winnings DESC, user_id) "
+        "WHERE total_bets >= 3",
+        # Заполнение по уже рассчитанным ставкам; окно - дата расчета (updated_at) в UTC
+        """
+        INSERT INTO leaderboard_stats (
+            period, period_start, user_id, total_bets, won_bets, total_winnings, total_wagered
+        )
+        SELECT w.period, w.period_start, b.user_id,
+               COUNT(*),
+               COUNT(*) FILTER (WHERE b.status = 'won'),
+               COALESCE(SUM(b.actual_payout) FILTER (WHERE b.status = 'won'), 0),
+               COALESCE(SUM(b.total_value), 0)
+        FROM bets b
+        CROSS JOIN LATERAL (
+            VALUES
+                ('day', date_trunc('day', COALESCE(b.updated_at, b.created_at) AT TIME ZONE 'UTC')::DATE),
+                ('week', date_trunc('week', COALESCE(b.updated_at, b.created_at) AT TIME ZONE 'UTC')::DATE),
+                ('all', DATE '1970-01-01')
+        ) AS w(period, period_start)
+        WHERE b.status IN ('won', 'lost')
+        GROUP BY w.period, w.period_start, b.user_id
+        ON CONFLICT (period, period_start, user_id) DO NOTHING
+        """,
+    ]),
+    # Счетчики события и исходов, обновляются при приеме и расчете ставок.
+    # event_bettors - точный учет уникальных игроков события
+    Migration(11, "event_stats", [
+        """
+        CREATE TABLE IF NOT EXISTS event_stats (
+            event_id INTEGER PRIMARY KEY REFERENCES events(id),
+            total_bets INTEGER NOT NULL DEFAULT 0,
+            unique_users INTEGER NOT NULL DEFAULT 0,
+            total_volume BIGINT NOT NULL DEFAULT 0,
+            winners_count INTEGER NOT NULL DEFAULT 0,
+            losers_count INTEGER NOT NULL DEFAULT 0,
+            total_payouts BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS event_outcome_stats (
+            event_id INTEGER NOT NULL REFERENCES events(id),
+            outcome_index INTEGER NOT NULL,
+            outcome VARCHAR(255),
+            bets_count INTEGER NOT NULL DEFAULT 0,
+            total_value BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (event_id, outcome_index)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS event_bettors (
+            event_id INTEGER NOT NULL REFERENCES events(id),
+            user_id BIGINT NOT NULL,
+            PRIMARY KEY (event_id, user_id)
+        )
+        """,
+        """
+        INSERT INTO event_bettors (event_id, user_id)
+        SELECT DISTINCT event_id, user_id FROM bets
+        ON CONFLICT DO NOTHING
+        """,
+        """
+        INSERT INTO event_stats (
+            event_id, total_bets, unique_users, total_volume,
+            winners_count, losers_count, total_payouts
+        )
+        SELECT event_id, COUNT(*), COUNT(DISTINCT user_id), COALESCE(SUM(total_value), 0),
+               COUNT(*) FILTER (WHERE status = 'won'),
+               COUNT(*) FILTER (WHERE status = 'lost'),
+               COALESCE(SUM(actual_payout) FILTER (WHERE status = 'won'), 0)
+        FROM bets
+        GROUP BY event_id
+        ON CONFLICT (event_id) DO NOTHING
+        """,
+        """
+        INSERT INTO event_outcome_stats (event_id, outcome_index, outcome, bets_count, total_value)
+        SELECT b.event_id, b.outcome_index, MIN(e.outcomes ->> b.outcome_index),
+               COUNT(*), COALESCE(SUM(b.total_value), 0)
+        FROM bets b
+        JOIN events e ON e.id = b.event_id
+        GROUP BY b.event_id, b.outcome_index
+        ON CONFLICT (event_id, outcome_index) DO NOTHING
+        """,
+    ]),
+    # Transactional outbox: уведомления пишутся в транзакции бизнес-операции,
+    # доставляются диспетчером уже после коммита
+    Migration(12, "outbox", [
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            kind VARCHAR(50) NOT NULL,
+            chat_id BIGINT NOT NULL,
+            payload JSONB NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+            last_error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            sent_at TIMESTAMP WITH TIME ZONE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_attempt_at, id) "
+        "WHERE status IN ('pending', 'sending')",
+    ]),
+    # Уникальный message_id депозита: дубли отсекает INSERT ... ON CONFLICT DO NOTHING.
+    # Дубли, успевшие проскочить мимо старой проверки SELECT, не удаляются -
+    # у более поздних копий обнуляется message_id, чтобы индекс можно было построить
+    Migration(13, "deposits_message_id_unique", [
+        """
+        UPDATE deposits d
+        SET message_id = NULL
+        WHERE d.message_id IS NOT NULL
+          AND EXISTS (
+              SELECT 1 FROM deposits earlier
+              WHERE earlier.message_id = d.message_id AND earlier.id < d.id
+          )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_deposits_message_id_unique ON deposits(message_id)",
+    ]),
+    # Очередь выводов pending -> sending -> completed/failed; на один депозит -
+    # не больше одного незавершенного или выполненного вывода.
+    # Ранее выполненные выводы переносятся как completed, чтобы индекс их учитывал
+    Migration(14, "withdrawals", [
+        """
+        CREATE TABLE IF NOT EXISTS withdrawals (
+            id BIGSERIAL PRIMARY KEY,
+            deposit_id INTEGER NOT NULL REFERENCES deposits(id),
+            owner_user_id BIGINT NOT NULL,
+            recipient_user_id BIGINT NOT NULL,
+            gift_value INTEGER NOT NULL,
+            transaction_id INTEGER,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+            last_error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            completed_at TIMESTAMP WITH TIME ZONE
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_withdrawals_deposit_active ON withdrawals(deposit_id) "
+        "WHERE status != 'failed'",
+        "CREATE INDEX IF NOT EXISTS idx_withdrawals_due ON withdrawals(next_attempt_at, id) "
+        "WHERE status IN ('pending', 'sending')",
+        """
+        INSERT INTO withdrawals (
+            deposit_id, owner_user_id, recipient_user_id, gift_value,
+            transaction_id, status, created_at, completed_at
+        )
+        SELECT DISTINCT ON (d.id)
+               d.id, t.user_id, COALESCE(t.recipient_user_id, t.user_id),
+               COALESCE(t.gift_value, d.num), t.id, 'completed', t.created_at, t.created_at
+        FROM transactions t
+        JOIN deposits d ON d.message_id = t.telegram_message_id
+        WHERE t.type = 'withdrawal' AND t.status = 'completed'
+          AND NOT EXISTS (SELECT 1 FROM withdrawals w WHERE w.deposit_id = d.id)
+        ORDER BY d.id, t.id
+        """,
+    ]),
+    # Кэш аватаров в user_profiles: cached_at - момент проверки photo_file_id через Bot API
+    # (NULL - еще не проверялся; photo_file_id NULL при свежем cached_at - фото нет)
+    Migration(15, "user_profiles_avatar_cache", [
+        "ALTER TABLE user_profiles ALTER COLUMN cached_at DROP DEFAULT",
+        "UPDATE user_profiles SET cached_at = NULL WHERE photo_file_id IS NULL",
+    ]),
+    # Приоритет сообщений outbox (0 - подтверждения, 1 - результаты ставок, 2 - рассылки):
+    # диспетчер забирает срочные первыми, даже если за ними очередь рассылки.
+    # Уже стоящие в outbox сообщения - подтверждения депозитов и выводов
+    Migration(16, "outbox_priority", [
+        "ALTER TABLE outbox ADD COLUMN IF NOT EXISTS priority SMALLINT NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due_priority ON outbox(priority, next_attempt_at, id) "
+        "WHERE status IN ('pending', 'sending')",
+        "DROP INDEX IF EXISTS idx_outbox_due",
+    ]),
+    # Хэш полей профиля из initData: повторный вход без изменений профиль не перезаписывает
+    Migration(17, "user_profiles_profile_hash", [
+        "ALTER TABLE user_profiles ADD COLUMN IF NOT EXISTS profile_hash VARCHAR(64)",
+    ]),
+    # Выданные invoice на оплату вывода: issued -> paid/expired.
+    # На набор подарков пользователя - не больше одного действующего invoice
+    Migration(18, "invoices", [
+        """
+        CREATE TABLE IF NOT EXISTS invoices (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            gift_ids INTEGER[] NOT NULL,
+            payload VARCHAR(128) NOT NULL UNIQUE,
+            invoice_url TEXT NOT NULL,
+            total_stars INTEGER NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'issued',
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            paid_at TIMESTAMP WITH TIME ZONE
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_invoices_active ON invoices(user_id, gift_ids) "
+        "WHERE status = 'issued'",
+        "CREATE INDEX IF NOT EXISTS idx_invoices_user ON invoices(user_id, created_at DESC)",
+    ]),
+    # Идентификатор платежа Telegram из successful_payment (для возвратов и сверки)
+    Migration(19, "invoices_payment_charge", [
+        "ALTER TABLE invoices ADD COLUMN IF NOT EXISTS telegram_payment_charge_id VARCHAR(255)",
+    ]),
+]
+
+class MigrationRunner:
+    """Применение миграций с учетом уже установленных версий"""
+    
+    def __init__(self, migrations: List[Migration]):
+        self.migrations = sorted(migrations, key=lambda m: m.version)
+    
+    async def applied_versions(self, conn) -> Set[int]:
+        """Единственный запрос на старте: какие версии уже применены"""
+        try:
+            rows = await conn.fetch("SELECT version FROM schema_version")
+        except asyncpg.UndefinedTableError:
+            return set()
+        return {row["version"] for row in rows}
+    
+    def pending(self, applied: Set[int], concurrent: Optional[bool] = None) -> List[Migration]:
+        """Неприменённые миграции (concurrent=None - все)"""
+        return [
+            m for m in self.migrations
+            if m.version not in applied and (concurrent is None or m.concurrent == concurrent)
+        ]
+    
+    async def migrate(self, pool: asyncpg.Pool) -> List[Migration]:
+        """
+        Применение блокирующих миграций
+        Concurrent-миграции с меньшей версией применяются перед ними по порядку,
+        остальные откладываются - возвращается их список
+        """
+        async with pool.acquire() as conn:
+            applied = await self.applied_versions(conn)
+            
+            if self.pending(applied, concurrent=False):
+                await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_KEY)
+                try:
+                    await conn.execute(SCHEMA_VERSION_SQL)
+                    # Другой процесс мог применить миграции, пока мы ждали lock
+                    applied = await self.applied_versions(conn)
+                    blocking = self.pending(applied, concurrent=False)
+                    last_blocking = blocking[-1].version if blocking else 0
+                    
+                    for migration in self.pending(applied):
+                        if migration.version > last_blocking:
+                            break
+                        
+                        if migration.concurrent:
+                            await self._apply_concurrent_migration(conn, migration)
+                        else:
+                            async with conn.transaction():
+                                for step in migration.steps:
+                                    await conn.execute(step)
+                                await self._mark_applied(conn, migration)
+                            print(f"[DB] ✅ Миграция {migration.version} ({migration.name}) применена")
+                        applied.add(migration.version)
+                finally:
+                    await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_KEY)
+            
+            return self.pending(applied, concurrent=True)
+    
+    async def apply_concurrent(self, pool: asyncpg.Pool):
+        """
+        Применение concurrent-миграций вне транзакции
+        Если их уже выполняет другой процесс - пропускаем
+        """
+        async with pool.acquire() as conn:
+            locked = await conn.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATIONS_LOCK_KEY)
+            if not locked:
+                print("[DB] ⏭️ Concurrent-миграции уже выполняются другим процессом")
+                return
+            
+            try:
+                applied = await self.applied_versions(conn)
+                
+                for migration in self.pending(applied, concurrent=True):
+                    await self._apply_concurrent_migration(conn, migration)
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_KEY)
+    
+    async def _apply_concurrent_migration(self, conn, migration: Migration):
+        """Шаги concurrent-миграции вне транзакции"""
+        # Индекс, оставшийся INVALID после прерванной сборки, пересоздаем
+        for index_name in migration.index_names():
+            is_valid = await conn.fetchval("""
+                SELECT i.indisvalid
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = $1
+            """, index_name)
+            if is_valid is False:
+                await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+        
+        for step in migration.steps:
+            await conn.execute(step)
+        await self._mark_applied(conn, migration)
+        print(f"[DB] ✅ Concurrent-миграция {migration.version} ({migration.name}) применена")
+    
+    async def _mark_applied(self, conn, migration: Migration):
+        """Запись версии в schema_version"""
+        await conn.execute("""
+            INSERT INTO schema_version (version, name) VALUES ($1, $2)
+            ON CONFLICT (version) DO NOTHING
+        """, migration.version, migration.name)
+    
+    async def status(self, pool: asyncpg.Pool) -> List[dict]:
+        """Состояние всех миграций"""
+        async with pool.acquire() as conn:
+            applied = await self.applied_versions(conn)
+            
+        return [
+            {
+                "version": m.version,
+                "name": m.name,
+                "concurrent": m.concurrent,
+                "applied": m.version in applied
+            }
+            for m in self.migrations
+        ]
+
+# Глобальный раннер миграций
+migration_runner = MigrationRunner(MIGRATIONS)
+
+async def _run_cli(show_status: bool, skip_concurrent: bool):
+    """Применение миграций из командной строки (перед деплоем)"""
+    pool = await asyncpg.create_pool(settings.DATABASE_URL, min_size=1, max_size=1)
+    try:
+        if not show_status:
+            await migration_runner.migrate(pool)
+            if not skip_concurrent:
+                await migration_runner.apply_concurrent(pool)
+                
+        for item in await migration_runner.status(pool):
+            mark = "✅" if item["applied"] else "⏳"
+            kind = " [concurrent]" if item["concurrent"] else ""
+            print(f"{mark} {item['version']:>4} {item['name']}{kind}")
+    finally:
+        await pool.close()
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Миграции схемы GIFT ZONA")
+    parser.add_argument("--status", action="store_true", help="Только показать состояние")
+    parser.add_argument("--skip-concurrent", action="store_true",
+                        help="Не выполнять CREATE INDEX CONCURRENTLY миграции")
+    args = parser.parse_args()
+    
+    asyncio.run(_run_cli(args.status, args.skip_concurrent))
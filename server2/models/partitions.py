@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Месячные партиции transactions и bets
+Создание будущих партиций заранее и архивирование старых в отдельную схему
+
+Запуск вручную:
+    python -m models.partitions            # создать недостающие партиции
+    python -m models.partitions --archive  # + отсоединить старые партиции в архив
+"""
+
+import asyncio
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import asyncpg
+from config.settings import settings
+
+PARTITIONED_TABLES = ("transactions", "bets")
+
+# Защита от одновременного обслуживания партиций несколькими инстансами
+PARTITIONS_LOCK_KEY = 7_310_043
+
+# Строки, из-за которых партицию еще нельзя уносить в архив
+OPEN_ROWS_CONDITIONS = {
+    "transactions": "status = 'pending'",
+    "bets": "status = 'pending'",
+}
+
+# Вклад строк партиции в леджер балансов (те же условия, что в COMPUTED_BALANCES_SQL)
+ARCHIVE_TOTALS_SQL = {
+    "transactions": """
+        SELECT user_id, 0::BIGINT AS spent, 0::BIGINT AS won,
+               SUM(COALESCE(gift_value, 0))::BIGINT AS withdrawn
+        FROM {partition}
+        WHERE type = 'withdrawal' AND status IN ('pending', 'completed')
+        GROUP BY user_id
+    """,
+    "bets": """
+        SELECT user_id,
+               SUM(total_value) FILTER (WHERE status != 'cancelled')::BIGINT AS spent,
+               COALESCE(SUM(actual_payout) FILTER (WHERE status = 'won'), 0)::BIGINT AS won,
+               0::BIGINT AS withdrawn
+        FROM {partition}
+        GROUP BY user_id
+    """,
+}
+
+_BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+def _parse_bound(value: str) -> Optional[datetime]:
+    """Граница из pg_get_expr: 'YYYY-MM-DD HH:MM:SS+00' или MINVALUE/MAXVALUE"""
+    value = value.strip()
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+def _month_start(moment: datetime) -> datetime:
+    """Начало месяца в UTC"""
+    return moment.astimezone(timezone.utc).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+
+def _add_months(moment: datetime, months: int) -> datetime:
+    """Сдвиг начала месяца на months месяцев"""
+    month_index = moment.year * 12 + moment.month - 1 + months
+    return moment.replace(year=month_index // 12, month=month_index % 12 + 1)
+
+class PartitionManager:
+    """Обслуживание месячных партиций"""
+    
+    async def list_partitions(self, conn, table: str) -> List[Dict]:
+        """Партиции таблицы с границами, отсортированные по началу диапазона"""
+        async with conn.transaction():
+            # Границы выводятся в UTC независимо от настроек сессии
+            await conn.execute("SET LOCAL TimeZone = 'UTC'")
+            rows = await conn.fetch("""
+                SELECT c.relname AS name,
+                       pg_get_expr(c.relpartbound, c.oid) AS bound
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = $1::regclass
+            """, table)
+            
+        partitions = []
+        for row in rows:
+            match = _BOUND_RE.search(row["bound"])
+            if not match:
+                continue
+            partitions.append({
+                "name": row["name"],
+                "range_start": _parse_bound(match.group(1)),
+                "range_end": _parse_bound(match.group(2))
+            })
+            
+        partitions.sort(key=lambda p: p["range_start"] or datetime.min.replace(tzinfo=timezone.utc))
+        return partitions
+    
+    async def is_partitioned(self, conn, table: str) -> bool:
+        """Таблица уже переведена на партиции (миграция 9)"""
+        return await conn.fetchval("""
+            SELECT EXISTS (
+                SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass($1)
+            )
+        """, table)
+    
+    async def ensure_partitions(self, pool: asyncpg.Pool, months_ahead: int = None) -> List[str]:
+        """
+        Создание партиций до текущего месяца + months_ahead
+        Партиции по умолчанию нет: вставка за пределами диапазонов - ошибка,
+        поэтому запас создается заранее и пополняется maintenance-циклом
+        """
+        if months_ahead is None:
+            months_ahead = settings.PARTITION_MONTHS_AHEAD
+            
+        horizon = _add_months(_month_start(datetime.now(timezone.utc)), months_ahead + 1)
+        created = []
+        
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", PARTITIONS_LOCK_KEY)
+                
+                for table in PARTITIONED_TABLES:
+                    if not await self.is_partitioned(conn, table):
+                        continue
+                        
+                    partitions = await self.list_partitions(conn, table)
+                    ends = [p["range_end"] for p in partitions if p["range_end"]]
+                    start = max(ends) if ends else _month_start(datetime.now(timezone.utc))
+                    
+                    while start < horizon:
+                        end = _add_months(start, 1)
+                        name = f"{table}_p{start:%Y_%m}"
+                        await conn.execute(f"""
+                            CREATE TABLE {name} PARTITION OF {table}
+                            FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')
+                        """)
+                        created.append(name)
+                        start = end
+                        
+        for name in created:
+            print(f"[PARTITIONS] ✅ Создана партиция {name}")
+        return created
+    
+    async def archive_partitions(self, pool: asyncpg.Pool,
+                                 retention_months: int = None) -> List[Dict]:
+        """
+        Отсоединение партиций старше retention_months в схему ARCHIVE_SCHEMA
+        Уносятся только партиции без незавершенных строк. Их вклад в балансы
+        переносится в archived_balance_totals в той же транзакции, что и DETACH,
+        поэтому сверка леджера не видит расхождения
+        """
+        if retention_months is None:
+            retention_months = settings.PARTITION_RETENTION_MONTHS
+            
+        cutoff = _add_months(_month_start(datetime.now(timezone.utc)), -retention_months)
+        archived = []
+        
+        async with pool.acquire() as conn:
+            await conn.execute("SELECT pg_advisory_lock($1)", PARTITIONS_LOCK_KEY)
+            try:
+                await conn.execute(f"CREATE SCHEMA IF NOT EXISTS {settings.ARCHIVE_SCHEMA}")
+                
+                for table in PARTITIONED_TABLES:
+                    if not await self.is_partitioned(conn, table):
+                        continue
+                        
+                    for partition in await self.list_partitions(conn, table):
+                        if partition["range_end"] is None or partition["range_end"] > cutoff:
+                            continue
+                            
+                        archived_partition = await self._archive_partition(conn, table, partition)
+                        if archived_partition:
+                            archived.append(archived_partition)
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1)", PARTITIONS_LOCK_KEY)
+                
+        return archived
+    
+    async def _archive_partition(self, conn, table: str, partition: Dict) -> Optional[Dict]:
+        """Перенос одной партиции в архив; None - если в ней есть незавершенные строки"""
+        name = partition["name"]
+        
+        async with conn.transaction():
+            has_open_rows = await conn.fetchval(f"""
+                SELECT EXISTS (
+                    SELECT 1 FROM {name} WHERE {OPEN_ROWS_CONDITIONS[table]}
+                )
+            """)
+            if has_open_rows:
+                print(f"[PARTITIONS] ⚠️ {name}: есть незавершенные строки, пропуск")
+                return None
+                
+            rows_count = await conn.fetchval(f"SELECT COUNT(*) FROM {name}")
+            
+            await conn.execute(f"""
+                INSERT INTO archived_balance_totals (
+                    user_id, total_spent, total_won, total_withdrawn
+                )
+                SELECT user_id, spent, won, withdrawn
+                FROM ({ARCHIVE_TOTALS_SQL[table].format(partition=name)}) AS totals
+                ON CONFLICT (user_id) DO UPDATE SET
+                    total_spent = archived_balance_totals.total_spent + EXCLUDED.total_spent,
+                    total_won = archived_balance_totals.total_won + EXCLUDED.total_won,
+                    total_withdrawn = archived_balance_totals.total_withdrawn
+                                      + EXCLUDED.total_withdrawn
+            """)
+            
+            # Обычный DETACH (не CONCURRENTLY): перенос итогов и отсоединение атомарны
+            await conn.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+            await conn.execute(f"ALTER TABLE {name} SET SCHEMA {settings.ARCHIVE_SCHEMA}")
+            if settings.ARCHIVE_TABLESPACE:
+                await conn.execute(f"""
+                    ALTER TABLE {settings.ARCHIVE_SCHEMA}.{name}
+                    SET TABLESPACE {settings.ARCHIVE_TABLESPACE}
+                """)
+                
+            await conn.execute("""
+                INSERT INTO archived_partitions (
+                    partition_name, parent_table, range_end, rows_count
+                )
+                VALUES ($1, $2, $3, $4)
+            """, name, table, partition["range_end"], rows_count)
+            
+        print(f"[PARTITIONS] ✅ {name} ({rows_count} строк) перенесена в {settings.ARCHIVE_SCHEMA}")
+        return {"partition": name, "table": table, "rows_count": rows_count}
+    
+    async def maintenance_loop(self, pool: asyncpg.Pool):
+        """Фоновое обслуживание: пополнение партиций и, при ARCHIVE_AUTO, архивирование"""
+        while True:
+            await asyncio.sleep(settings.PARTITION_MAINTENANCE_INTERVAL)
+            try:
+                await self.ensure_partitions(pool)
+                if settings.ARCHIVE_AUTO:
+                    await self.archive_partitions(pool)
+            except Exception as e:
+                print(f"[PARTITIONS] ⚠️ Ошибка обслуживания партиций: {e}")
+
+# Глобальный менеджер партиций
+partition_manager = PartitionManager()
+
+async def _run_cli(archive: bool, retention_months: Optional[int]):
+    """Обслуживание партиций из командной строки"""
+    pool = await asyncpg.create_pool(settings.DATABASE_URL, min_size=1, max_size=1)
+    try:
+        await partition_manager.ensure_partitions(pool)
+        if archive:
+            await partition_manager.archive_partitions(pool, retention_months)
+            
+        async with pool.acquire() as conn:
+            for table in PARTITIONED_TABLES:
+                for partition in await partition_manager.list_partitions(conn, table):
+                    start = partition["range_start"] or "MINVALUE"
+                    end = partition["range_end"] or "MAXVALUE"
+                    print(f"{partition['name']:<28} {start} → {end}")
+    finally:
+        await pool.close()
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Партиции transactions/bets GIFT ZONA")
+    parser.add_argument("--archive", action="store_true",
+                        help="Отсоединить старые партиции в архивную схему")
+    parser.add_argument("--retention-months", type=int, default=None,
+                        help="Сколько месяцев держать в горячих партициях")
+    args = parser.parse_args()
+    
+    asyncio.run(_run_cli(args.archive, args.retention_months))
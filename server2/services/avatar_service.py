@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Кэш аватаров пользователей
+file_id аватара ищется по цепочке: LRU в памяти -> user_profiles.photo_file_id
+(свежий по cached_at) -> getUserProfilePhotos. Результат Bot API сохраняется в обе ступени
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from config.settings import settings
+from models.database import db_manager
+from utils.telegram import fetch_user_avatar_file_id
+
+class AvatarService:
+    """Пакетное получение file_id аватаров с TTL-кэшем и склейкой одинаковых запросов"""
+    
+    def __init__(self, max_size: int = None, ttl: float = None, concurrency: int = None):
+        self.max_size = max_size or settings.AVATAR_CACHE_SIZE
+        self.ttl = settings.AVATAR_CACHE_TTL if ttl is None else ttl
+        # user_id -> (момент истечения, file_id или None - фото нет)
+        self._cache: "OrderedDict[int, tuple]" = OrderedDict()
+        self._in_flight: Dict[int, asyncio.Future] = {}
+        self._tasks: set = set()
+        self._semaphore = asyncio.Semaphore(concurrency or settings.AVATAR_FETCH_CONCURRENCY)
+        
+        # Метрики
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.api_calls = 0
+        self.coalesced = 0
+        self.errors = 0
+    
+    def _remember(self, user_id: int, file_id: Optional[str], expires_at: float):
+        """Запись в LRU с вытеснением самых давних"""
+        self._cache[user_id] = (expires_at, file_id)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+    
+    async def get_avatar(self, user_id: int) -> Optional[str]:
+        """file_id аватара одного пользователя"""
+        return (await self.get_avatars([user_id])).get(user_id)
+    
+    async def get_avatars(self, user_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        """
+        file_id аватаров набора пользователей
+        Промахи памяти - один запрос к user_profiles, промахи БД - Bot API
+        не больше AVATAR_FETCH_CONCURRENCY одновременно; для пользователей
+        без профиля в user_profiles - None без запросов к Bot API
+        """
+        now = time.monotonic()
+        result: Dict[int, Optional[str]] = {}
+        missing: List[int] = []
+        
+        for user_id in dict.fromkeys(user_ids):
+            cached = self._cache.get(user_id)
+            if cached and cached[0] > now:
+                self._cache.move_to_end(user_id)
+                result[user_id] = cached[1]
+                self.memory_hits += 1
+            else:
+                missing.append(user_id)
+                
+        if not missing:
+            return result
+            
+        # Уже идущие поиски не дублируем, новые регистрируем до первого await,
+        # чтобы параллельные вызовы их подхватили
+        waiting = {user_id: self._in_flight[user_id] for user_id in missing if user_id in self._in_flight}
+        self.coalesced += len(waiting)
+        
+        loop = asyncio.get_running_loop()
+        futures = {
+            user_id: loop.create_future() for user_id in missing if user_id not in waiting
+        }
+        if futures:
+            self._in_flight.update(futures)
+            waiting.update(futures)
+            task = asyncio.create_task(self._resolve(futures))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            
+        for user_id, future in waiting.items():
+            result[user_id] = await asyncio.shield(future)
+            
+        return result
+    
+    async def _resolve(self, futures: Dict[int, asyncio.Future]):
+        """Поиск пачки промахов: БД, затем Bot API; результат - в futures"""
+        outcomes: Dict[int, object] = {}
+        try:
+            fresh, known = await self._load_from_db(list(futures))
+            outcomes.update(fresh)
+            # Bot API спрашиваем только про зарегистрированных: чужие id не стоят запросов
+            to_fetch = [
+                user_id for user_id in futures if user_id in known and user_id not in outcomes
+            ]
+            
+            if to_fetch and settings.BOT_TOKEN:
+                outcomes.update(await self._fetch_from_api(to_fetch))
+        except Exception as e:
+            print(f"[AVATAR] ❌ Ошибка поиска аватаров: {e}")
+        finally:
+            for user_id, future in futures.items():
+                # Без ответа (сбой, нет BOT_TOKEN) - None, в кэш не попадает
+                outcome = outcomes.get(user_id)
+                future.set_result(None if isinstance(outcome, Exception) else outcome)
+                del self._in_flight[user_id]
+    
+    async def _load_from_db(self, user_ids: List[int]) -> Tuple[Dict[int, Optional[str]], Set[int]]:
+        """Свежие (моложе TTL) file_id из user_profiles и множество найденных там пользователей"""
+        async with db_manager.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT user_id, photo_file_id,
+                       EXTRACT(EPOCH FROM NOW() - cached_at)::FLOAT8 AS age
+                FROM user_profiles
+                WHERE user_id = ANY($1::BIGINT[])
+            """, user_ids)
+            
+        now = time.monotonic()
+        found = {}
+        for row in rows:
+            # age NULL - аватар еще не проверялся
+            if row["age"] is None or row["age"] >= self.ttl:
+                continue
+            found[row["user_id"]] = row["photo_file_id"]
+            self._remember(row["user_id"], row["photo_file_id"], now + self.ttl - row["age"])
+        self.db_hits += len(found)
+        return found, {row["user_id"] for row in rows}
+    
+    async def _fetch_from_api(self, user_ids: List[int]) -> Dict[int, object]:
+        """Bot API не больше AVATAR_FETCH_CONCURRENCY одновременно, успешные ответы - в БД"""
+        async def fetch_one(user_id: int):
+            async with self._semaphore:
+                self.api_calls += 1
+                return await fetch_user_avatar_file_id(user_id)
+                
+        outcomes = await asyncio.gather(*(fetch_one(user_id) for user_id in user_ids),
+                                        return_exceptions=True)
+                                        
+        resolved = {}
+        now = time.monotonic()
+        for user_id, outcome in zip(user_ids, outcomes):
+            if isinstance(outcome, Exception):
+                # Сбой не кэшируем: следующий запрос попробует снова
+                self.errors += 1
+                print(f"[AVATAR] ❌ Ошибка получения аватара для {user_id}: {outcome}")
+            else:
+                resolved[user_id] = outcome
+                self._remember(user_id, outcome, now + self.ttl)
+                
+        if resolved:
+            try:
+                await self._persist(resolved)
+            except Exception as e:
+                print(f"[AVATAR] ⚠️ Не удалось сохранить аватары в БД: {e}")
+                
+        return dict(zip(user_ids, outcomes))
+    
+    async def _persist(self, resolved: Dict[int, Optional[str]]):
+        """Сохранение file_id и момента проверки одним запросом, только в существующие профили"""
+        async with db_manager.pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE user_profiles AS p
+                SET photo_file_id = a.photo_file_id, cached_at = NOW()
+                FROM unnest($1::BIGINT[], $2::VARCHAR[]) AS a(user_id, photo_file_id)
+                WHERE p.user_id = a.user_id
+            """, list(resolved), list(resolved.values()))
+    
+    def get_metrics(self) -> Dict:
+        """Метрики кэша аватаров"""
+        return {
+            "cached": len(self._cache),
+            "in_flight": len(self._in_flight),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "api_calls": self.api_calls,
+            "coalesced": self.coalesced,
+            "errors": self.errors
+        }
+
+# Глобальный экземпляр сервиса
+avatar_service = AvatarService()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Сервис баланса пользователей
+Инкрементальный леджер user_balances вместо SUM по deposits/bets
+"""
+
+import asyncio
+from typing import Dict
+from models.database import db_manager, execute_single
+
+# Пересчет баланса из сырых таблиц (источник истины для сверки)
+COMPUTED_BALANCES_SQL = """
+    SELECT user_id,
+           SUM(deposited)::BIGINT AS total_deposited,
+           SUM(spent)::BIGINT AS total_spent,
+           SUM(won)::BIGINT AS total_won,
+           SUM(withdrawn)::BIGINT AS total_withdrawn
+    FROM (
+        SELECT telegram_user_id AS user_id, num AS deposited,
+               0 AS spent, 0 AS won, 0 AS withdrawn
+        FROM deposits
+        UNION ALL
+        SELECT user_id, 0, total_value, 0, 0
+        FROM bets WHERE status != 'cancelled'
+        UNION ALL
+        SELECT user_id, 0, 0, COALESCE(actual_payout, 0), 0
+        FROM bets WHERE status = 'won'
+        UNION ALL
+        SELECT user_id, 0, 0, 0, COALESCE(gift_value, 0)
+        FROM transactions WHERE type = 'withdrawal' AND status IN ('pending', 'completed')
+        UNION ALL
+        -- Строки из отсоединенных в архив партиций
+        SELECT user_id, 0, total_spent, total_won, total_withdrawn
+        FROM archived_balance_totals
+    ) AS movements
+    GROUP BY user_id
+"""
+
+BALANCE_FIELDS = ("total_deposited", "total_spent", "total_won", "total_withdrawn")
+
+class BalanceService:
+    """Леджер балансов: обновляется в тех же транзакциях, что и движения средств"""
+    
+    async def apply(self, conn, user_id: int, deposited: int = 0, spent: int = 0,
+                    won: int = 0, withdrawn: int = 0):
+        """
+        Изменение баланса пользователя внутри уже открытой транзакции
+        Вызывается из process_deposit, process_withdrawal и пула выводов
+        (ставки списываются пачкой через apply_many, выигрыши - в settlement_service)
+        """
+        await conn.execute("""
+            INSERT INTO user_balances (
+                user_id, total_deposited, total_spent, total_won, total_withdrawn
+            )
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (user_id) DO UPDATE SET
+                total_deposited = user_balances.total_deposited + EXCLUDED.total_deposited,
+                total_spent = user_balances.total_spent + EXCLUDED.total_spent,
+                total_won = user_balances.total_won + EXCLUDED.total_won,
+                total_withdrawn = user_balances.total_withdrawn + EXCLUDED.total_withdrawn,
+                updated_at = NOW()
+        """, user_id, deposited, spent, won, withdrawn)
+        
+    async def apply_many(self, conn, field: str, amounts: Dict[int, int]):
+        """
+        Изменение одного поля баланса сразу для многих пользователей
+        field: deposited / spent / won / withdrawn
+        """
+        if not amounts:
+            return
+            
+        column = f"total_{field}"
+        if column not in BALANCE_FIELDS:
+            raise ValueError(f"Неизвестное поле баланса: {field}")
+            
+        await conn.execute(f"""
+            INSERT INTO user_balances (user_id, {column})
+            SELECT * FROM unnest($1::BIGINT[], $2::BIGINT[])
+            ON CONFLICT (user_id) DO UPDATE SET
+                {column} = user_balances.{column} + EXCLUDED.{column},
+                updated_at = NOW()
+        """, list(amounts.keys()), list(amounts.values()))
+        
+    async def get_balance(self, user_id: int) -> Dict:
+        """Баланс пользователя - один lookup по первичному ключу"""
+        row = await execute_single("""
+            SELECT total_deposited, total_spent, total_won, total_withdrawn
+            FROM user_balances
+            WHERE user_id = $1
+        """, user_id)
+        
+        if not row:
+            return {field: 0 for field in BALANCE_FIELDS}
+            
+        return {field: row[field] for field in BALANCE_FIELDS}
+        
+    async def reconcile(self, fix: bool = False) -> Dict:
+        """
+        Сверка леджера с сырыми таблицами
+        При fix=True расхождения перезаписываются пересчитанными значениями
+        """
+        async with db_manager.pool.acquire() as conn:
+            async with conn.transaction():
+                if fix:
+                    # Блокируем запись в леджер на время пересборки
+                    await conn.execute("LOCK TABLE user_balances IN EXCLUSIVE MODE")
+                    
+                drift_rows = await conn.fetch(f"""
+                    WITH computed AS ({COMPUTED_BALANCES_SQL})
+                    SELECT COALESCE(c.user_id, b.user_id) AS user_id,
+                           COALESCE(c.total_deposited, 0) AS expected_deposited,
+                           COALESCE(c.total_spent, 0) AS expected_spent,
+                           COALESCE(c.total_won, 0) AS expected_won,
+                           COALESCE(c.total_withdrawn, 0) AS expected_withdrawn,
+                           COALESCE(b.total_deposited, 0) AS actual_deposited,
+                           COALESCE(b.total_spent, 0) AS actual_spent,
+                           COALESCE(b.total_won, 0) AS actual_won,
+                           COALESCE(b.total_withdrawn, 0) AS actual_withdrawn
+                    FROM computed c
+                    FULL OUTER JOIN user_balances b ON b.user_id = c.user_id
+                    WHERE COALESCE(c.total_deposited, 0) != COALESCE(b.total_deposited, 0)
+                       OR COALESCE(c.total_spent, 0) != COALESCE(b.total_spent, 0)
+                       OR COALESCE(c.total_won, 0) != COALESCE(b.total_won, 0)
+                       OR COALESCE(c.total_withdrawn, 0) != COALESCE(b.total_withdrawn, 0)
+                """)
+                
+                drift = [dict(row) for row in drift_rows]
+                
+                if fix and drift:
+                    await conn.execute(f"""
+                        WITH computed AS ({COMPUTED_BALANCES_SQL})
+                        INSERT INTO user_balances (
+                            user_id, total_deposited, total_spent, total_won, total_withdrawn
+                        )
+                        SELECT user_id, total_deposited, total_spent, total_won, total_withdrawn
+                        FROM computed
+                        WHERE user_id = ANY($1::BIGINT[])
+                        ON CONFLICT (user_id) DO UPDATE SET
+                            total_deposited = EXCLUDED.total_deposited,
+                            total_spent = EXCLUDED.total_spent,
+                            total_won = EXCLUDED.total_won,
+                            total_withdrawn = EXCLUDED.total_withdrawn,
+                            updated_at = NOW()
+                    """, [row["user_id"] for row in drift])
+                    
+                    # Пользователи, у которых в сырых таблицах ничего не осталось
+                    await conn.execute(f"""
+                        WITH computed AS ({COMPUTED_BALANCES_SQL})
+                        UPDATE user_balances b
+                        SET total_deposited = 0, total_spent = 0,
+                            total_won = 0, total_withdrawn = 0,
+                            updated_at = NOW()
+                        WHERE b.user_id = ANY($1::BIGINT[])
+                        AND NOT EXISTS (SELECT 1 FROM computed c WHERE c.user_id = b.user_id)
+                    """, [row["user_id"] for row in drift])
+                    
+        if drift:
+            print(f"[BALANCE] ⚠️ Расхождения леджера: {len(drift)} пользователей"
+                  f"{' (исправлено)' if fix else ''}")
+        else:
+            print("[BALANCE] ✅ Леджер совпадает с сырыми таблицами")
+            
+        return {
+            "success": True,
+            "drift_count": len(drift),
+            "fixed": fix and bool(drift),
+            "drift": drift
+        }
+
+# Глобальный экземпляр сервиса
+balance_service = BalanceService()
+
+async def _run_reconciliation(fix: bool):
+    """Запуск сверки из командной строки"""
+    await db_manager.initialize()
+    try:
+        result = await balance_service.reconcile(fix=fix)
+        for row in result["drift"]:
+            print(f"[BALANCE] user {row['user_id']}: {row}")
+    finally:
+        await db_manager.close()
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Сверка леджера балансов")
+    parser.add_argument("--fix", action="store_true", help="Перезаписать расхождения")
+    args = parser.parse_args()
+    
+    asyncio.run(_run_reconciliation(args.fix))
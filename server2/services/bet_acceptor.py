@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Прием ставок через per-event очередь
+Ставки на одно событие собираются в пачку и проводятся одной транзакцией,
+поэтому строка events.total_bank блокируется один раз на пачку, а не на каждую ставку
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, List
+from config.settings import settings
+
+class BetRequest:
+    """Запрос на ставку, ожидающий обработки в пачке"""
+    
+    __slots__ = ("user_id", "event_id", "outcome", "outcome_index", "gift_ids", "future")
+    
+    def __init__(self, user_id: int, event_id: int, outcome: str,
+                 outcome_index: int, gift_ids: List[int]):
+        self.user_id = user_id
+        self.event_id = event_id
+        self.outcome = outcome
+        self.outcome_index = outcome_index
+        self.gift_ids = gift_ids
+        self.future = asyncio.get_running_loop().create_future()
+
+BatchHandler = Callable[[int, List[BetRequest]], Awaitable[List[Dict]]]
+
+class BetAcceptor:
+    """
+    Актор приема ставок: одна очередь и один воркер на событие
+    Воркер создается при первой ставке и завершается после простоя
+    """
+    
+    def __init__(self, handler: BatchHandler, batch_size: int = None,
+                 tick_ms: int = None, idle_timeout: float = None):
+        self.handler = handler
+        self.batch_size = batch_size or settings.BET_BATCH_MAX_SIZE
+        self.tick = (settings.BET_BATCH_TICK_MS if tick_ms is None else tick_ms) / 1000
+        self.idle_timeout = idle_timeout or settings.BET_WORKER_IDLE_TIMEOUT
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._closing = False
+        
+        # Метрики
+        self.batches_processed = 0
+        self.bets_processed = 0
+        self.max_batch_size = 0
+    
+    async def submit(self, request: BetRequest) -> Dict:
+        """Постановка ставки в очередь события и ожидание результата"""
+        if self._closing:
+            return {"success": False, "error": "Сервер перезапускается, повторите ставку"}
+            
+        queue = self._queues.get(request.event_id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._queues[request.event_id] = queue
+            self._workers[request.event_id] = asyncio.create_task(
+                self._run_event(request.event_id, queue)
+            )
+            
+        queue.put_nowait(request)
+        return await request.future
+    
+    async def _collect_batch(self, queue: asyncio.Queue, first: BetRequest) -> List[BetRequest]:
+        """Сбор пачки: все, что уже в очереди, плюс то, что придет за один тик"""
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.tick
+        
+        while len(batch) < self.batch_size:
+            if not queue.empty():
+                item = queue.get_nowait()
+            else:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                    
+            if item is None:
+                # Сигнал остановки - вернем его в очередь после текущей пачки
+                queue.put_nowait(None)
+                break
+            batch.append(item)
+            
+        return batch
+    
+    async def _run_event(self, event_id: int, queue: asyncio.Queue):
+        """Воркер события: пачка за пачкой, пока есть ставки"""
+        try:
+            while True:
+                try:
+                    first = await asyncio.wait_for(queue.get(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if queue.empty():
+                        return
+                    continue
+                    
+                if first is None:
+                    return
+                    
+                batch = await self._collect_batch(queue, first)
+                
+                try:
+                    results = await self.handler(event_id, batch)
+                except Exception as e:
+                    print(f"[BETS] ❌ Ошибка обработки пачки ставок события {event_id}: {e}")
+                    results = [{"success": False, "error": f"Ошибка сервера: {str(e)}"}] * len(batch)
+                    
+                for request, result in zip(batch, results):
+                    if not request.future.done():
+                        request.future.set_result(result)
+                        
+                self.batches_processed += 1
+                self.bets_processed += len(batch)
+                self.max_batch_size = max(self.max_batch_size, len(batch))
+        finally:
+            # Между проверкой очереди и удалением нет await - новые ставки не потеряются
+            if self._queues.get(event_id) is queue:
+                del self._queues[event_id]
+                del self._workers[event_id]
+                
+            while not queue.empty():
+                request = queue.get_nowait()
+                if request is not None and not request.future.done():
+                    request.future.set_result(
+                        {"success": False, "error": "Сервер перезапускается, повторите ставку"}
+                    )
+    
+    def get_metrics(self) -> Dict:
+        """Метрики приема ставок"""
+        return {
+            "active_events": len(self._workers),
+            "queued_bets": sum(queue.qsize() for queue in self._queues.values()),
+            "batches_processed": self.batches_processed,
+            "bets_processed": self.bets_processed,
+            "avg_batch_size": round(self.bets_processed / self.batches_processed, 2)
+                              if self.batches_processed else 0,
+            "max_batch_size": self.max_batch_size
+        }
+    
+    async def close(self):
+        """Graceful shutdown: дорабатываем уже принятые в очередь ставки"""
+        self._closing = True
+        workers = list(self._workers.values())
+        
+        for queue in list(self._queues.values()):
+            queue.put_nowait(None)
+            
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
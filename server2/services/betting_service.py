@@ -6,221 +6,365 @@
 
 import json
 import asyncio
-from typing import Dict, List, Optional, Any
-from datetime import datetime, timedelta
+import asyncpg
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Tuple
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from config.settings import settings
 from models.database import db_manager, execute_query, execute_single, execute_insert
+from services.balance_service import balance_service
+from services.bet_acceptor import BetAcceptor, BetRequest
+from services.cluster_bus import (CACHE_EVENTS, CACHE_EVENT_STATS, CACHE_LEADERBOARD,
+                                  KIND_EVENT_STATE, cluster_bus)
+from services.event_feed import event_feed, event_fields
+from services.event_stats_service import event_stats_service
+from services.events_cache import EventsCache
+from services.leaderboard_service import leaderboard_service
+from services.settlement_service import settlement_service
+from services.ws_hub import TOPIC_EVENTS, event_topic, ws_hub
+from utils.pagination import build_page, clamp_limit, decode_cursor, keyset_condition
 
 class BettingService:
     """Сервис для работы со ставками на события"""
     
     def __init__(self):
-        pass
+        self.acceptor = BetAcceptor(self._process_bet_batch)
+        self.events_cache = EventsCache(self._load_active_events)
+        # event_id -> total_bets последнего примененного состояния события
+        self._applied_bets: "OrderedDict[int, int]" = OrderedDict()
+    
+    async def _load_active_events(self) -> List[Dict]:
+        """Загрузка активных событий из БД (источник для кэша)"""
+        events = await execute_query("""
+            SELECT id, title, description, outcomes, coefficients, 
+                   total_bank, status, end_time, created_at
+            FROM events 
+            WHERE status IN ('waiting', 'active') 
+            AND end_time > NOW()
+            ORDER BY end_time ASC
+        """)
+        
+        # Парсим JSON поля
+        for event in events:
+            if isinstance(event['outcomes'], str):
+                event['outcomes'] = json.loads(event['outcomes'])
+            if isinstance(event['coefficients'], str):
+                event['coefficients'] = json.loads(event['coefficients'])
+                
+        return events
     
     async def get_active_events(self) -> List[Dict]:
-        """Получение активных событий для ставок"""
+        """Получение активных событий для ставок (из кэша)"""
         try:
-            events = await execute_query("""
-                SELECT id, title, description, outcomes, coefficients, 
-                       total_bank, status, end_time, created_at
-                FROM events 
-                WHERE status IN ('waiting', 'active') 
-                AND end_time > NOW()
-                ORDER BY end_time ASC
-            """)
-            
-            # Парсим JSON поля
-            for event in events:
-                if isinstance(event['outcomes'], str):
-                    event['outcomes'] = json.loads(event['outcomes'])
-                if isinstance(event['coefficients'], str):
-                    event['coefficients'] = json.loads(event['coefficients'])
-            
-            return events
+            return await self.events_cache.get_events()
             
         except Exception as e:
             print(f"[BETTING] ❌ Ошибка получения событий: {e}")
             return []
     
+    async def get_active_events_response(self) -> Tuple[bytes, str]:
+        """Готовое JSON-тело ленты событий и его ETag"""
+        return await self.events_cache.get_response()
+    
+    async def create_event(self, title: str, outcomes: List[str], coefficients: List[float],
+                           end_time: datetime, description: Optional[str] = None,
+                           start_time: Optional[datetime] = None) -> Dict:
+        """Создание события для ставок"""
+        try:
+            if len(outcomes) < 2 or len(outcomes) != len(coefficients):
+                return {"success": False, "error": "Нужно минимум 2 исхода и коэффициент на каждый"}
+                
+            if end_time <= datetime.now(timezone.utc):
+                return {"success": False, "error": "Время окончания уже прошло"}
+                
+            event = await execute_single("""
+                INSERT INTO events (title, description, outcomes, coefficients, start_time, end_time)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                RETURNING id, title, description, outcomes, coefficients,
+                          total_bank, status, end_time, created_at
+            """, title, description, json.dumps(outcomes), json.dumps(coefficients),
+                start_time, end_time)
+                
+            event['outcomes'] = outcomes
+            event['coefficients'] = coefficients
+            self.events_cache.upsert(event)
+            cluster_bus.invalidate(CACHE_EVENTS)
+            ws_hub.publish(TOPIC_EVENTS, {"type": "event_created", "event": event})
+            
+            print(f"[BETTING] ✅ Событие создано: ID {event['id']} '{title}'")
+            return {"success": True, "event": event}
+            
+        except Exception as e:
+            print(f"[BETTING] ❌ Ошибка создания события: {e}")
+            return {
+                "success": False,
+                "error": f"Ошибка сервера: {str(e)}"
+            }
+    
     async def place_bet(self, user_id: int, event_id: int, outcome: str, 
                        outcome_index: int, gift_ids: List[int]) -> Dict:
-        """Размещение ставки пользователем"""
+        """Размещение ставки пользователем (через очередь приема ставок события)"""
         try:
-            async with db_manager.pool.acquire() as conn:
-                async with conn.transaction():
-                    # Проверяем событие
-                    event = await conn.fetchrow("""
-                        SELECT id, title, outcomes, coefficients, status, end_time
-                        FROM events WHERE id = $1
-                    """, event_id)
-                    
-                    if not event:
-                        return {"success": False, "error": "Событие не найдено"}
-                    
-                    if event['status'] not in ['waiting', 'active']:
-                        return {"success": False, "error": "Ставки на это событие закрыты"}
-                    
-                    if event['end_time'] <= datetime.now():
-                        return {"success": False, "error": "Время для ставок истекло"}
-                    
-                    # Парсим данные события
-                    outcomes = json.loads(event['outcomes']) if isinstance(event['outcomes'], str) else event['outcomes']
-                    coefficients = json.loads(event['coefficients']) if isinstance(event['coefficients'], str) else event['coefficients']
-                    
-                    if outcome_index >= len(outcomes) or outcome_index >= len(coefficients):
-                        return {"success": False, "error": "Неверный индекс исхода"}
-                    
-                    # Проверяем подарки пользователя
-                    gift_values = await conn.fetch("""
-                        SELECT id, num FROM deposits 
-                        WHERE id = ANY($1) AND telegram_user_id = $2
-                    """, gift_ids, user_id)
-                    
-                    if len(gift_values) != len(gift_ids):
-                        return {"success": False, "error": "Некоторые подарки не найдены"}
-                    
-                    # Проверяем, не используются ли подарки в других ставках
-                    used_gifts = await conn.fetchval("""
-                        SELECT COUNT(*) FROM bets 
-                        WHERE user_id = $1 AND status IN ('pending', 'won') 
-                        AND gift_ids ?| $2
-                    """, user_id, [str(gid) for gid in gift_ids])
+            return await self.acceptor.submit(
+                BetRequest(user_id, event_id, outcome, outcome_index, gift_ids)
+            )
+            
+        except Exception as e:
+            print(f"[BETTING] ❌ Ошибка размещения ставки: {e}")
+            return {
+                "success": False,
+                "error": f"Ошибка сервера: {str(e)}"
+            }
+    
+    async def _process_bet_batch(self, event_id: int, requests: List[BetRequest]) -> List[Dict]:
+        """
+        Проведение пачки ставок на одно событие одной транзакцией
+        Событие блокируется один раз, банк увеличивается одним UPDATE
+        """
+        results = []
+        
+        async with db_manager.pool.acquire() as conn:
+            async with conn.transaction():
+                # Проверяем событие и блокируем его строку на время пачки
+                event = await conn.fetchrow("""
+                    SELECT id, title, outcomes, coefficients, status, end_time
+                    FROM events WHERE id = $1
+                    FOR UPDATE
+                """, event_id)
+                
+                if not event:
+                    return [{"success": False, "error": "Событие не найдено"}] * len(requests)
                     
-                    if used_gifts > 0:
-                        return {"success": False, "error": "Некоторые подарки уже используются в других ставках"}
+                if event['status'] not in ['waiting', 'active']:
+                    return [{"success": False, "error": "Ставки на это событие закрыты"}] * len(requests)
                     
-                    # Рассчитываем общую стоимость
-                    total_value = sum(gift['num'] for gift in gift_values)
-                    coefficient = Decimal(str(coefficients[outcome_index]))
-                    potential_payout = int(total_value * coefficient)
+                if event['end_time'] <= datetime.now(timezone.utc):
+                    return [{"success": False, "error": "Время для ставок истекло"}] * len(requests)
                     
-                    # Создаем ставку
-                    bet_id = await conn.fetchval("""
-                        INSERT INTO bets (
-                            user_id, event_id, outcome, outcome_index, 
-                            gift_ids, total_value, coefficient, potential_payout, status
+                # Парсим данные события
+                outcomes = json.loads(event['outcomes']) if isinstance(event['outcomes'], str) else event['outcomes']
+                coefficients = json.loads(event['coefficients']) if isinstance(event['coefficients'], str) else event['coefficients']
+                
+                bank_increment = 0
+                spent_by_user = {}
+                accepted = []
+                bank = None
+                
+                for request in requests:
+                    try:
+                        # Savepoint: ошибка одной ставки не откатывает остальные
+                        async with conn.transaction():
+                            result = await self._insert_bet(conn, request, outcomes, coefficients)
+                    except asyncpg.UniqueViolationError:
+                        result = {"success": False, "error": "Некоторые подарки уже используются в других ставках"}
+                    except Exception as e:
+                        print(f"[BETTING] ❌ Ошибка размещения ставки: {e}")
+                        result = {"success": False, "error": f"Ошибка сервера: {str(e)}"}
+                        
+                    if result["success"]:
+                        bank_increment += result["total_value"]
+                        spent_by_user[request.user_id] = (
+                            spent_by_user.get(request.user_id, 0) + result["total_value"]
                         )
-                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, 'pending')
-                        RETURNING id
-                    """, 
-                        user_id, event_id, outcome, outcome_index,
-                        json.dumps(gift_ids), total_value, coefficient, potential_payout
-                    )
+                        accepted.append({
+                            "user_id": request.user_id,
+                            "outcome_index": request.outcome_index,
+                            "total_value": result["total_value"]
+                        })
+                        
+                    results.append(result)
                     
-                    # Обновляем банк события
-                    await conn.execute("""
+                if bank_increment:
+                    # Обновляем банк события одним запросом на всю пачку
+                    bank = await conn.fetchrow("""
                         UPDATE events 
                         SET total_bank = total_bank + $1,
                             status = CASE WHEN status = 'waiting' THEN 'active' ELSE status END
                         WHERE id = $2
-                    """, total_value, event_id)
+                        RETURNING total_bank, status
+                    """, bank_increment, event_id)
                     
-                    print(f"[BETTING] ✅ Ставка размещена: ID {bet_id}, сумма {total_value} ⭐")
+                    # Списываем ставки в леджере баланса
+                    await balance_service.apply_many(conn, "spent", spent_by_user)
                     
-                    return {
-                        "success": True,
-                        "bet_id": bet_id,
-                        "total_value": total_value,
-                        "coefficient": float(coefficient),
-                        "potential_payout": potential_payout,
-                        "message": f"Ставка на '{outcome}' размещена успешно!"
-                    }
+                    # Счетчики события и исходов
+                    counters = await event_stats_service.record_bets(conn, event_id, accepted, outcomes)
                     
-        except Exception as e:
-            print(f"[BETTING] ❌ Ошибка размещения ставки: {e}")
-            return {
-                "success": False,
-                "error": f"Ошибка сервера: {str(e)}"
+        # Транзакция закоммичена - новые банк и счетчики события в кэши, дельты и другие процессы
+        if bank_increment:
+            state = {
+                "event_id": event_id, "total_bank": bank["total_bank"], "status": bank["status"],
+                "total_stats": counters["total_stats"], "outcome_stats": counters["outcome_stats"]
             }
+            self.apply_event_state(state)
+            cluster_bus.publish(KIND_EVENT_STATE, state)
+            self._publish_bets(event_id, accepted, spent_by_user)
+            
+        for result in results:
+            if result["success"]:
+                print(f"[BETTING] ✅ Ставка размещена: ID {result['bet_id']}, сумма {result['total_value']} ⭐")
+                
+        return results
+    
+    def apply_event_state(self, state: Dict):
+        """
+        Банк и счетчики события после коммита пачки ставок этого или другого процесса:
+        кэш ленты, зеркало счетчиков и дельты WebSocket (склеиваются за тик)
+        """
+        event_id = state["event_id"]
+        total_bets = state["total_stats"]["total_bets"]
+        # Пачки разных процессов приходят не строго в порядке коммитов - более старое состояние
+        # (total_bets только растет) пропускаем
+        if self._applied_bets.get(event_id, 0) >= total_bets:
+            return
+            
+        self._applied_bets[event_id] = total_bets
+        self._applied_bets.move_to_end(event_id)
+        while len(self._applied_bets) > settings.EVENT_STATS_CACHE_SIZE:
+            self._applied_bets.popitem(last=False)
+            
+        self.events_cache.set_bank(event_id, state["total_bank"], state["status"])
+        event_stats_service.apply_counters(event_id, state["total_stats"], state["outcome_stats"])
+        event_feed.update(event_id, event_fields(
+            state["total_bank"], state["status"], state["total_stats"], state["outcome_stats"]
+        ))
     
-    async def get_user_bets(self, user_id: int, limit: int = 20) -> List[Dict]:
-        """Получение ставок пользователя"""
+    def _publish_bets(self, event_id: int, accepted: List[Dict], spent_by_user: Dict[int, int]):
+        """Принятые ставки пачки - подписчикам события, списания - в балансы"""
+        ws_hub.publish(event_topic(event_id), {"type": "bets", "event_id": event_id, "bets": accepted})
+        for user_id, spent in spent_by_user.items():
+            ws_hub.publish_balance(user_id, -spent, "bet", event_id=event_id)
+    
+    async def _insert_bet(self, conn, request: BetRequest, outcomes: List, coefficients: List) -> Dict:
+        """Проверка и запись одной ставки внутри транзакции пачки"""
+        user_id = request.user_id
+        gift_ids = request.gift_ids
+        outcome_index = request.outcome_index
+        
+        if outcome_index >= len(outcomes) or outcome_index >= len(coefficients):
+            return {"success": False, "error": "Неверный индекс исхода"}
+            
+        # Проверяем подарки пользователя; FOR SHARE - параллельный вывод дождется коммита
+        gift_values = await conn.fetch("""
+            SELECT id, num FROM deposits 
+            WHERE id = ANY($1) AND telegram_user_id = $2
+            FOR SHARE
+        """, gift_ids, user_id)
+        
+        if len(gift_values) != len(gift_ids):
+            return {"success": False, "error": "Некоторые подарки не найдены"}
+            
+        # Отдельным запросом после блокировки: видим выводы, закоммиченные пока ждали
+        withdrawn = await conn.fetchval("""
+            SELECT EXISTS (
+                SELECT 1 FROM withdrawals
+                WHERE deposit_id = ANY($1) AND status != 'failed'
+            )
+        """, gift_ids)
+        
+        if withdrawn:
+            return {"success": False, "error": "Некоторые подарки выведены или выводятся"}
+            
+        # Рассчитываем общую стоимость
+        total_value = sum(gift['num'] for gift in gift_values)
+        coefficient = Decimal(str(coefficients[outcome_index]))
+        potential_payout = int(total_value * coefficient)
+        
+        # Создаем ставку
+        bet_id = await conn.fetchval("""
+            INSERT INTO bets (
+                user_id, event_id, outcome, outcome_index, 
+                gift_ids, total_value, coefficient, potential_payout, status
+            )
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, 'pending')
+            RETURNING id
+        """, 
+            user_id, request.event_id, request.outcome, outcome_index,
+            json.dumps(gift_ids), total_value, coefficient, potential_payout
+        )
+        
+        # Резервируем подарки: повторный резерв отсекает уникальный индекс
+        await conn.execute("""
+            INSERT INTO bet_gifts (bet_id, deposit_id)
+            SELECT $1, unnest($2::INTEGER[])
+        """, bet_id, gift_ids)
+        
+        return {
+            "success": True,
+            "bet_id": bet_id,
+            "total_value": total_value,
+            "coefficient": float(coefficient),
+            "potential_payout": potential_payout,
+            "message": f"Ставка на '{request.outcome}' размещена успешно!"
+        }
+    
+    async def get_user_bets(self, user_id: int, limit: int = 20,
+                            cursor: Optional[str] = None) -> Dict:
+        """Страница ставок пользователя (keyset по created_at, id)"""
+        limit = clamp_limit(limit)
+        after, after_args = keyset_condition("b", decode_cursor(cursor), 3)
+        
         try:
-            bets = await execute_query("""
+            bets = await execute_query(f"""
                 SELECT b.*, e.title as event_title, e.status as event_status
                 FROM bets b
                 JOIN events e ON b.event_id = e.id
-                WHERE b.user_id = $1
-                ORDER BY b.created_at DESC
+                WHERE b.user_id = $1 {after}
+                ORDER BY b.created_at DESC, b.id DESC
                 LIMIT $2
-            """, user_id, limit)
+            """, user_id, limit + 1, *after_args)
             
             # Парсим JSON поля
             for bet in bets:
                 if isinstance(bet['gift_ids'], str):
                     bet['gift_ids'] = json.loads(bet['gift_ids'])
             
-            return bets
+            return build_page(bets, limit)
             
         except Exception as e:
             print(f"[BETTING] ❌ Ошибка получения ставок: {e}")
-            return []
+            return {"items": [], "next_cursor": None}
     
     async def process_event_result(self, event_id: int, winner_index: int, 
                                   result_outcome: str) -> Dict:
-        """Обработка результата события"""
+        """Обработка результата события (set-based расчет ставок)"""
         try:
-            async with db_manager.pool.acquire() as conn:
-                async with conn.transaction():
-                    # Обновляем событие
-                    await conn.execute("""
-                        UPDATE events 
-                        SET status = 'finished', 
-                            winner_index = $1, 
-                            result_outcome = $2,
-                            updated_at = NOW()
-                        WHERE id = $3
-                    """, winner_index, result_outcome, event_id)
-                    
-                    # Получаем все ставки на это событие
-                    all_bets = await conn.fetch("""
-                        SELECT id, user_id, outcome_index, total_value, potential_payout
-                        FROM bets 
-                        WHERE event_id = $1 AND status = 'pending'
-                    """, event_id)
-                    
-                    winners_count = 0
-                    losers_count = 0
-                    total_payouts = 0
-                    
-                    for bet in all_bets:
-                        if bet['outcome_index'] == winner_index:
-                            # Выигрышная ставка
-                            await conn.execute("""
-                                UPDATE bets 
-                                SET status = 'won', 
-                                    actual_payout = potential_payout,
-                                    updated_at = NOW()
-                                WHERE id = $1
-                            """, bet['id'])
-                            
-                            winners_count += 1
-                            total_payouts += bet['potential_payout']
-                        else:
-                            # Проигрышная ставка
-                            await conn.execute("""
-                                UPDATE bets 
-                                SET status = 'lost', 
-                                    actual_payout = 0,
-                                    updated_at = NOW()
-                                WHERE id = $1
-                            """, bet['id'])
-                            
-                            losers_count += 1
-                    
-                    print(f"[BETTING] ✅ Событие {event_id} обработано:")
-                    print(f"[BETTING] - Победителей: {winners_count}")
-                    print(f"[BETTING] - Проигравших: {losers_count}")
-                    print(f"[BETTING] - Общие выплаты: {total_payouts} ⭐")
-                    
-                    return {
-                        "success": True,
-                        "winners_count": winners_count,
-                        "losers_count": losers_count,
-                        "total_payouts": total_payouts,
-                        "message": f"Результат события обработан: {result_outcome}"
-                    }
-                    
+            try:
+                summary = await settlement_service.settle_event(
+                    event_id, winner_index, result_outcome
+                )
+            except Exception:
+                # Часть пачек могла закоммититься - счетчики перечитаем из БД
+                event_stats_service.invalidate(event_id)
+                raise
+            finally:
+                # Статус события меняется первым коммитом - убираем его из ленты в любом случае;
+                # другие процессы перечитают ленту и счетчики
+                self.events_cache.invalidate(event_id)
+                cluster_bus.invalidate(CACHE_EVENTS, event_id)
+                cluster_bus.invalidate(CACHE_EVENT_STATS, event_id)
+                
+            event_stats_service.apply_settlement(event_id, summary)
+            
+            print(f"[BETTING] ✅ Событие {event_id} обработано:")
+            print(f"[BETTING] - Победителей: {summary['winners_count']}")
+            print(f"[BETTING] - Проигравших: {summary['losers_count']}")
+            print(f"[BETTING] - Общие выплаты: {summary['total_payouts']} ⭐")
+            
+            # Агрегаты обновлены в том же запросе - перечитываем топ лидерборда
+            try:
+                await leaderboard_service.refresh()
+            except Exception as e:
+                print(f"[BETTING] ⚠️ Не удалось обновить лидерборд: {e}")
+            cluster_bus.invalidate(CACHE_LEADERBOARD)
+            
+            return {
+                "success": True,
+                **summary,
+                "message": f"Результат события обработан: {result_outcome}"
+            }
+            
         except Exception as e:
             print(f"[BETTING] ❌ Ошибка обработки результата: {e}")
             return {
@@ -229,34 +373,9 @@ class BettingService:
             }
     
     async def get_event_stats(self, event_id: int) -> Dict:
-        """Статистика события"""
+        """Статистика события (счетчики event_stats из памяти)"""
         try:
-            stats = await execute_single("""
-                SELECT 
-                    COUNT(*) as total_bets,
-                    COUNT(DISTINCT user_id) as unique_users,
-                    SUM(total_value) as total_volume,
-                    AVG(total_value) as avg_bet_size
-                FROM bets 
-                WHERE event_id = $1
-            """, event_id)
-            
-            # Статистика по исходам
-            outcome_stats = await execute_query("""
-                SELECT 
-                    outcome, outcome_index,
-                    COUNT(*) as bets_count,
-                    SUM(total_value) as total_value
-                FROM bets 
-                WHERE event_id = $1 
-                GROUP BY outcome, outcome_index
-                ORDER BY outcome_index
-            """, event_id)
-            
-            return {
-                "total_stats": stats or {},
-                "outcome_stats": outcome_stats
-            }
+            return await event_stats_service.get_stats(event_id)
             
         except Exception as e:
             print(f"[BETTING] ❌ Ошибка получения статистики: {e}")
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Шина между воркерами uvicorn
+Рассылки WebSocket, новое состояние событий и инвалидация кэшей в памяти передаются
+остальным процессам. Сообщения за тик (CLUSTER_BUS_FLUSH_MS) собираются в пачки и
+уходят одним pg_notify на пачку (по умолчанию) или в Redis pub/sub (CLUSTER_BUS_BACKEND=redis).
+Собственные сообщения процесс пропускает по node_id; после переподключения слушателя
+все зарегистрированные кэши сбрасываются - сообщения за время обрыва потеряны
+"""
+
+import asyncio
+import json
+import uuid
+from typing import Callable, Dict, List, Optional
+from config.settings import settings
+from models.database import db_manager
+
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    aioredis = None
+    REDIS_AVAILABLE = False
+
+# Виды сообщений
+KIND_WS = "ws"
+KIND_EVENT_STATE = "event_state"
+KIND_EVENT_FIELDS = "event_fields"
+KIND_INVALIDATE = "invalidate"
+KIND_RESYNC = "resync"
+
+# Кэши, которые сбрасываются по сообщениям других процессов
+CACHE_EVENTS = "events"
+CACHE_EVENT_STATS = "event_stats"
+CACHE_EVENT_FEED = "event_feed"
+CACHE_LEADERBOARD = "leaderboard"
+
+# Предел payload NOTIFY - 8000 байт, оставляем запас на экранирование
+PG_MAX_PAYLOAD = 7900
+
+def encode_part(kind: str, data) -> str:
+    """JSON одного сообщения (даты и Decimal - строками)"""
+    return json.dumps({"kind": kind, "data": data}, default=str, ensure_ascii=False,
+                      separators=(",", ":"))
+
+class PostgresBusBackend:
+    """LISTEN на отдельном соединении DatabaseManager, NOTIFY - через пул"""
+    
+    name = "postgres"
+    max_payload = PG_MAX_PAYLOAD
+    
+    def __init__(self, channel: str):
+        self.channel = channel
+        self._callback: Optional[Callable[[str], None]] = None
+    
+    async def start(self, on_payload: Callable[[str], None], on_reconnect: Callable[[], None]):
+        self._callback = on_payload
+        await db_manager.listen(self.channel, on_payload, on_reconnect)
+    
+    async def send(self, payloads: List[str]):
+        """Все пачки тика одним запросом"""
+        async with db_manager.pool.acquire() as conn:
+            await conn.execute(
+                "SELECT pg_notify($1, payload) FROM unnest($2::TEXT[]) AS payload",
+                self.channel, payloads
+            )
+    
+    async def close(self):
+        if self._callback is not None:
+            await db_manager.unlisten(self.channel, self._callback)
+            self._callback = None
+
+class RedisBusBackend:
+    """Redis pub/sub: подписка в фоновой задаче с переподключением"""
+    
+    name = "redis"
+    max_payload = None
+    
+    def __init__(self, channel: str, url: str):
+        self.channel = channel
+        self.client = aioredis.from_url(url, decode_responses=True)
+        self._task: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+    
+    async def start(self, on_payload: Callable[[str], None], on_reconnect: Callable[[], None]):
+        self._task = asyncio.create_task(self._listen(on_payload, on_reconnect))
+        await asyncio.wait_for(self._subscribed.wait(), timeout=10)
+    
+    async def _listen(self, on_payload: Callable[[str], None], on_reconnect: Callable[[], None]):
+        delay = settings.DB_LISTEN_RECONNECT_DELAY
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                if self._subscribed.is_set():
+                    print("[BUS] ✅ Подписка Redis восстановлена")
+                    on_reconnect()
+                self._subscribed.set()
+                delay = settings.DB_LISTEN_RECONNECT_DELAY
+                
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        on_payload(message["data"])
+                        
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[BUS] ⚠️ Подписка Redis потеряна: {e}, переподключение через {delay:.0f} с")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+            finally:
+                await asyncio.gather(pubsub.reset(), return_exceptions=True)
+    
+    async def send(self, payloads: List[str]):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for payload in payloads:
+                pipe.publish(self.channel, payload)
+            await pipe.execute()
+    
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.client.close()
+
+class ClusterBus:
+    """Пакетная рассылка сообщений другим процессам и вызов обработчиков для чужих сообщений"""
+    
+    def __init__(self, backend: str = None, channel: str = None, flush_ms: int = None,
+                 queue_size: int = None):
+        self.backend_name = backend or settings.CLUSTER_BUS_BACKEND
+        self.channel = channel or settings.CLUSTER_BUS_CHANNEL
+        self.tick = (settings.CLUSTER_BUS_FLUSH_MS if flush_ms is None else flush_ms) / 1000
+        self.queue_size = queue_size or settings.CLUSTER_BUS_QUEUE_SIZE
+        self.node_id = uuid.uuid4().hex[:12]
+        self.backend = None
+        
+        self._handlers: Dict[str, Callable[[Dict], None]] = {}
+        self._caches: Dict[str, Callable] = {}
+        self._buffer: List[str] = []
+        # Неотправленные payload-ы (сбой БД/Redis): уходят первыми на следующем тике
+        self._unsent: List[str] = []
+        self._unsent_messages = 0
+        self._retry_delay = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        
+        # Метрики
+        self.published = 0
+        self.payloads_sent = 0
+        self.received = 0
+        self.handler_errors = 0
+        self.send_errors = 0
+        self.dropped = 0
+        self.resyncs = 0
+    
+    @property
+    def is_running(self) -> bool:
+        return self.backend is not None
+    
+    def subscribe(self, kind: str, handler: Callable[[Dict], None]):
+        """Обработчик сообщений вида kind от других процессов"""
+        self._handlers[kind] = handler
+    
+    def register_cache(self, name: str, invalidate: Callable):
+        """Кэш процесса: invalidate(key) по сообщениям, invalidate(None) - сброс целиком"""
+        self._caches[name] = invalidate
+    
+    def _select_backend(self):
+        """Бэкенд по CLUSTER_BUS_BACKEND; redis без REDIS_URL или пакета - postgres"""
+        if self.backend_name == "redis":
+            if settings.REDIS_URL and REDIS_AVAILABLE:
+                return RedisBusBackend(self.channel, settings.REDIS_URL)
+            print("[BUS] ⚠️ Redis недоступен (нет REDIS_URL или пакета redis) - используется Postgres")
+        return PostgresBusBackend(self.channel)
+    
+    async def start(self) -> bool:
+        """Подписка на канал и запуск отправки пачек; False - шина выключена или недоступна"""
+        if self.backend_name == "off" or self.is_running:
+            return self.is_running
+            
+        backend = self._select_backend()
+        try:
+            await backend.start(self._on_payload, self.resync)
+        except Exception as e:
+            print(f"[BUS] ❌ Шина не запущена ({backend.name}): {e}")
+            await asyncio.gather(backend.close(), return_exceptions=True)
+            return False
+            
+        self.backend = backend
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        print(f"[BUS] ✅ Шина запущена: {backend.name}, канал {self.channel}, узел {self.node_id}")
+        return True
+    
+    def publish(self, kind: str, data: Dict):
+        """Сообщение другим процессам (после коммита изменений); без ожидания отправки"""
+        if self.backend is None:
+            return
+            
+        if len(self._buffer) >= self.queue_size:
+            # Отправка не успевает - вместо потерянных сообщений остальные сбросят кэши
+            self.dropped += len(self._buffer)
+            print(f"[BUS] ⚠️ Буфер шины переполнен ({self.queue_size}), сообщения заменены на resync")
+            self._buffer = [encode_part(KIND_RESYNC, None)]
+            
+        self._buffer.append(encode_part(kind, data))
+        self.published += 1
+        self._wakeup.set()
+    
+    def invalidate(self, cache: str, key=None):
+        """Сброс записи кэша (или всего кэша) в других процессах"""
+        self.publish(KIND_INVALIDATE, {"cache": cache, "key": key})
+    
+    async def _run(self):
+        """Цикл: ждем первое сообщение, копим тик, отправляем"""
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(max(self.tick, self._retry_delay))
+            self._wakeup.clear()
+            await self.flush()
+    
+    def _pack(self, parts: List[str]) -> List[str]:
+        """Payload-ы не больше предела бэкенда: {"node": ..., "messages": [...]}"""
+        prefix = f'{{"node":"{self.node_id}","messages":['
+        limit = self.backend.max_payload
+        overhead = len(prefix) + 2
+        payloads = []
+        batch: List[str] = []
+        size = overhead
+        
+        for part in parts:
+            part_size = len(part.encode()) + 1
+            if limit and overhead + part_size > limit:
+                self.dropped += 1
+                print(f"[BUS] ⚠️ Сообщение {part_size} байт больше предела NOTIFY, пропущено")
+                continue
+                
+            if batch and limit and size + part_size > limit:
+                payloads.append(prefix + ",".join(batch) + "]}")
+                batch = []
+                size = overhead
+            batch.append(part)
+            size += part_size
+            
+        if batch:
+            payloads.append(prefix + ",".join(batch) + "]}")
+        return payloads
+    
+    async def flush(self):
+        """Отправка накопленных сообщений; при сбое они остаются до следующего тика"""
+        parts, self._buffer = self._buffer, []
+        if (not parts and not self._unsent) or self.backend is None:
+            return
+            
+        payloads = self._unsent + self._pack(parts)
+        messages = self._unsent_messages + len(parts)
+        self._unsent, self._unsent_messages = [], 0
+        try:
+            await self.backend.send(payloads)
+            self.payloads_sent += len(payloads)
+            self._retry_delay = 0.0
+        except Exception as e:
+            # Слушатели других процессов обрыв отправки могут и не заметить - повторяем
+            self.send_errors += 1
+            self._retry_delay = min(max(self._retry_delay * 2, 0.5), 30)
+            print(f"[BUS] ❌ Ошибка отправки {messages} сообщений: {e}, "
+                  f"повтор через {self._retry_delay:.1f} с")
+                  
+            if messages > self.queue_size:
+                # Копить дальше нельзя - вместо потерянных сообщений остальные сбросят кэши
+                self.dropped += messages
+                payloads, messages = self._pack([encode_part(KIND_RESYNC, None)]), 1
+            self._unsent, self._unsent_messages = payloads, messages
+            self._wakeup.set()
+    
+    def _on_payload(self, payload: str):
+        """Пачка из канала: свои сообщения пропускаем, чужие - обработчикам"""
+        try:
+            envelope = json.loads(payload)
+        except ValueError:
+            self.handler_errors += 1
+            return
+            
+        if envelope.get("node") == self.node_id:
+            return
+            
+        for message in envelope.get("messages", ()):
+            self.received += 1
+            try:
+                self._dispatch(message["kind"], message["data"])
+            except Exception as e:
+                self.handler_errors += 1
+                print(f"[BUS] ❌ Ошибка обработки {message.get('kind')}: {e}")
+    
+    def _dispatch(self, kind: str, data):
+        if kind == KIND_INVALIDATE:
+            invalidate = self._caches.get(data["cache"])
+            if invalidate is not None:
+                invalidate(data["key"])
+        elif kind == KIND_RESYNC:
+            self.resync()
+        else:
+            handler = self._handlers.get(kind)
+            if handler is not None:
+                handler(data)
+    
+    def resync(self):
+        """Сообщения могли потеряться - сбрасываем все кэши процесса"""
+        self.resyncs += 1
+        for invalidate in self._caches.values():
+            invalidate(None)
+        if self._caches:
+            print(f"[BUS] ⚠️ Кэши сброшены после потери сообщений: {', '.join(self._caches)}")
+    
+    def get_metrics(self) -> Dict:
+        """Метрики шины"""
+        return {
+            "backend": self.backend.name if self.backend else "off",
+            "node_id": self.node_id,
+            "buffered": len(self._buffer) + self._unsent_messages,
+            "published": self.published,
+            "payloads_sent": self.payloads_sent,
+            "received": self.received,
+            "handler_errors": self.handler_errors,
+            "send_errors": self.send_errors,
+            "dropped": self.dropped,
+            "resyncs": self.resyncs
+        }
+    
+    async def close(self):
+        """Остановка: накопленные сообщения отправляются, подписка снимается"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            
+        if self.backend is not None:
+            await self.flush()
+            await self.backend.close()
+            self.backend = None
+
+# Глобальная шина между процессами
+cluster_bus = ClusterBus()
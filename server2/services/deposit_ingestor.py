@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Пакетный прием депозитов подарков
+Обработчик Pyrogram только кладет депозит в ограниченную очередь,
+а писатель сохраняет накопившуюся пачку несколькими многострочными INSERT
+"""
+
+import asyncio
+from typing import Dict, List, Optional
+from config.settings import settings
+from models.database import db_manager
+from services.balance_service import balance_service
+from services.gift_service import deposit_confirmation_text, gift_service
+from services.outbox_dispatcher import outbox_dispatcher
+from services.ws_hub import ws_hub
+from utils.gift_updates import GiftUpdate
+
+# Депозиты пачки; повтор message_id (в БД или внутри пачки) отсекает уникальный индекс
+INSERT_DEPOSITS_SQL = """
+    INSERT INTO deposits (telegram_user_id, title, slug, num, message_id)
+    SELECT * FROM unnest($1::BIGINT[], $2::VARCHAR[], $3::VARCHAR[], $4::INTEGER[], $5::INTEGER[])
+    ON CONFLICT (message_id) DO NOTHING
+    RETURNING id, telegram_user_id, title, slug, num, message_id
+"""
+
+INSERT_TRANSACTIONS_SQL = """
+    INSERT INTO transactions (
+        user_id, type, deposit_id, gift_title, gift_slug, gift_value,
+        stars_paid, status, telegram_message_id, notes
+    )
+    SELECT t.user_id, 'deposit', t.deposit_id, t.title, t.slug, t.num,
+           t.num, 'completed', t.message_id,
+           'Автоматический депозит пользователя ' || t.user_id
+    FROM unnest($1::BIGINT[], $2::INTEGER[], $3::VARCHAR[], $4::VARCHAR[],
+                $5::INTEGER[], $6::INTEGER[])
+         AS t(user_id, deposit_id, title, slug, num, message_id)
+"""
+
+class DepositRequest:
+    """Депозит, ожидающий записи в пачке"""
+    
+    __slots__ = ("sender_id", "title", "slug", "num", "message_id")
+    
+    def __init__(self, sender_id: int, title: str, slug: str, num: int, message_id: int):
+        self.sender_id = sender_id
+        self.title = title
+        self.slug = slug
+        self.num = num
+        self.message_id = message_id
+
+class DepositIngestor:
+    """
+    Очередь депозитов с пакетной записью
+    Очередь ограничена DEPOSIT_QUEUE_SIZE: при заполнении submit ждет,
+    и обработчик Telegram притормаживает вместо роста памяти
+    """
+    
+    def __init__(self, batch_size: int = None, tick_ms: int = None, queue_size: int = None):
+        self.batch_size = batch_size or settings.DEPOSIT_BATCH_MAX_SIZE
+        self.tick = (settings.DEPOSIT_BATCH_TICK_MS if tick_ms is None else tick_ms) / 1000
+        self.queue_size = queue_size or settings.DEPOSIT_QUEUE_SIZE
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        
+        # Метрики
+        self.batches_written = 0
+        self.deposits_written = 0
+        self.duplicates_skipped = 0
+        self.max_batch_size = 0
+        self.max_queue_depth = 0
+        self.backpressure_waits = 0
+        self.write_errors = 0
+        self.fallback_written = 0
+        self.deposits_lost = 0
+    
+    def start(self):
+        """Запуск писателя"""
+        if self._writer is None or self._writer.done():
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._writer = asyncio.create_task(self._run())
+            print("[DEPOSITS] ✅ Пакетный прием депозитов запущен")
+    
+    async def submit(self, gift: GiftUpdate, sender_id: int, message_id: int) -> bool:
+        """
+        Постановка депозита в очередь (вызывается из обработчика Pyrogram)
+        Без запущенного писателя депозит проводится напрямую
+        """
+        if not sender_id or not gift.slug or gift.transfer_price <= 0:
+            print(f"[DEPOSITS] ⚠️ Недостаточно данных для депозита, message_id: {message_id}")
+            return False
+            
+        if self._writer is None or self._writer.done():
+            result = await gift_service.process_deposit(gift, sender_id, message_id)
+            return result["success"]
+            
+        request = DepositRequest(sender_id, gift.title, gift.slug, gift.transfer_price, message_id)
+        if self._queue.full():
+            self.backpressure_waits += 1
+        await self._queue.put(request)
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return True
+    
+    async def _collect_batch(self, first: DepositRequest) -> List[DepositRequest]:
+        """Пачка: все, что уже в очереди, плюс то, что придет за один тик"""
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.tick
+        
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                item = self._queue.get_nowait()
+            else:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                    
+            if item is None:
+                # Сигнал остановки - вернем его в очередь после текущей пачки
+                self._queue.put_nowait(None)
+                break
+            batch.append(item)
+            
+        return batch
+    
+    async def _run(self):
+        """Писатель: пачка за пачкой до сигнала остановки"""
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                return
+                
+            batch = await self._collect_batch(first)
+            await self._write_with_retry(batch)
+    
+    async def _write_with_retry(self, batch: List[DepositRequest]):
+        """
+        Запись пачки с повторами; после исчерпания - поштучно через gift_service,
+        чтобы один сбойный депозит не терял всю пачку
+        """
+        attempts = settings.DEPOSIT_WRITE_RETRIES + 1
+        for attempt in range(attempts):
+            try:
+                await self.write_batch(batch)
+                return
+            except Exception as e:
+                self.write_errors += 1
+                print(f"[DEPOSITS] ❌ Ошибка записи пачки из {len(batch)} депозитов "
+                      f"(попытка {attempt + 1}): {e}")
+                if attempt + 1 < attempts:
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+                    
+        print(f"[DEPOSITS] ⚠️ Пачка не записана, поштучная запись {len(batch)} депозитов")
+        for request in batch:
+            gift = GiftUpdate(0, request.slug, request.title, 0, request.num)
+            result = await gift_service.process_deposit(gift, request.sender_id, request.message_id)
+            if result["success"]:
+                self.fallback_written += 1
+            elif result.get("duplicate"):
+                self.duplicates_skipped += 1
+            else:
+                self.deposits_lost += 1
+                print(f"[DEPOSITS] ❌ Депозит не сохранен: user {request.sender_id}, "
+                      f"message_id {request.message_id}, {request.title} ({request.num} ⭐)")
+    
+    async def write_batch(self, batch: List[DepositRequest]) -> List[Dict]:
+        """Одна транзакция на пачку: депозиты, транзакции, леджер и уведомления"""
+        deposited_by_user = {}
+        async with db_manager.pool.acquire() as conn:
+            async with conn.transaction():
+                inserted = await conn.fetch(
+                    INSERT_DEPOSITS_SQL,
+                    [r.sender_id for r in batch], [r.title for r in batch],
+                    [r.slug for r in batch], [r.num for r in batch],
+                    [r.message_id for r in batch]
+                )
+                
+                if inserted:
+                    await conn.execute(
+                        INSERT_TRANSACTIONS_SQL,
+                        [row["telegram_user_id"] for row in inserted],
+                        [row["id"] for row in inserted],
+                        [row["title"] for row in inserted],
+                        [row["slug"] for row in inserted],
+                        [row["num"] for row in inserted],
+                        [row["message_id"] for row in inserted]
+                    )
+                    
+                    for row in inserted:
+                        deposited_by_user[row["telegram_user_id"]] = (
+                            deposited_by_user.get(row["telegram_user_id"], 0) + row["num"]
+                        )
+                    await balance_service.apply_many(conn, "deposited", deposited_by_user)
+                    
+                    await outbox_dispatcher.enqueue_many(conn, [
+                        (row["telegram_user_id"], deposit_confirmation_text(row["title"], row["num"]))
+                        for row in inserted
+                    ])
+                    
+        if inserted:
+            outbox_dispatcher.wake()
+            
+        for user_id, deposited in deposited_by_user.items():
+            ws_hub.publish_balance(user_id, deposited, "deposit")
+            
+        self.batches_written += 1
+        self.deposits_written += len(inserted)
+        self.duplicates_skipped += len(batch) - len(inserted)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+        
+        print(f"[DEPOSITS] ✅ Пачка сохранена: {len(inserted)} депозитов"
+              + (f", дублей пропущено: {len(batch) - len(inserted)}" if len(inserted) < len(batch) else ""))
+        return [dict(row) for row in inserted]
+    
+    def get_metrics(self) -> Dict:
+        """Метрики приема депозитов"""
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "backpressure_waits": self.backpressure_waits,
+            "batches_written": self.batches_written,
+            "deposits_written": self.deposits_written,
+            "duplicates_skipped": self.duplicates_skipped,
+            "avg_batch_size": round((self.deposits_written + self.duplicates_skipped)
+                                    / self.batches_written, 2) if self.batches_written else 0,
+            "max_batch_size": self.max_batch_size,
+            "write_errors": self.write_errors,
+            "fallback_written": self.fallback_written,
+            "deposits_lost": self.deposits_lost
+        }
+    
+    async def close(self):
+        """Graceful shutdown: дописываем все, что уже в очереди"""
+        if self._writer is None or self._writer.done():
+            return
+            
+        await self._queue.put(None)
+        await self._writer
+
+# Глобальный экземпляр приемщика депозитов
+deposit_ingestor = DepositIngestor()
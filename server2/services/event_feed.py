@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Дельты банков и счетчиков событий для клиентов WebSocket
+Пачки ставок передают новые значения полей события, за тик (EVENT_DELTA_TICK_MS)
+изменения одного события склеиваются, и подписчики events и event:<id> получают одно
+сообщение только с изменившимися полями и порядковым номером seq события.
+Клиент, у которого seq не следующий за последним, запрашивает snapshot.
+Каждый воркер ведет свои seq: изменения других воркеров приходят через шину
+и склеиваются с локальными
+"""
+
+import asyncio
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from config.settings import settings
+from models.database import db_manager
+from services.event_stats_service import event_stats_service
+from services.ws_hub import TOPIC_EVENTS, event_topic, ws_hub
+
+# Поля счетчиков события и исхода, которые уходят клиентам
+TOTAL_FIELDS = ("total_bets", "unique_users", "total_volume",
+                "winners_count", "losers_count", "total_payouts")
+OUTCOME_FIELDS = ("bets_count", "total_value")
+
+# Поле еще не публиковалось
+MISSING = object()
+
+def event_fields(total_bank: int = None, status: str = None, total_stats: Dict = None,
+                 outcome_stats: List[Dict] = None) -> Dict[str, Any]:
+    """
+    Плоский набор полей события: total_bank, status, счетчики и outcomes.<index>.<поле>
+    Передаются только известные значения - отсутствующие поля не меняются
+    """
+    fields: Dict[str, Any] = {}
+    if total_bank is not None:
+        fields["total_bank"] = total_bank
+    if status is not None:
+        fields["status"] = status
+        
+    for name in TOTAL_FIELDS:
+        if total_stats and total_stats.get(name) is not None:
+            fields[name] = total_stats[name]
+            
+    for row in outcome_stats or ():
+        for name in OUTCOME_FIELDS:
+            fields[f"outcomes.{row['outcome_index']}.{name}"] = row[name]
+    return fields
+
+class EventFeedState:
+    """Опубликованные значения полей события, номер последней дельты и накопленные изменения"""
+    
+    __slots__ = ("seq", "fields", "pending")
+    
+    def __init__(self):
+        self.seq = 0
+        self.fields: Dict[str, Any] = {}
+        self.pending: Dict[str, Any] = {}
+
+class EventFeedPublisher:
+    """Склейка изменений событий за тик и рассылка дельт с seq"""
+    
+    def __init__(self, tick_ms: int = None, max_events: int = None):
+        self.tick = (settings.EVENT_DELTA_TICK_MS if tick_ms is None else tick_ms) / 1000
+        self.max_events = max_events or settings.EVENT_STATS_CACHE_SIZE
+        self._events: "OrderedDict[int, EventFeedState]" = OrderedDict()
+        self._dirty: Dict[int, EventFeedState] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        
+        # Метрики
+        self.updates = 0
+        self.coalesced = 0
+        self.deltas = 0
+        self.fields_sent = 0
+        self.snapshots = 0
+    
+    def start(self):
+        """Запуск рассылки по тику"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            print(f"[FEED] ✅ Дельты событий запущены (тик {int(self.tick * 1000)} мс)")
+    
+    def _state(self, event_id: int) -> EventFeedState:
+        """Состояние события; при переполнении вытесняются давно не менявшиеся"""
+        state = self._events.get(event_id)
+        if state is None:
+            state = EventFeedState()
+            self._events[event_id] = state
+            while len(self._events) > self.max_events:
+                oldest_id, oldest = next(iter(self._events.items()))
+                if oldest_id in self._dirty:
+                    break
+                del self._events[oldest_id]
+        else:
+            self._events.move_to_end(event_id)
+        return state
+    
+    def update(self, event_id: int, fields: Dict[str, Any]):
+        """
+        Новые значения полей события (после коммита)
+        Значения абсолютные: повтор или пропуск промежуточного тика не искажает состояние
+        """
+        state = self._state(event_id)
+        self.updates += 1
+        for name, value in fields.items():
+            if name in state.pending or state.fields.get(name, MISSING) != value:
+                state.pending[name] = value
+                
+        if not state.pending:
+            return
+        if event_id in self._dirty:
+            self.coalesced += 1
+            return
+            
+        self._dirty[event_id] = state
+        if self._task is None or self._task.done():
+            # Без фонового цикла (скрипты, тесты) дельта уходит сразу
+            self.flush()
+        else:
+            self._wakeup.set()
+    
+    async def _run(self):
+        """Цикл: ждем первое изменение, копим тик, рассылаем"""
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.tick)
+            self._wakeup.clear()
+            self.flush()
+    
+    def flush(self):
+        """Рассылка накопленных изменений всех событий"""
+        dirty, self._dirty = self._dirty, {}
+        for event_id, state in dirty.items():
+            self._publish(event_id, state)
+    
+    def _publish(self, event_id: int, state: EventFeedState):
+        """Одна дельта события в ленту событий и подписчикам события"""
+        # Поле могло вернуться к опубликованному значению - такое не отправляем
+        changes = {
+            name: value for name, value in state.pending.items()
+            if state.fields.get(name, MISSING) != value
+        }
+        state.pending = {}
+        if not changes:
+            return
+            
+        state.fields.update(changes)
+        state.seq += 1
+        self.deltas += 1
+        self.fields_sent += len(changes)
+        
+        # seq у каждого процесса свой - дельты в шину не уходят
+        message = {"type": "delta", "event_id": event_id, "seq": state.seq, "changes": changes}
+        ws_hub.publish(TOPIC_EVENTS, message, relay=False)
+        ws_hub.publish(event_topic(event_id), message, relay=False)
+    
+    def update_remote(self, data: Dict):
+        """Поля события, измененные другим воркером"""
+        self.update(data["event_id"], data["fields"])
+    
+    def invalidate(self, event_id: Optional[int] = None):
+        """
+        Забываем разосланные значения (сообщения шины могли потеряться):
+        снимок читается из БД, следующая дельта несет все переданные поля
+        """
+        if event_id is None:
+            states = list(self._events.values())
+        else:
+            states = [self._events[event_id]] if event_id in self._events else []
+            
+        for state in states:
+            state.fields = {}
+    
+    async def _load(self, event_id: int) -> Optional[Dict[str, Any]]:
+        """Полное состояние события из БД и зеркала счетчиков"""
+        async with db_manager.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT total_bank, status FROM events WHERE id = $1", event_id
+            )
+        if row is None:
+            return None
+            
+        stats = await event_stats_service.get_stats(event_id)
+        return event_fields(row["total_bank"], row["status"],
+                            stats["total_stats"], stats["outcome_stats"])
+    
+    async def snapshot(self, event_id: int) -> Optional[Dict]:
+        """
+        Полное состояние события с seq последней разосланной дельты; None - события нет
+        Накопленные изменения события рассылаются до снимка, чтобы seq их учитывал
+        """
+        state = self._dirty.pop(event_id, None)
+        if state is not None:
+            self._publish(event_id, state)
+            
+        loaded = await self._load(event_id)
+        if loaded is None:
+            return None
+            
+        self.snapshots += 1
+        state = self._events.get(event_id)
+        if state is None:
+            return {"type": "snapshot", "event_id": event_id, "seq": 0, "state": loaded}
+        # Разосланные значения не старее прочитанных до их коммита - они главнее
+        return {"type": "snapshot", "event_id": event_id, "seq": state.seq,
+                "state": {**loaded, **state.fields}}
+    
+    def get_metrics(self) -> Dict:
+        """Метрики дельт"""
+        return {
+            "tracked_events": len(self._events),
+            "pending_events": len(self._dirty),
+            "updates": self.updates,
+            "coalesced": self.coalesced,
+            "deltas": self.deltas,
+            "fields_sent": self.fields_sent,
+            "snapshots": self.snapshots
+        }
+    
+    async def close(self):
+        """Остановка: накопленные изменения рассылаются сразу"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.flush()
+
+# Глобальный издатель дельт событий
+event_feed = EventFeedPublisher()
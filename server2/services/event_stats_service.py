@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Счетчики ставок по событиям
+Таблицы event_stats / event_outcome_stats обновляются в транзакции пачки ставок
+и при расчете, чтение идет из зеркала в памяти без агрегатов по bets
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from config.settings import settings
+from models.database import db_manager
+
+class EventStatsService:
+    """Счетчики событий: запись в БД вместе со ставками, чтение из памяти"""
+    
+    def __init__(self, max_events: int = None, ttl: float = None):
+        self.max_events = max_events or settings.EVENT_STATS_CACHE_SIZE
+        self.ttl = settings.EVENTS_CACHE_TTL if ttl is None else ttl
+        # event_id -> (момент загрузки, статистика)
+        self._cache: "OrderedDict[int, tuple]" = OrderedDict()
+        self._generation = 0
+        self._loading: Dict[int, asyncio.Future] = {}
+    
+    async def record_bets(self, conn, event_id: int, bets: List[Dict], outcomes: List) -> Dict:
+        """
+        Учет принятых ставок пачки внутри ее транзакции
+        bets - [{"user_id", "outcome_index", "total_value"}]; возвращает новые значения
+        счетчиков события (total_stats) и затронутых исходов (outcome_stats)
+        """
+        new_users = await conn.fetchval("""
+            WITH inserted AS (
+                INSERT INTO event_bettors (event_id, user_id)
+                SELECT $1, unnest($2::BIGINT[])
+                ON CONFLICT DO NOTHING
+                RETURNING 1
+            )
+            SELECT COUNT(*) FROM inserted
+        """, event_id, list({bet["user_id"] for bet in bets}))
+        
+        total_stats = await conn.fetchrow("""
+            INSERT INTO event_stats (event_id, total_bets, unique_users, total_volume)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (event_id) DO UPDATE SET
+                total_bets = event_stats.total_bets + EXCLUDED.total_bets,
+                unique_users = event_stats.unique_users + EXCLUDED.unique_users,
+                total_volume = event_stats.total_volume + EXCLUDED.total_volume,
+                updated_at = NOW()
+            RETURNING total_bets, unique_users, total_volume
+        """, event_id, len(bets), new_users, sum(bet["total_value"] for bet in bets))
+        
+        by_outcome: Dict[int, List[int]] = {}
+        for bet in bets:
+            counters = by_outcome.setdefault(bet["outcome_index"], [0, 0])
+            counters[0] += 1
+            counters[1] += bet["total_value"]
+            
+        indexes = list(by_outcome)
+        outcome_stats = await conn.fetch("""
+            INSERT INTO event_outcome_stats (event_id, outcome_index, outcome, bets_count, total_value)
+            SELECT $1, t.outcome_index, t.outcome, t.bets_count, t.total_value
+            FROM unnest($2::INTEGER[], $3::VARCHAR[], $4::INTEGER[], $5::BIGINT[])
+                 AS t(outcome_index, outcome, bets_count, total_value)
+            ON CONFLICT (event_id, outcome_index) DO UPDATE SET
+                bets_count = event_outcome_stats.bets_count + EXCLUDED.bets_count,
+                total_value = event_outcome_stats.total_value + EXCLUDED.total_value
+            RETURNING outcome, outcome_index, bets_count, total_value
+        """, event_id, indexes, [str(outcomes[i]) for i in indexes],
+            [by_outcome[i][0] for i in indexes], [by_outcome[i][1] for i in indexes])
+            
+        return {
+            "total_stats": dict(total_stats),
+            "outcome_stats": [dict(row) for row in outcome_stats]
+        }
+    
+    async def _load(self, event_id: int) -> Dict:
+        """Чтение счетчиков события по первичным ключам"""
+        async with db_manager.pool.acquire() as conn:
+            totals = await conn.fetchrow("""
+                SELECT total_bets, unique_users, total_volume,
+                       winners_count, losers_count, total_payouts
+                FROM event_stats WHERE event_id = $1
+            """, event_id)
+            outcomes = await conn.fetch("""
+                SELECT outcome, outcome_index, bets_count, total_value
+                FROM event_outcome_stats
+                WHERE event_id = $1
+                ORDER BY outcome_index
+            """, event_id)
+            
+        return {
+            "total_stats": dict(totals) if totals else {
+                "total_bets": 0, "unique_users": 0, "total_volume": 0,
+                "winners_count": 0, "losers_count": 0, "total_payouts": 0
+            },
+            "outcome_stats": [dict(row) for row in outcomes]
+        }
+    
+    def _store(self, event_id: int, stats: Dict, loaded_at: float):
+        """Запись в LRU-зеркало с вытеснением самых старых событий"""
+        self._cache[event_id] = (loaded_at, stats)
+        self._cache.move_to_end(event_id)
+        while len(self._cache) > self.max_events:
+            self._cache.popitem(last=False)
+    
+    async def get_stats(self, event_id: int) -> Dict:
+        """Статистика события: O(1) из памяти, при промахе - два запроса по PK"""
+        cached = self._cache.get(event_id)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            self._cache.move_to_end(event_id)
+            return self._present(cached[1])
+            
+        # Параллельные промахи по одному событию ждут одну загрузку
+        future = self._loading.get(event_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._loading[event_id] = future
+            generation = self._generation
+            try:
+                stats = await self._load(event_id)
+                # Пока шла загрузка, счетчики патчили - снимок не кэшируем как свежий
+                self._store(event_id, stats,
+                            time.monotonic() if generation == self._generation else 0.0)
+                future.set_result(stats)
+            except Exception as e:
+                future.set_exception(e)
+                # Ожидающих может не быть - помечаем исключение полученным
+                future.exception()
+                raise
+            finally:
+                del self._loading[event_id]
+                
+        return self._present(await future)
+    
+    def _present(self, stats: Dict) -> Dict:
+        """Ответ в прежнем формате get_event_stats + итоги расчета"""
+        totals = dict(stats["total_stats"])
+        totals["avg_bet_size"] = (
+            round(totals["total_volume"] / totals["total_bets"], 2) if totals["total_bets"] else 0
+        )
+        return {
+            "total_stats": totals,
+            "outcome_stats": [dict(row) for row in stats["outcome_stats"]]
+        }
+    
+    def apply_counters(self, event_id: int, total_stats: Dict, outcome_stats: List[Dict]):
+        """
+        Патч зеркала значениями из record_bets после коммита пачки ставок
+        Значения абсолютные - пачки другого процесса применяются так же, как свои
+        """
+        self._generation += 1
+        cached = self._cache.get(event_id)
+        if not cached:
+            return
+            
+        cached[1]["total_stats"].update(total_stats)
+        
+        rows = {row["outcome_index"]: row for row in cached[1]["outcome_stats"]}
+        for row in outcome_stats:
+            rows[row["outcome_index"]] = dict(row)
+            
+        cached[1]["outcome_stats"] = [rows[index] for index in sorted(rows)]
+    
+    def apply_settlement(self, event_id: int, summary: Dict):
+        """Патч зеркала итогами расчета события"""
+        self._generation += 1
+        cached = self._cache.get(event_id)
+        if not cached:
+            return
+            
+        totals = cached[1]["total_stats"]
+        totals["winners_count"] += summary["winners_count"]
+        totals["losers_count"] += summary["losers_count"]
+        totals["total_payouts"] += summary["total_payouts"]
+    
+    def invalidate(self, event_id: Optional[int] = None):
+        """Сброс зеркала события (или всего зеркала)"""
+        self._generation += 1
+        if event_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(event_id, None)
+
+# Глобальный экземпляр сервиса
+event_stats_service = EventStatsService()
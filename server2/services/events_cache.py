@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Кэш ленты активных событий
+Список событий и готовое JSON-тело ответа хранятся в памяти процесса:
+попадание в кэш не обращается к пулу БД, а ETag позволяет отвечать 304
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from config.settings import settings
+
+EventsLoader = Callable[[], Awaitable[List[Dict]]]
+
+def _json_default(value):
+    """Сериализация datetime/Decimal так же, как это делает FastAPI"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+class EventsCache:
+    """
+    Write-through кэш активных событий
+    Ставки обновляют total_bank, создание события добавляет его в кэш,
+    расчет результата инвалидирует. Изменения других процессов приходят
+    через шину, EVENTS_CACHE_TTL ограничивает устаревание при потере сообщений
+    """
+    
+    def __init__(self, loader: EventsLoader, ttl: float = None):
+        self.loader = loader
+        self.ttl = settings.EVENTS_CACHE_TTL if ttl is None else ttl
+        self._events: Dict[int, Dict] = {}
+        self._loaded_at = 0.0
+        # Меняется при добавлении и сбросе событий: такой снимок, прочитанный до изменения, устарел
+        self._generation = 0
+        self._load_lock = asyncio.Lock()
+        # Банк и статус, пришедшие во время загрузки: накладываются на прочитанный снимок
+        self._loading = False
+        self._load_patches: Dict[int, Tuple[int, str]] = {}
+        
+        # Готовый ответ и момент, когда первое событие в нем истечет
+        self._body: Optional[bytes] = None
+        self._etag: Optional[str] = None
+        self._body_expires_at: Optional[datetime] = None
+        
+        # Метрики
+        self.hits = 0
+        self.reloads = 0
+        self.rebuilds = 0
+    
+    def _is_fresh(self) -> bool:
+        """Снимок загружен и не старше TTL"""
+        return bool(self._loaded_at) and time.monotonic() - self._loaded_at < self.ttl
+    
+    async def _reload(self):
+        """Загрузка из БД; параллельные промахи ждут одну загрузку"""
+        async with self._load_lock:
+            if self._is_fresh():
+                return
+                
+            generation = self._generation
+            self._loading = True
+            self._load_patches = {}
+            try:
+                events = await self.loader()
+            finally:
+                self._loading = False
+                
+            self._events = {event["id"]: event for event in events}
+            # Ставки, закоммиченные во время загрузки, не теряем: значения абсолютные,
+            # банк только растет - более старое значение снимок не откатывает
+            for event_id, (total_bank, status) in self._load_patches.items():
+                self._apply_bank(event_id, total_bank, status)
+            self._load_patches = {}
+            self._body = None
+            self.reloads += 1
+            
+            # Пока шла загрузка, события добавляли или сбрасывали - снимок мог устареть
+            self._loaded_at = time.monotonic() if generation == self._generation else 0.0
+    
+    def _build_body(self):
+        """Сериализация ленты: только события, по которым еще принимаются ставки"""
+        now = datetime.now(timezone.utc)
+        events = sorted(
+            (event for event in self._events.values() if event["end_time"] > now),
+            key=lambda event: event["end_time"]
+        )
+        
+        self._body = json.dumps(
+            {"success": True, "events": events, "count": len(events)},
+            default=_json_default, ensure_ascii=False, separators=(",", ":")
+        ).encode()
+        self._etag = f'"{hashlib.blake2b(self._body, digest_size=12).hexdigest()}"'
+        self._body_expires_at = events[0]["end_time"] if events else None
+        self.rebuilds += 1
+    
+    async def get_response(self) -> Tuple[bytes, str]:
+        """Готовое тело ответа и его ETag"""
+        if not self._is_fresh():
+            await self._reload()
+        else:
+            self.hits += 1
+            
+        if (self._body is None or
+                (self._body_expires_at and self._body_expires_at <= datetime.now(timezone.utc))):
+            self._build_body()
+            
+        return self._body, self._etag
+    
+    async def get_events(self) -> List[Dict]:
+        """Активные события (из кэша)"""
+        if not self._is_fresh():
+            await self._reload()
+        else:
+            self.hits += 1
+            
+        now = datetime.now(timezone.utc)
+        return sorted(
+            (dict(event) for event in self._events.values() if event["end_time"] > now),
+            key=lambda event: event["end_time"]
+        )
+    
+    def set_bank(self, event_id: int, total_bank: int, status: str):
+        """Ставки приняты (этим или другим процессом): банк и статус из RETURNING UPDATE events"""
+        if self._loading:
+            self._load_patches[event_id] = (total_bank, status)
+        self._apply_bank(event_id, total_bank, status)
+    
+    def _apply_bank(self, event_id: int, total_bank: int, status: str):
+        """Банк и статус события в снимке, если они не старее уже известных"""
+        event = self._events.get(event_id)
+        if event is None or (event["total_bank"] or 0) > total_bank:
+            return
+            
+        event["total_bank"] = total_bank
+        event["status"] = status
+        self._body = None
+    
+    def upsert(self, event: Dict):
+        """Новое или измененное событие"""
+        self._generation += 1
+        if not self._loaded_at:
+            return
+            
+        if event["status"] in ("waiting", "active"):
+            self._events[event["id"]] = event
+        else:
+            self._events.pop(event["id"], None)
+        self._body = None
+    
+    def invalidate(self, event_id: Optional[int] = None):
+        """Сброс кэша: событие удаляется сразу, остальное перечитается при следующем запросе"""
+        self._generation += 1
+        if event_id is not None:
+            self._events.pop(event_id, None)
+        self._loaded_at = 0.0
+        self._body = None
+    
+    def get_metrics(self) -> Dict:
+        """Метрики кэша событий"""
+        return {
+            "cached_events": len(self._events),
+            "hits": self.hits,
+            "reloads": self.reloads,
+            "rebuilds": self.rebuilds
+        }
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Сервис выгрузки транзакций и ставок
+Потоковая выгрузка NDJSON/CSV через серверный курсор - память не растет с объемом
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import AsyncIterator, List, Optional, Tuple
+from config.settings import settings
+from models.database import stream_query
+
+# Выгружаемые наборы: колонки и поля фильтров
+EXPORT_DATASETS = {
+    "transactions": {
+        "table": "transactions",
+        "columns": [
+            "id", "user_id", "type", "deposit_id", "gift_title", "gift_slug",
+            "gift_value", "stars_paid", "recipient_user_id", "transfer_cost",
+            "status", "telegram_message_id", "notes", "created_at"
+        ],
+        "user_column": "user_id",
+        "type_column": "type",
+    },
+    "bets": {
+        "table": "bets",
+        "columns": [
+            "id", "user_id", "event_id", "outcome", "outcome_index", "gift_ids",
+            "total_value", "coefficient", "potential_payout", "status",
+            "actual_payout", "created_at", "updated_at"
+        ],
+        "user_column": "user_id",
+        "type_column": "status",
+    },
+}
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+def _json_default(value):
+    """Сериализация типов asyncpg, которых нет в json"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+class ExportService:
+    """Потоковая выгрузка данных для админов"""
+    
+    def build_query(self, dataset: str, user_id: Optional[int] = None,
+                    type_filter: Optional[str] = None,
+                    date_from: Optional[datetime] = None,
+                    date_to: Optional[datetime] = None) -> Tuple[str, List]:
+        """SQL выгрузки с фильтрами по пользователю, типу и диапазону дат"""
+        spec = EXPORT_DATASETS[dataset]
+        conditions = []
+        args = []
+        
+        if user_id is not None:
+            args.append(user_id)
+            conditions.append(f"{spec['user_column']} = ${len(args)}")
+        if type_filter:
+            args.append(type_filter)
+            conditions.append(f"{spec['type_column']} = ${len(args)}")
+        if date_from:
+            args.append(date_from)
+            conditions.append(f"created_at >= ${len(args)}")
+        if date_to:
+            args.append(date_to)
+            conditions.append(f"created_at < ${len(args)}")
+            
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"""
+            SELECT {', '.join(spec['columns'])}
+            FROM {spec['table']}
+            {where}
+            ORDER BY created_at, id
+        """
+        return query, args
+    
+    async def stream(self, dataset: str, export_format: str, **filters) -> AsyncIterator[bytes]:
+        """
+        Генератор чанков выгрузки
+        Строки копятся в буфер по EXPORT_CHUNK_ROWS и отдаются одним куском
+        """
+        query, args = self.build_query(dataset, **filters)
+        columns = EXPORT_DATASETS[dataset]["columns"]
+        chunk_rows = settings.EXPORT_CHUNK_ROWS
+        
+        buffer = io.StringIO()
+        writer = None
+        if export_format == "csv":
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            
+        rows_in_buffer = 0
+        rows_total = 0
+        
+        async for record in stream_query(query, *args, prefetch=settings.EXPORT_PREFETCH):
+            if writer:
+                writer.writerow([
+                    _json_default(value) if isinstance(value, (datetime, Decimal)) else value
+                    for value in record.values()
+                ])
+            else:
+                row = dict(record)
+                if isinstance(row.get("gift_ids"), str):
+                    row["gift_ids"] = json.loads(row["gift_ids"])
+                buffer.write(json.dumps(row, default=_json_default, ensure_ascii=False))
+                buffer.write("\n")
+                
+            rows_in_buffer += 1
+            if rows_in_buffer >= chunk_rows:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+                rows_total += rows_in_buffer
+                rows_in_buffer = 0
+                
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+        rows_total += rows_in_buffer
+        
+        print(f"[EXPORT] ✅ Выгрузка {dataset} ({export_format}): {rows_total} строк")
+
+# Глобальный экземпляр сервиса
+export_service = ExportService()
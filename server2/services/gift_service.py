@@ -10,7 +10,16 @@ import asyncio
 from typing import Dict, List, Optional, Any
 from datetime import datetime
 from models.database import db_manager, execute_query, execute_single, execute_insert
-from utils.telegram import send_telegram_message
+from services.balance_service import balance_service
+from services.outbox_dispatcher import outbox_dispatcher
+from services.withdrawal_worker import withdrawal_worker
+from services.ws_hub import ws_hub
+from utils.gift_updates import GiftUpdate
+from utils.pagination import build_page, decode_cursor, fetch_limit, keyset_condition, page_limit
+
+def deposit_confirmation_text(gift_title: str, value: int) -> str:
+    """Текст подтверждения зачисления подарка"""
+    return f"✅ Подарок '{gift_title}' успешно зачислен! Стоимость: {value} ⭐"
 
 class GiftService:
     """Сервис для работы с подарками Telegram"""
@@ -18,16 +27,15 @@ class GiftService:
     def __init__(self, telegram_client=None):
         self.telegram_client = telegram_client
     
-    async def process_deposit(self, gift_data: Dict, sender_id: int, message_id: int) -> Dict:
+    async def process_deposit(self, gift: GiftUpdate, sender_id: int, message_id: int) -> Dict:
         """
         Обработка депозита подарка
         Адаптировано из main.py строки 620-640
         """
         try:
-            gift_slug = gift_data.get("name", "")
-            gift_title = gift_data.get("title", "")
-            gift_num = gift_data.get("collectible_id", 0)
-            transfer_price = gift_data.get("transfer_price", 0)
+            gift_slug = gift.slug
+            gift_title = gift.title
+            transfer_price = gift.transfer_price
             
             print(f"[GIFT] 💎 Обработка депозита:")
             print(f"[GIFT] - Пользователь: {sender_id}")
@@ -42,61 +50,56 @@ class GiftService:
             
             async with db_manager.pool.acquire() as conn:
                 async with conn.transaction():
-                    # Проверяем дубли по message_id
-                    existing = await conn.fetchrow(
-                        "SELECT id FROM deposits WHERE message_id = $1",
-                        message_id
-                    )
+                    # Сохраняем депозит; дубль по message_id отсекает уникальный индекс
+                    deposit_row = await conn.fetchrow("""
+                        INSERT INTO deposits (telegram_user_id, title, slug, num, message_id)
+                        VALUES ($1, $2, $3, $4, $5)
+                        ON CONFLICT (message_id) DO NOTHING
+                        RETURNING id
+                    """, sender_id, gift_title, gift_slug, transfer_price, message_id)
                     
-                    if existing:
+                    if not deposit_row:
                         print(f"[GIFT] ⚠️ Дубль депозита, message_id: {message_id}")
                         return {
                             "success": False,
+                            "duplicate": True,
                             "error": "Депозит уже обработан"
                         }
                     
-                    # Сохраняем депозит
-                    deposit_row = await conn.fetchrow("""
-                        INSERT INTO deposits (telegram_user_id, title, slug, num, message_id)
-                        VALUES ($1, $2, $3, $4, $5)
-                        RETURNING id
-                    """, sender_id, gift_title, gift_slug, transfer_price, message_id)
-                    
                     deposit_id = deposit_row['id']
                     
                     # Сохраняем транзакцию
                     await conn.execute("""
                         INSERT INTO transactions (
-                            user_id, type, gift_title, gift_slug, gift_value, 
+                            user_id, type, deposit_id, gift_title, gift_slug, gift_value, 
                             stars_paid, status, telegram_message_id, notes
                         )
-                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
                     """, 
-                        sender_id, 'deposit', gift_title, gift_slug, transfer_price,
+                        sender_id, 'deposit', deposit_id, gift_title, gift_slug, transfer_price,
                         transfer_price, 'completed', message_id, 
                         f'Автоматический депозит пользователя {sender_id}'
                     )
                     
-                    print(f"[GIFT] ✅ Депозит сохранен: ID {deposit_id}")
-                    
-                    # Отправляем подтверждение
-                    if self.telegram_client:
-                        try:
-                            await send_telegram_message(
-                                self.telegram_client, 
-                                sender_id,
-                                f"✅ Подарок '{gift_title}' успешно зачислен! "
-                                f"Стоимость: {transfer_price} ⭐"
-                            )
-                        except Exception as e:
-                            print(f"[GIFT] ⚠️ Не удалось отправить подтверждение: {e}")
+                    # Обновляем леджер баланса в той же транзакции
+                    await balance_service.apply(conn, sender_id, deposited=transfer_price)
                     
-                    return {
-                        "success": True,
-                        "deposit_id": deposit_id,
-                        "message": f"Депозит {gift_title} успешно обработан"
-                    }
+                    # Подтверждение уходит через outbox после коммита,
+                    # транзакция не ждет сетевой вызов к Telegram
+                    await outbox_dispatcher.enqueue(
+                        conn, sender_id, deposit_confirmation_text(gift_title, transfer_price)
+                    )
                     
+            print(f"[GIFT] ✅ Депозит сохранен: ID {deposit_id}")
+            outbox_dispatcher.wake()
+            ws_hub.publish_balance(sender_id, transfer_price, "deposit")
+            
+            return {
+                "success": True,
+                "deposit_id": deposit_id,
+                "message": f"Депозит {gift_title} успешно обработан"
+            }
+            
         except Exception as e:
             print(f"[GIFT] ❌ Ошибка обработки депозита: {e}")
             return {
@@ -104,60 +107,50 @@ class GiftService:
                 "error": f"Ошибка сервера: {str(e)}"
             }
     
-    async def get_user_deposits(self, user_id: int) -> List[Dict]:
+    async def get_user_deposits(self, user_id: int, limit: int = None,
+                                cursor: Optional[str] = None) -> Dict:
         """
-        Получение депозитов пользователя
+        Страница депозитов пользователя (keyset по created_at, id);
+        без limit и cursor - все депозиты
         Адаптировано из main.py строки 680-684
         """
+        limit = page_limit(limit, cursor)
+        after, after_args = keyset_condition("d", decode_cursor(cursor), 3)
+        
         try:
-            deposits = await execute_query("""
-                SELECT id, title, slug, num, created_at, 
-                       true as can_withdraw
-                FROM deposits 
-                WHERE telegram_user_id = $1 
-                ORDER BY created_at DESC
-            """, user_id)
+            deposits = await execute_query(f"""
+                SELECT d.id, d.title, d.slug, d.num, d.created_at, 
+                       NOT EXISTS (
+                           SELECT 1 FROM bet_gifts bg
+                           WHERE bg.deposit_id = d.id AND bg.is_active
+                       ) AND NOT EXISTS (
+                           SELECT 1 FROM withdrawals w
+                           WHERE w.deposit_id = d.id AND w.status != 'failed'
+                       ) as can_withdraw
+                FROM deposits d
+                WHERE d.telegram_user_id = $1 {after}
+                ORDER BY d.created_at DESC, d.id DESC
+                LIMIT $2
+            """, user_id, fetch_limit(limit), *after_args)
             
-            return deposits
+            return build_page(deposits, limit)
             
         except Exception as e:
             print(f"[GIFT] ❌ Ошибка получения депозитов: {e}")
-            return []
+            return {"items": [], "next_cursor": None}
     
     async def get_user_balance(self, user_id: int) -> Dict:
-        """Получение баланса пользователя в звездах"""
+        """Получение баланса пользователя в звездах (из леджера user_balances)"""
         try:
-            # Общий баланс из депозитов
-            total_deposited = await execute_single("""
-                SELECT COALESCE(SUM(num), 0) as total
-                FROM deposits 
-                WHERE telegram_user_id = $1
-            """, user_id)
-            
-            # Потраченные средства (ставки)
-            total_spent = await execute_single("""
-                SELECT COALESCE(SUM(total_value), 0) as total
-                FROM bets 
-                WHERE user_id = $1 AND status != 'cancelled'
-            """, user_id)
-            
-            # Выигрыши
-            total_won = await execute_single("""
-                SELECT COALESCE(SUM(actual_payout), 0) as total
-                FROM bets 
-                WHERE user_id = $1 AND status = 'won'
-            """, user_id)
-            
-            deposited = total_deposited['total'] if total_deposited else 0
-            spent = total_spent['total'] if total_spent else 0
-            won = total_won['total'] if total_won else 0
+            balance = await balance_service.get_balance(user_id)
             
-            available_balance = deposited - spent + won
+            available_balance = (
+                balance["total_deposited"] - balance["total_spent"]
+                + balance["total_won"] - balance["total_withdrawn"]
+            )
             
             return {
-                "total_deposited": deposited,
-                "total_spent": spent,
-                "total_won": won,
+                **balance,
                 "available_balance": max(0, available_balance)
             }
             
@@ -167,20 +160,23 @@ class GiftService:
                 "total_deposited": 0,
                 "total_spent": 0,
                 "total_won": 0,
+                "total_withdrawn": 0,
                 "available_balance": 0
             }
     
     async def process_withdrawal(self, deposit_id: int, recipient_user_id: int, owner_user_id: int) -> Dict:
         """
-        Обработка вывода подарка
+        Постановка вывода подарка в очередь withdrawals
+        Передачу выполняет withdrawal_worker вне транзакции; повторный запрос
+        по тому же депозиту возвращает уже созданный вывод
         Адаптировано из withdrawal_service.py
         """
         try:
             async with db_manager.pool.acquire() as conn:
                 async with conn.transaction():
-                    # Получаем информацию о депозите
+                    # Блокируем депозит: параллельная ставка этим подарком дождется коммита
                     deposit = await conn.fetchrow(
-                        "SELECT * FROM deposits WHERE id = $1", 
+                        "SELECT * FROM deposits WHERE id = $1 FOR UPDATE", 
                         deposit_id
                     )
                     
@@ -197,49 +193,76 @@ class GiftService:
                             "error": "Нет прав на вывод этого подарка"
                         }
                     
-                    # Проверяем, не был ли уже выведен
+                    # Проверяем, не зарезервирован ли подарок ставкой
+                    reserved = await conn.fetchval("""
+                        SELECT EXISTS (
+                            SELECT 1 FROM bet_gifts
+                            WHERE deposit_id = $1 AND is_active
+                        )
+                    """, deposit_id)
+                    
+                    if reserved:
+                        return {
+                            "success": False,
+                            "error": "Подарок используется в ставке"
+                        }
+                        
+                    # Идемпотентность по депозиту: вывод уже в очереди или выполнен
                     existing_withdrawal = await conn.fetchrow("""
-                        SELECT id FROM transactions 
-                        WHERE telegram_message_id = $1 AND type = 'withdrawal' 
-                        AND status = 'completed'
-                        LIMIT 1
-                    """, deposit['message_id'])
+                        SELECT id, status FROM withdrawals
+                        WHERE deposit_id = $1 AND status != 'failed'
+                    """, deposit_id)
                     
-                    if existing_withdrawal:
+                    if existing_withdrawal and existing_withdrawal['status'] == 'completed':
                         return {
                             "success": False,
                             "error": "Подарок уже был выведен"
                         }
                     
-                    # Создаем транзакцию вывода
-                    await conn.execute("""
+                    if existing_withdrawal:
+                        return {
+                            "success": True,
+                            "withdrawal_id": existing_withdrawal['id'],
+                            "status": existing_withdrawal['status'],
+                            "message": f"Вывод подарка '{deposit['title']}' уже в очереди"
+                        }
+                        
+                    # Создаем транзакцию вывода (completed/failed проставит пул выводов)
+                    transaction_id = await conn.fetchval("""
                         INSERT INTO transactions (
-                            user_id, type, gift_title, gift_slug, gift_value,
+                            user_id, type, deposit_id, gift_title, gift_slug, gift_value,
                             recipient_user_id, status, telegram_message_id, notes
                         )
-                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+                        RETURNING id
                     """,
-                        owner_user_id, 'withdrawal', deposit['title'], 
+                        owner_user_id, 'withdrawal', deposit_id, deposit['title'], 
                         deposit['slug'], deposit['num'], recipient_user_id,
                         'pending', deposit['message_id'],
                         f'Вывод подарка пользователю {recipient_user_id}'
                     )
                     
-                    # TODO: Интеграция с Telegram API для отправки подарка
-                    # Пока что помечаем как выполненную
-                    await conn.execute("""
-                        UPDATE transactions 
-                        SET status = 'completed', notes = notes || ' [SIMULATED]'
-                        WHERE telegram_message_id = $1 AND type = 'withdrawal'
-                    """, deposit['message_id'])
-                    
-                    print(f"[GIFT] ✅ Вывод обработан: {deposit['title']} -> {recipient_user_id}")
+                    withdrawal_id = await conn.fetchval("""
+                        INSERT INTO withdrawals (
+                            deposit_id, owner_user_id, recipient_user_id, gift_value, transaction_id
+                        )
+                        VALUES ($1, $2, $3, $4, $5)
+                        RETURNING id
+                    """, deposit_id, owner_user_id, recipient_user_id, deposit['num'], transaction_id)
                     
-                    return {
-                        "success": True,
-                        "message": f"Подарок '{deposit['title']}' отправлен пользователю {recipient_user_id}"
-                    }
+                    # Подарок списывается с баланса сразу; при неудаче пул выводов вернет его
+                    await balance_service.apply(conn, owner_user_id, withdrawn=deposit['num'])
                     
+            withdrawal_worker.wake()
+            print(f"[GIFT] ✅ Вывод поставлен в очередь: {deposit['title']} -> {recipient_user_id}")
+            
+            return {
+                "success": True,
+                "withdrawal_id": withdrawal_id,
+                "status": "pending",
+                "message": f"Подарок '{deposit['title']}' будет отправлен пользователю {recipient_user_id}"
+            }
+            
         except Exception as e:
             print(f"[GIFT] ❌ Ошибка вывода: {e}")
             return {
@@ -247,20 +270,28 @@ class GiftService:
                 "error": f"Ошибка сервера: {str(e)}"
             }
     
-    async def get_withdrawal_history(self, user_id: int) -> List[Dict]:
-        """История выводов пользователя"""
+    async def get_withdrawal_history(self, user_id: int, limit: int = None,
+                                     cursor: Optional[str] = None) -> Dict:
+        """
+        Страница истории выводов пользователя (keyset по created_at, id);
+        без limit и cursor - вся история
+        """
+        limit = page_limit(limit, cursor)
+        after, after_args = keyset_condition("", decode_cursor(cursor), 3)
+        
         try:
-            history = await execute_query("""
+            history = await execute_query(f"""
                 SELECT * FROM transactions 
-                WHERE user_id = $1 AND type = 'withdrawal' 
-                ORDER BY created_at DESC
-            """, user_id)
+                WHERE user_id = $1 AND type = 'withdrawal' {after}
+                ORDER BY created_at DESC, id DESC
+                LIMIT $2
+            """, user_id, fetch_limit(limit), *after_args)
             
-            return history
+            return build_page(history, limit)
             
         except Exception as e:
             print(f"[GIFT] ❌ Ошибка получения истории: {e}")
-            return []
+            return {"items": [], "next_cursor": None}
 
 # Глобальный экземпляр сервиса
 gift_service = GiftService()
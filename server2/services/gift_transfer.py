@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Бэкенды передачи подарков получателю
+Пул выводов вызывает backend.transfer(withdrawal) вне транзакции БД:
+FloodWait - повтор после паузы, TransferRejected - окончательный отказ,
+любое другое исключение - повтор с экспоненциальной задержкой
+"""
+
+from typing import Dict, Optional
+from config.settings import settings
+
+class TransferRejected(Exception):
+    """Telegram отказал окончательно (подарок недоступен, получатель не найден) - повтор не поможет"""
+
+class SimulatedTransferBackend:
+    """
+    Прежнее поведение process_withdrawal: передача считается выполненной сразу
+    Используется, пока нет интеграции с Telegram API для отправки подарка
+    """
+    
+    name = "simulated"
+    
+    async def transfer(self, withdrawal: Dict) -> Optional[str]:
+        """Пометка в notes транзакции вывода"""
+        return "[SIMULATED]"
+
+def create_transfer_backend(name: str = None):
+    """Бэкенд по имени из WITHDRAWAL_BACKEND"""
+    name = name or settings.WITHDRAWAL_BACKEND
+    if name == "simulated":
+        return SimulatedTransferBackend()
+    raise ValueError(f"Неизвестный бэкенд вывода: {name}")
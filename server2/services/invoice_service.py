@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Идемпотентное создание invoice на оплату вывода
+Ключ - (user_id, отсортированные gift_ids): пока invoice действителен (INVOICE_TTL),
+повторный запрос получает ту же ссылку из памяти или из таблицы invoices,
+одновременные одинаковые запросы ждут один вызов createInvoiceLink
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from config.settings import settings
+from models.database import db_manager
+from utils.telegram import answer_pre_checkout_query, create_payment_invoice
+
+# Действующий invoice ключа; просроченные переводятся в expired, чтобы освободить уникальный индекс
+ACTIVE_INVOICE_SQL = """
+    WITH expired AS (
+        UPDATE invoices SET status = 'expired'
+        WHERE user_id = $1 AND gift_ids = $2 AND status = 'issued' AND expires_at <= NOW()
+    )
+    SELECT invoice_url, total_stars, payload,
+           EXTRACT(EPOCH FROM expires_at - NOW())::FLOAT8 AS ttl
+    FROM invoices
+    WHERE user_id = $1 AND gift_ids = $2 AND status = 'issued' AND expires_at > NOW()
+"""
+
+InvoiceKey = Tuple[int, Tuple[int, ...]]
+
+class InvoiceService:
+    """Кэш выданных invoice со склейкой одинаковых запросов"""
+    
+    def __init__(self, ttl: float = None, max_size: int = None):
+        self.ttl = ttl or settings.INVOICE_TTL
+        self.max_size = max_size or settings.INVOICE_CACHE_SIZE
+        # ключ -> (момент истечения, ответ create_payment_invoice)
+        self._cache: "OrderedDict[InvoiceKey, tuple]" = OrderedDict()
+        self._in_flight: Dict[InvoiceKey, asyncio.Future] = {}
+        
+        # Метрики
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.created = 0
+        self.coalesced = 0
+        self.paid = 0
+    
+    @staticmethod
+    def make_key(user_id: int, gift_ids: Iterable[int]) -> InvoiceKey:
+        """Ключ идемпотентности: порядок и повторы gift_ids не важны"""
+        return int(user_id), tuple(sorted({int(gift_id) for gift_id in gift_ids}))
+    
+    def _remember(self, key: InvoiceKey, result: Dict, ttl: float):
+        """Запись в LRU с вытеснением самых давних"""
+        self._cache[key] = (time.monotonic() + ttl, result)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+    
+    async def get_invoice(self, user_id: int, gift_ids: List[int]) -> Dict:
+        """
+        Ссылка на оплату для набора подарков
+        Действующий invoice переиспользуется (reused=True), иначе создается новый
+        """
+        key = self.make_key(user_id, gift_ids)
+        
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            self._cache.move_to_end(key)
+            self.memory_hits += 1
+            return {**cached[1], "reused": True}
+            
+        future = self._in_flight.get(key)
+        if future:
+            self.coalesced += 1
+            result = await asyncio.shield(future)
+            return {**result, "reused": True} if result["success"] else result
+            
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await self._resolve(key)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже получил вызывающий - ожидающим его отдаст shield
+            future.exception()
+            raise
+        finally:
+            # Вызывающего отменили - ожидающие получат CancelledError, а не зависнут
+            if not future.done():
+                future.cancel()
+            del self._in_flight[key]
+    
+    async def _resolve(self, key: InvoiceKey) -> Dict:
+        """Поиск действующего invoice в БД, иначе createInvoiceLink и запись в invoices"""
+        user_id, gift_ids = key
+        
+        async with db_manager.pool.acquire() as conn:
+            row = await conn.fetchrow(ACTIVE_INVOICE_SQL, user_id, list(gift_ids))
+            
+        if row:
+            self.db_hits += 1
+            return self._from_row(key, row)
+            
+        result = await create_payment_invoice(list(gift_ids), user_id)
+        if not result["success"]:
+            return result
+            
+        async with db_manager.pool.acquire() as conn:
+            row = await conn.fetchrow("""
+                INSERT INTO invoices (user_id, gift_ids, payload, invoice_url, total_stars, expires_at)
+                VALUES ($1, $2, $3, $4, $5, NOW() + make_interval(secs => $6))
+                ON CONFLICT (user_id, gift_ids) WHERE status = 'issued' DO NOTHING
+                RETURNING invoice_url, total_stars, payload,
+                          EXTRACT(EPOCH FROM expires_at - NOW())::FLOAT8 AS ttl
+            """, user_id, list(gift_ids), result["payload"], result["invoice_url"],
+                result["total_stars"], float(self.ttl))
+                
+            if row is None:
+                # Другой процесс успел выдать invoice на тот же ключ - отдаем его ссылку
+                row = await conn.fetchrow(ACTIVE_INVOICE_SQL, user_id, list(gift_ids))
+                
+        self.created += 1
+        if row is None:
+            return {**result, "reused": False}
+        return {**self._from_row(key, row), "reused": row["payload"] != result["payload"]}
+    
+    def _from_row(self, key: InvoiceKey, row) -> Dict:
+        """Ответ из строки invoices с записью в кэш на оставшийся срок"""
+        result = {
+            "success": True,
+            "invoice_url": row["invoice_url"],
+            "total_stars": row["total_stars"],
+            "payload": row["payload"]
+        }
+        self._remember(key, result, row["ttl"])
+        return {**result, "reused": True}
+    
+    async def handle_pre_checkout(self, query: Dict):
+        """
+        Подтверждение оплаты: invoice выдан этому пользователю на эту сумму
+        и ни он, ни другой invoice на те же подарки еще не оплачен
+        """
+        async with db_manager.pool.acquire() as conn:
+            payable = await conn.fetchval("""
+                SELECT TRUE FROM invoices i
+                WHERE i.payload = $1 AND i.user_id = $2 AND i.total_stars = $3
+                  AND i.status != 'paid'
+                  AND NOT EXISTS (
+                      SELECT 1 FROM invoices p
+                      WHERE p.user_id = i.user_id AND p.gift_ids = i.gift_ids AND p.status = 'paid'
+                  )
+            """, query.get("invoice_payload"), query["from"]["id"], query.get("total_amount"))
+            
+        if not payable or query.get("currency") != "XTR":
+            print(f"[INVOICE] ⚠️ Оплата отклонена: {query.get('invoice_payload')}")
+            await answer_pre_checkout_query(query["id"], False, "Счет недействителен или уже оплачен")
+            return
+            
+        await answer_pre_checkout_query(query["id"], True)
+    
+    async def handle_payment_message(self, message: Dict):
+        """successful_payment: invoice помечается оплаченным (повторная доставка ничего не меняет)"""
+        payment = message.get("successful_payment")
+        if not payment:
+            return
+            
+        async with db_manager.pool.acquire() as conn:
+            row = await conn.fetchrow("""
+                UPDATE invoices
+                SET status = 'paid', paid_at = NOW(), telegram_payment_charge_id = $2
+                WHERE payload = $1 AND status != 'paid'
+                RETURNING user_id, gift_ids
+            """, payment.get("invoice_payload"), payment.get("telegram_payment_charge_id"))
+            
+        if row is None:
+            print(f"[INVOICE] ⚠️ Платеж без выданного invoice или повтор: {payment.get('invoice_payload')}")
+            return
+            
+        self.invalidate(row["user_id"], row["gift_ids"])
+        self.paid += 1
+        print(f"[INVOICE] ✅ Invoice оплачен: {payment.get('invoice_payload')} "
+              f"({payment.get('total_amount')} ⭐)")
+    
+    def invalidate(self, user_id: int, gift_ids: List[int]):
+        """Сброс кэша ключа (invoice оплачен или отменен)"""
+        self._cache.pop(self.make_key(user_id, gift_ids), None)
+    
+    def get_metrics(self) -> Dict:
+        """Метрики кэша invoice"""
+        return {
+            "cached": len(self._cache),
+            "in_flight": len(self._in_flight),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "created": self.created,
+            "coalesced": self.coalesced,
+            "paid": self.paid
+        }
+
+# Глобальный экземпляр сервиса
+invoice_service = InvoiceService()
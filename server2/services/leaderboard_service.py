@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Сервис лидерборда
+Агрегаты по игрокам ведутся в leaderboard_stats при расчете ставок,
+топ-K каждого окна держится в памяти и обновляется после расчета
+"""
+
+import asyncio
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from config.settings import settings
+from models.database import execute_query, execute_update
+
+LEADERBOARD_PERIODS = ("day", "week", "all")
+
+# Минимум рассчитанных ставок для попадания в лидерборд (совпадает с индексом)
+LEADERBOARD_MIN_BETS = 3
+
+LEADERBOARD_TOP_SQL = f"""
+    SELECT ls.user_id, up.first_name, up.username,
+           ls.total_bets, ls.won_bets, ls.total_winnings, ls.total_wagered
+    FROM leaderboard_stats ls
+    LEFT JOIN user_profiles up ON up.user_id = ls.user_id
+    WHERE ls.period = $1 AND ls.period_start = $2 AND ls.total_bets >= {LEADERBOARD_MIN_BETS}
+    ORDER BY ls.total_winnings DESC, ls.user_id
+    LIMIT $3
+"""
+
+def period_start(period: str, today: Optional[date] = None) -> date:
+    """Начало текущего окна в UTC (неделя - с понедельника, как date_trunc('week'))"""
+    today = today or datetime.now(timezone.utc).date()
+    if period == "day":
+        return today
+    if period == "week":
+        return today - timedelta(days=today.weekday())
+    return date(1970, 1, 1)
+
+class LeaderboardService:
+    """Топ игроков по выигрышам за день, неделю и все время"""
+    
+    def __init__(self):
+        self.top_k = settings.LEADERBOARD_TOP_K
+        self._top: Dict[str, List[Dict]] = {}
+        self._starts: Dict[str, date] = {}
+        self._refreshed_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+        self._pruned_on: Optional[date] = None
+    
+    def _is_fresh(self) -> bool:
+        """Топ загружен, окна не сменились и снимок не старше TTL"""
+        if not self._refreshed_at:
+            return False
+        if time.monotonic() - self._refreshed_at >= settings.LEADERBOARD_CACHE_TTL:
+            return False
+        return all(self._starts.get(p) == period_start(p) for p in LEADERBOARD_PERIODS)
+    
+    async def refresh(self, force: bool = True):
+        """Перечитывание топ-K всех окон по индексу leaderboard_stats"""
+        async with self._refresh_lock:
+            # Параллельные промахи ждут одно перечитывание
+            if not force and self._is_fresh():
+                return
+                
+            today = datetime.now(timezone.utc).date()
+            top = {}
+            starts = {}
+            
+            for period in LEADERBOARD_PERIODS:
+                starts[period] = period_start(period, today)
+                top[period] = await execute_query(
+                    LEADERBOARD_TOP_SQL, period, starts[period], self.top_k
+                )
+                
+            self._top = top
+            self._starts = starts
+            self._refreshed_at = time.monotonic()
+            
+            if self._pruned_on != today:
+                await self.prune(today)
+                self._pruned_on = today
+    
+    def invalidate(self, key=None):
+        """Топ перечитается при следующем запросе (расчет события в другом процессе)"""
+        self._refreshed_at = 0.0
+    
+    async def prune(self, today: date):
+        """Удаление закрытых дневных и недельных окон старше LEADERBOARD_KEEP_DAYS"""
+        # Текущая неделя началась не раньше 6 дней назад - ее не трогаем
+        cutoff = today - timedelta(days=max(settings.LEADERBOARD_KEEP_DAYS, 7))
+        await execute_update("""
+            DELETE FROM leaderboard_stats
+            WHERE period IN ('day', 'week') AND period_start < $1
+        """, cutoff)
+    
+    async def get_leaderboard(self, period: str = "all", limit: int = 10) -> List[Dict]:
+        """Топ окна: срез из памяти, за пределами K - чтение из rollup-таблицы"""
+        if period not in LEADERBOARD_PERIODS:
+            raise ValueError("Окно лидерборда должно быть day, week или all")
+            
+        limit = min(max(limit, 1), settings.MAX_PAGE_SIZE)
+        
+        if limit > self.top_k:
+            return await execute_query(LEADERBOARD_TOP_SQL, period, period_start(period), limit)
+            
+        if not self._is_fresh():
+            await self.refresh(force=False)
+            
+        return self._top[period][:limit]
+
+# Глобальный экземпляр сервиса
+leaderboard_service = LeaderboardService()
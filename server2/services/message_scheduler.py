@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Планировщик исходящих сообщений Telegram
+Все уведомления (подтверждения депозитов и выводов, результаты ставок, рассылки)
+отправляются отсюда: очередь с приоритетами, лимиты Telegram на чат (MESSAGE_CHAT_RATE)
+и на весь бот (MESSAGE_GLOBAL_RATE), пауза на FloodWait. Несколько ожидающих
+сообщений одному пользователю уходят одним сообщением
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from config.settings import settings
+from utils.rate_limit import RateLimiter, flood_wait_seconds
+
+# Приоритеты: меньше - раньше
+PRIORITY_HIGH = 0    # подтверждения депозитов и выводов
+PRIORITY_NORMAL = 1  # результаты ставок
+PRIORITY_LOW = 2     # рассылки администратора
+
+PRIORITY_NAMES = {PRIORITY_HIGH: "high", PRIORITY_NORMAL: "normal", PRIORITY_LOW: "low"}
+
+# Лимит длины текста сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+# Разделитель склеенных сообщений
+COALESCE_SEPARATOR = "\n\n"
+
+# Отправка одного сообщения в чат: исключение - не доставлено
+MessageSender = Callable[[int, str], Awaitable[None]]
+
+class PendingMessage:
+    """Сообщение, ожидающее отправки"""
+    
+    __slots__ = ("priority", "seq", "text", "queued_at", "future")
+    
+    def __init__(self, priority: int, seq: int, text: str):
+        self.priority = priority
+        self.seq = seq
+        self.text = text
+        self.queued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+class MessageScheduler:
+    """
+    Очередь сообщений по чатам с приоритетами
+    Из кучи (приоритет, порядок) выбирается первый чат, у которого есть токен лимита;
+    чат с ожидающими сообщениями стоит в куче один раз, отправляемый чат - ни разу
+    """
+    
+    def __init__(self, global_rate: float = None, chat_rate: float = None,
+                 concurrency: int = None):
+        self.limiter = RateLimiter(
+            settings.MESSAGE_GLOBAL_RATE if global_rate is None else global_rate,
+            settings.MESSAGE_CHAT_RATE if chat_rate is None else chat_rate
+        )
+        self.concurrency = concurrency or settings.MESSAGE_SEND_CONCURRENCY
+        self.sender: Optional[MessageSender] = None
+        self._pending: Dict[int, List[PendingMessage]] = {}
+        # Куча (приоритет, seq, chat_id); актуальная запись чата - в _queued
+        self._ready: List[Tuple[int, int, int]] = []
+        self._queued: Dict[int, Tuple[int, int]] = {}
+        self._sending: set = set()
+        self._seq = itertools.count()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+        self._closing = False
+        
+        # Метрики
+        self.submitted = 0
+        self.sent = 0
+        self.deliveries = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.flood_waits = 0
+    
+    def start(self, sender: MessageSender):
+        """Запуск фоновой отправки"""
+        self.sender = sender
+        self._closing = False
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            print("[MESSAGES] ✅ Планировщик сообщений запущен")
+    
+    async def send(self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL):
+        """
+        Постановка сообщения в очередь и ожидание отправки
+        Ошибка Telegram (в т.ч. FloodWait) пробрасывается вызывающему
+        """
+        if self._task is None or self._task.done():
+            raise ConnectionError("Планировщик сообщений не запущен")
+            
+        message = PendingMessage(priority, next(self._seq), text)
+        self._pending.setdefault(chat_id, []).append(message)
+        self.submitted += 1
+        self._schedule(chat_id)
+        self._wakeup.set()
+        
+        await message.future
+    
+    def _schedule(self, chat_id: int):
+        """Чат с ожидающими сообщениями - в кучу с приоритетом самого срочного"""
+        if chat_id in self._sending:
+            # Вернется в кучу после текущей отправки
+            return
+            
+        priority = min(message.priority for message in self._pending[chat_id])
+        queued = self._queued.get(chat_id)
+        if queued and queued[0] <= priority:
+            return
+            
+        # Прежняя запись чата в куче становится устаревшей
+        entry = (priority, next(self._seq), chat_id)
+        self._queued[chat_id] = entry[:2]
+        heapq.heappush(self._ready, entry)
+    
+    def _pick(self) -> Tuple[Optional[int], Optional[float]]:
+        """
+        Самый срочный чат, которому можно отправить сейчас
+        Иначе (None, через сколько проверить снова; None - ждать новых сообщений)
+        """
+        wait = self.limiter.delay()
+        if wait > 0:
+            return None, wait
+            
+        picked, wait, blocked = None, None, []
+        while self._ready:
+            entry = heapq.heappop(self._ready)
+            priority, seq, chat_id = entry
+            if self._queued.get(chat_id) != (priority, seq):
+                continue
+                
+            delay = self.limiter.delay(chat_id)
+            if delay > 0:
+                # Чату недавно писали - пропускаем вперед следующих
+                blocked.append(entry)
+                wait = delay if wait is None else min(wait, delay)
+                continue
+                
+            del self._queued[chat_id]
+            self.limiter.try_acquire(chat_id)
+            picked = chat_id
+            break
+            
+        for entry in blocked:
+            heapq.heappush(self._ready, entry)
+        return picked, wait
+    
+    def _take(self, chat_id: int) -> List[PendingMessage]:
+        """Ожидающие сообщения чата, которые помещаются в одно сообщение Telegram"""
+        pending = sorted(
+            (message for message in self._pending.pop(chat_id, []) if not message.future.done()),
+            key=lambda message: (message.priority, message.seq)
+        )
+        
+        taken, length = [], 0
+        for message in pending:
+            added = len(message.text) + (len(COALESCE_SEPARATOR) if taken else 0)
+            if taken and length + added > MAX_MESSAGE_LENGTH:
+                break
+            taken.append(message)
+            length += added
+            
+        rest = pending[len(taken):]
+        if rest:
+            self._pending[chat_id] = rest
+        return taken
+    
+    async def _run(self):
+        """Цикл: берем слот отправки, выбираем чат, отправляем в отдельной задаче"""
+        while not self._closing:
+            await self._semaphore.acquire()
+            if self._closing:
+                self._semaphore.release()
+                break
+                
+            self._wakeup.clear()
+            chat_id, wait = self._pick()
+            
+            if chat_id is None:
+                self._semaphore.release()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+                
+            messages = self._take(chat_id)
+            if not messages:
+                # Все ожидавшие отправку уже отменены
+                self._semaphore.release()
+                continue
+                
+            self._sending.add(chat_id)
+            task = asyncio.create_task(self._deliver(chat_id, messages))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _deliver(self, chat_id: int, messages: List[PendingMessage]):
+        """Отправка склеенного текста; результат - всем вошедшим в него сообщениям"""
+        try:
+            await self.sender(chat_id, COALESCE_SEPARATOR.join(m.text for m in messages))
+            
+            for message in messages:
+                if not message.future.done():
+                    message.future.set_result(None)
+            self.sent += len(messages)
+            self.deliveries += 1
+            self.coalesced += len(messages) - 1
+            
+        except Exception as e:
+            retry_after = flood_wait_seconds(e)
+            if retry_after is not None:
+                # FloodWait относится ко всему боту - останавливаем все отправки
+                self.flood_waits += 1
+                self.limiter.flood_wait(retry_after)
+                
+            for message in messages:
+                if not message.future.done():
+                    message.future.set_exception(e)
+            self.failed += len(messages)
+            print(f"[MESSAGES] ❌ Ошибка отправки в чат {chat_id}: {e}")
+            
+        finally:
+            self._sending.discard(chat_id)
+            self._semaphore.release()
+            if chat_id in self._pending:
+                self._schedule(chat_id)
+            self._wakeup.set()
+    
+    def get_metrics(self) -> Dict:
+        """Метрики очереди и отправки"""
+        now = time.monotonic()
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        oldest = None
+        
+        for messages in self._pending.values():
+            for message in messages:
+                name = PRIORITY_NAMES.get(message.priority, str(message.priority))
+                queued[name] = queued.get(name, 0) + 1
+                if oldest is None or message.queued_at < oldest:
+                    oldest = message.queued_at
+                    
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "queued": queued,
+            "queued_chats": len(self._pending),
+            "sending_chats": len(self._sending),
+            "oldest_wait_seconds": round(now - oldest, 3) if oldest is not None else 0,
+            "submitted": self.submitted,
+            "sent": self.sent,
+            "deliveries": self.deliveries,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "flood_waits": self.flood_waits,
+            "limiter": self.limiter.get_metrics()
+        }
+    
+    async def close(self, timeout: float = 10):
+        """
+        Остановка: начатые отправки дорабатываются до timeout,
+        ожидающие сообщения отменяются (outbox повторит их после аренды)
+        """
+        if not self._task or self._task.done():
+            return
+            
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        
+        if self._tasks:
+            done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                print(f"[MESSAGES] ⚠️ Прервано отправок: {len(pending)}")
+                
+        for messages in self._pending.values():
+            for message in messages:
+                message.future.cancel()
+        self._pending.clear()
+        self._ready.clear()
+        self._queued.clear()
+        print("[MESSAGES] Планировщик сообщений остановлен")
+
+# Глобальный планировщик сообщений
+message_scheduler = MessageScheduler()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Transactional outbox для уведомлений Telegram
+Сообщение записывается в outbox в той же транзакции, что и бизнес-операция,
+а диспетчер доставляет его после коммита: соединение с БД не удерживается
+на время сетевого вызова, доставка - at-least-once.
+Сообщения забираются по приоритету и передаются планировщику отправки,
+следующая пачка забирается, не дожидаясь доставки предыдущей
+"""
+
+import asyncio
+import json
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from config.settings import settings
+from models.database import db_manager
+from services.message_scheduler import PRIORITY_HIGH, PRIORITY_LOW
+from utils.rate_limit import flood_wait_seconds
+
+# Отправка одного сообщения (chat_id, payload, priority): исключение - попытка не удалась
+OutboxSender = Callable[[int, Dict, int], Awaitable[None]]
+
+# Захват пачки к отправке. Захваченная строка получает аренду (next_attempt_at в будущем):
+# если процесс упадет во время отправки, после аренды ее заберет другой диспетчер
+CLAIM_SQL = """
+    UPDATE outbox o
+    SET status = 'sending',
+        attempts = o.attempts + 1,
+        next_attempt_at = NOW() + make_interval(secs => $2)
+    FROM (
+        SELECT id FROM outbox
+        WHERE status IN ('pending', 'sending') AND next_attempt_at <= NOW()
+        ORDER BY priority, next_attempt_at, id
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    ) AS due
+    WHERE o.id = due.id
+    RETURNING o.id, o.kind, o.chat_id, o.payload, o.priority, o.attempts
+"""
+
+class OutboxDispatcher:
+    """
+    Фоновая доставка сообщений из outbox с ретраями
+    В доставке одновременно не больше OUTBOX_CONCURRENCY сообщений
+    """
+    
+    def __init__(self):
+        self.sender: Optional[OutboxSender] = None
+        self._task: Optional[asyncio.Task] = None
+        self._batches: set = set()
+        self._in_flight = 0
+        self._wakeup = asyncio.Event()
+        self._slot_freed = asyncio.Event()
+        self._closing = False
+        
+        # Метрики
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+    
+    async def enqueue(self, conn, chat_id: int, text: str, kind: str = "telegram_message",
+                      priority: int = PRIORITY_HIGH):
+        """Запись сообщения в outbox внутри уже открытой транзакции"""
+        await conn.execute("""
+            INSERT INTO outbox (kind, chat_id, payload, priority)
+            VALUES ($1, $2, $3, $4)
+        """, kind, chat_id, json.dumps({"text": text}, ensure_ascii=False), priority)
+    
+    async def enqueue_many(self, conn, messages: List[Tuple[int, str]],
+                           kind: str = "telegram_message", priority: int = PRIORITY_HIGH):
+        """Запись пачки сообщений (chat_id, text) одним INSERT"""
+        if not messages:
+            return
+            
+        await conn.execute("""
+            INSERT INTO outbox (kind, chat_id, payload, priority)
+            SELECT $1, m.chat_id, jsonb_build_object('text', m.text), $4
+            FROM unnest($2::BIGINT[], $3::TEXT[]) AS m(chat_id, text)
+        """, kind, [chat_id for chat_id, _ in messages], [text for _, text in messages], priority)
+    
+    async def broadcast(self, text: str, user_ids: Optional[List[int]] = None) -> int:
+        """
+        Рассылка с низким приоритетом: по строке outbox на пользователя одним INSERT
+        user_ids=None - всем пользователям из user_profiles; возвращает число сообщений
+        """
+        async with db_manager.pool.acquire() as conn:
+            queued = await conn.fetchval("""
+                WITH queued AS (
+                    INSERT INTO outbox (kind, chat_id, payload, priority)
+                    SELECT 'broadcast', up.user_id, jsonb_build_object('text', $1::TEXT), $2
+                    FROM user_profiles up
+                    WHERE $3::BIGINT[] IS NULL OR up.user_id = ANY($3::BIGINT[])
+                    RETURNING 1
+                )
+                SELECT COUNT(*) FROM queued
+            """, text, PRIORITY_LOW, user_ids)
+            
+        self.wake()
+        return queued
+    
+    def wake(self):
+        """Сигнал диспетчеру после коммита: в outbox появились сообщения"""
+        self._wakeup.set()
+    
+    def start(self, sender: OutboxSender):
+        """Запуск фоновой доставки"""
+        self.sender = sender
+        self._closing = False
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            print("[OUTBOX] ✅ Диспетчер уведомлений запущен")
+    
+    async def _run(self):
+        """
+        Цикл: пока есть свободные места, забираем пачку и отдаем ее в доставку
+        отдельной задачей; иначе ждем пробуждения или таймера опроса
+        """
+        while not self._closing:
+            free = settings.OUTBOX_CONCURRENCY - self._in_flight
+            if free <= 0:
+                self._slot_freed.clear()
+                await self._slot_freed.wait()
+                continue
+                
+            try:
+                rows = await self._claim(min(settings.OUTBOX_BATCH_SIZE, free))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[OUTBOX] ❌ Ошибка диспетчера: {e}")
+                rows = []
+                
+            if rows:
+                self._in_flight += len(rows)
+                task = asyncio.create_task(self._deliver_batch(rows))
+                self._batches.add(task)
+                task.add_done_callback(self._batches.discard)
+                continue
+                
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+    
+    async def _claim(self, limit: int) -> List:
+        """Захват пачки короткой транзакцией"""
+        async with db_manager.pool.acquire() as conn:
+            return await conn.fetch(CLAIM_SQL, limit, settings.OUTBOX_LEASE_SECONDS)
+    
+    async def dispatch_once(self) -> int:
+        """Одна пачка: захват и доставка с ожиданием результата"""
+        rows = await self._claim(settings.OUTBOX_BATCH_SIZE)
+        if rows:
+            self._in_flight += len(rows)
+            await self._deliver_batch(rows)
+        return len(rows)
+    
+    async def _deliver_batch(self, rows: List):
+        """Отправка пачки вне транзакции и запись результатов"""
+        try:
+            await self._record(rows, await asyncio.gather(*(self._deliver(row) for row in rows)))
+        except Exception as e:
+            # Строки остались в sending - их заберут снова после аренды
+            print(f"[OUTBOX] ❌ Ошибка записи результатов доставки: {e}")
+        finally:
+            self._in_flight -= len(rows)
+            self._slot_freed.set()
+    
+    async def _record(self, rows: List, results: List[Optional[Exception]]):
+        """Отметка отправленных и планирование повторов одной парой запросов"""
+        sent_ids = [row["id"] for row, error in zip(rows, results) if error is None]
+        failures = [(row, error) for row, error in zip(rows, results) if error is not None]
+        
+        async with db_manager.pool.acquire() as conn:
+            if sent_ids:
+                await conn.execute("""
+                    UPDATE outbox SET status = 'sent', sent_at = NOW(), last_error = NULL
+                    WHERE id = ANY($1::BIGINT[])
+                """, sent_ids)
+                
+            if failures:
+                await self._record_failures(conn, failures)
+                
+        self.sent += len(sent_ids)
+    
+    async def _deliver(self, row) -> Optional[Exception]:
+        """Отправка одного сообщения; None - успех, иначе ошибка"""
+        try:
+            payload = row["payload"]
+            if isinstance(payload, str):
+                payload = json.loads(payload)
+            await self.sender(row["chat_id"], payload, row["priority"])
+            return None
+        except Exception as e:
+            return e
+    
+    async def _record_failures(self, conn, failures: List):
+        """Повтор с экспоненциальной задержкой или failed после OUTBOX_MAX_ATTEMPTS"""
+        ids, statuses, delays, errors = [], [], [], []
+        
+        for row, error in failures:
+            # FloodWait сообщает, сколько ждать; иначе - экспоненциальная задержка
+            retry_after = flood_wait_seconds(error)
+            if retry_after is None:
+                retry_after = min(
+                    settings.OUTBOX_RETRY_BASE_SECONDS * 2 ** (row["attempts"] - 1),
+                    settings.OUTBOX_RETRY_MAX_SECONDS
+                )
+                
+            exhausted = row["attempts"] >= settings.OUTBOX_MAX_ATTEMPTS
+            ids.append(row["id"])
+            statuses.append("failed" if exhausted else "pending")
+            delays.append(float(retry_after))
+            errors.append(str(error)[:500])
+            
+            if exhausted:
+                self.failed += 1
+                print(f"[OUTBOX] ❌ Сообщение {row['id']} для {row['chat_id']} не доставлено "
+                      f"после {row['attempts']} попыток: {error}")
+            else:
+                self.retried += 1
+                
+        await conn.execute("""
+            UPDATE outbox o
+            SET status = f.status,
+                next_attempt_at = NOW() + make_interval(secs => f.delay),
+                last_error = f.error
+            FROM unnest($1::BIGINT[], $2::VARCHAR[], $3::FLOAT8[], $4::TEXT[])
+                 AS f(id, status, delay, error)
+            WHERE o.id = f.id
+        """, ids, statuses, delays, errors)
+    
+    def get_metrics(self) -> Dict:
+        """Метрики доставки"""
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "in_flight": self._in_flight,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed
+        }
+    
+    async def close(self, timeout: float = 10):
+        """
+        Остановка диспетчера: начатые пачки дорабатываются до timeout,
+        прерванные отправки будут повторены после аренды
+        """
+        if not self._task or self._task.done():
+            return
+            
+        self._closing = True
+        self._wakeup.set()
+        self._slot_freed.set()
+        await self._task
+        
+        if self._batches:
+            done, pending = await asyncio.wait(set(self._batches), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                print("[OUTBOX] ⚠️ Диспетчер остановлен, не дождавшись текущих пачек")
+
+# Глобальный диспетчер outbox
+outbox_dispatcher = OutboxDispatcher()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Движок расчета ставок по результату события
+Set-based обновление вместо UPDATE на каждую ставку
+"""
+
+from typing import Dict, Optional
+from config.settings import settings
+from models.database import db_manager
+from services.cluster_bus import KIND_EVENT_FIELDS, cluster_bus
+from services.event_feed import event_feed
+from services.message_scheduler import PRIORITY_NORMAL
+from services.outbox_dispatcher import outbox_dispatcher
+from services.ws_hub import TOPIC_EVENTS, event_topic, ws_hub
+
+# Перевод пачки pending-ставок в won/lost одним запросом.
+# Выигрыши сразу зачисляются в леджер балансов, агрегаты лидерборда
+# и счетчики события обновляются в том же запросе, итоги считаются в SQL.
+# Уведомления о результате пишутся в outbox одной строкой на пользователя в пачке
+# ($4 - заголовок уведомления, NULL - без уведомлений), выплаты по пользователям
+# возвращаются для рассылки по WebSocket.
+SETTLE_BETS_SQL = """
+    WITH batch AS (
+        SELECT id, created_at FROM bets
+        WHERE event_id = $1 AND status = 'pending'
+        ORDER BY id
+        LIMIT $3
+        FOR UPDATE
+    ), settled AS (
+        UPDATE bets b
+        SET status = CASE WHEN b.outcome_index = $2 THEN 'won' ELSE 'lost' END,
+            actual_payout = CASE WHEN b.outcome_index = $2 THEN b.potential_payout ELSE 0 END,
+            updated_at = NOW()
+        FROM batch
+        -- created_at - ключ партиции: строка ищется по PK (id, created_at)
+        WHERE b.id = batch.id AND b.created_at = batch.created_at
+        RETURNING b.id, b.user_id, b.status, b.actual_payout, b.total_value
+    ), released AS (
+        -- Проигравшие ставки снимают резерв с подарков
+        UPDATE bet_gifts bg
+        SET is_active = FALSE
+        FROM settled
+        WHERE bg.bet_id = settled.id AND settled.status = 'lost'
+    ), won AS (
+        SELECT user_id, SUM(actual_payout) AS payout
+        FROM settled
+        WHERE status = 'won'
+        GROUP BY user_id
+    ), payouts AS (
+        INSERT INTO user_balances (user_id, total_won)
+        SELECT user_id, payout FROM won
+        ON CONFLICT (user_id) DO UPDATE SET
+            total_won = user_balances.total_won + EXCLUDED.total_won,
+            updated_at = NOW()
+    ), leaderboard AS (
+        -- Агрегаты лидерборда за текущий день, неделю и все время (UTC)
+        INSERT INTO leaderboard_stats (
+            period, period_start, user_id, total_bets, won_bets, total_winnings, total_wagered
+        )
+        SELECT w.period, w.period_start, settled.user_id,
+               COUNT(*),
+               COUNT(*) FILTER (WHERE settled.status = 'won'),
+               SUM(settled.actual_payout),
+               SUM(settled.total_value)
+        FROM settled
+        CROSS JOIN (
+            VALUES
+                ('day', date_trunc('day', NOW() AT TIME ZONE 'UTC')::DATE),
+                ('week', date_trunc('week', NOW() AT TIME ZONE 'UTC')::DATE),
+                ('all', DATE '1970-01-01')
+        ) AS w(period, period_start)
+        GROUP BY w.period, w.period_start, settled.user_id
+        ON CONFLICT (period, period_start, user_id) DO UPDATE SET
+            total_bets = leaderboard_stats.total_bets + EXCLUDED.total_bets,
+            won_bets = leaderboard_stats.won_bets + EXCLUDED.won_bets,
+            total_winnings = leaderboard_stats.total_winnings + EXCLUDED.total_winnings,
+            total_wagered = leaderboard_stats.total_wagered + EXCLUDED.total_wagered
+    ), event_totals AS (
+        -- Итоги расчета в счетчиках события
+        UPDATE event_stats es
+        SET winners_count = es.winners_count + t.winners,
+            losers_count = es.losers_count + t.losers,
+            total_payouts = es.total_payouts + t.payouts,
+            updated_at = NOW()
+        FROM (
+            SELECT COUNT(*) FILTER (WHERE status = 'won') AS winners,
+                   COUNT(*) FILTER (WHERE status = 'lost') AS losers,
+                   COALESCE(SUM(actual_payout), 0) AS payouts
+            FROM settled
+        ) AS t
+        WHERE es.event_id = $1
+    ), notifications AS (
+        INSERT INTO outbox (kind, chat_id, payload, priority)
+        SELECT 'bet_result', user_id,
+               jsonb_build_object('text', CASE
+                   WHEN SUM(actual_payout) > 0
+                   THEN $4 || E'\n🎉 Выигрыш: +' || SUM(actual_payout) || ' ⭐'
+                   ELSE $4 || E'\nСтавка не сыграла'
+               END),
+               $5
+        FROM settled
+        WHERE $4::TEXT IS NOT NULL
+        GROUP BY user_id
+    )
+    SELECT COUNT(*) FILTER (WHERE status = 'won') AS winners_count,
+           COUNT(*) FILTER (WHERE status = 'lost') AS losers_count,
+           COALESCE(SUM(actual_payout) FILTER (WHERE status = 'won'), 0) AS total_payouts,
+           -- Выплаты по пользователям - для обновления балансов у клиентов WebSocket
+           (SELECT array_agg(user_id ORDER BY user_id) FROM won) AS won_user_ids,
+           (SELECT array_agg(payout ORDER BY user_id) FROM won) AS won_payouts
+    FROM settled
+"""
+
+class SettlementService:
+    """Расчет ставок события пачками"""
+    
+    async def finish_event(self, conn, event_id: int, winner_index: int,
+                           result_outcome: str) -> Optional[str]:
+        """Фиксация результата события, возвращает заголовок уведомлений о ставках"""
+        title = await conn.fetchval("""
+            UPDATE events
+            SET status = 'finished',
+                winner_index = $1,
+                result_outcome = $2,
+                updated_at = NOW()
+            WHERE id = $3
+            RETURNING title
+        """, winner_index, result_outcome, event_id)
+        
+        if not settings.BET_RESULT_NOTIFICATIONS:
+            return None
+        return f"🏁 Событие «{title}» завершено. Результат: {result_outcome}"
+    
+    async def settle_chunk(self, conn, event_id: int, winner_index: int,
+                           limit: Optional[int], notice: Optional[str] = None) -> Dict:
+        """
+        Расчет одной пачки ставок (limit=None - все оставшиеся)
+        notice - заголовок уведомлений участникам (None - без уведомлений)
+        """
+        row = await conn.fetchrow(SETTLE_BETS_SQL, event_id, winner_index, limit,
+                                  notice, PRIORITY_NORMAL)
+        return {
+            "winners_count": row["winners_count"],
+            "losers_count": row["losers_count"],
+            "total_payouts": int(row["total_payouts"]),
+            "payouts": dict(zip(row["won_user_ids"] or [], row["won_payouts"] or []))
+        }
+    
+    def _publish_finished(self, event_id: int, winner_index: int, result_outcome: str):
+        """Результат события - в ленту событий и подписчикам события, статус - в дельты"""
+        message = {"type": "event_finished", "event_id": event_id,
+                   "winner_index": winner_index, "result_outcome": result_outcome}
+        ws_hub.publish(TOPIC_EVENTS, message)
+        ws_hub.publish(event_topic(event_id), message)
+        
+        fields = {"status": "finished"}
+        event_feed.update(event_id, fields)
+        cluster_bus.publish(KIND_EVENT_FIELDS, {"event_id": event_id, "fields": fields})
+    
+    def _publish_payouts(self, event_id: int, chunk: Dict):
+        """Выплаты закоммиченной пачки - в темы балансов победителей"""
+        for user_id, payout in chunk["payouts"].items():
+            ws_hub.publish_balance(user_id, int(payout), "payout", event_id=event_id)
+    
+    async def settle_event(self, event_id: int, winner_index: int, result_outcome: str,
+                           chunk_size: Optional[int] = None) -> Dict:
+        """
+        Расчет всех ставок события
+        chunk_size > 0 - каждая пачка коммитится отдельно, блокировки короткие;
+        повторный вызов продолжает с оставшихся pending-ставок
+        """
+        if chunk_size is None:
+            chunk_size = settings.SETTLEMENT_CHUNK_SIZE
+            
+        summary = {"winners_count": 0, "losers_count": 0, "total_payouts": 0}
+        
+        async with db_manager.pool.acquire() as conn:
+            if chunk_size <= 0:
+                # Одна транзакция на все событие
+                async with conn.transaction():
+                    notice = await self.finish_event(conn, event_id, winner_index, result_outcome)
+                    chunk = await self.settle_chunk(conn, event_id, winner_index, None, notice)
+                outbox_dispatcher.wake()
+                self._publish_finished(event_id, winner_index, result_outcome)
+                self._publish_payouts(event_id, chunk)
+                return {key: chunk[key] for key in summary}
+                
+            async with conn.transaction():
+                notice = await self.finish_event(conn, event_id, winner_index, result_outcome)
+            self._publish_finished(event_id, winner_index, result_outcome)
+            
+            while True:
+                async with conn.transaction():
+                    chunk = await self.settle_chunk(conn, event_id, winner_index, chunk_size, notice)
+                    
+                # Уведомления пачки уже закоммичены - отправка начинается, не дожидаясь остальных
+                outbox_dispatcher.wake()
+                self._publish_payouts(event_id, chunk)
+                
+                for key in summary:
+                    summary[key] += chunk[key]
+                    
+                if chunk["winners_count"] + chunk["losers_count"] < chunk_size:
+                    break
+                    
+        return summary
+
+# Глобальный экземпляр сервиса
+settlement_service = SettlementService()
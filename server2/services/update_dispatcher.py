@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Прием обновлений Bot API через webhook
+/webhook только проверяет секрет и кладет обновление в ограниченную очередь,
+пул обработчиков (WEBHOOK_WORKERS) разбирает ее отдельно от запроса Telegram.
+Повторная доставка того же update_id отбрасывается
+"""
+
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+from config.settings import settings
+
+# Обработчик одного вида обновлений (message, pre_checkout_query, ...)
+UpdateHandler = Callable[[Dict], Awaitable[None]]
+
+class UpdateDispatcher:
+    """Ограниченная очередь обновлений, пул обработчиков и дедупликация по update_id"""
+    
+    def __init__(self, queue_size: int = None, workers: int = None, dedup_size: int = None):
+        self.queue_size = queue_size or settings.WEBHOOK_QUEUE_SIZE
+        self.workers = workers or settings.WEBHOOK_WORKERS
+        self.dedup_size = dedup_size or settings.WEBHOOK_DEDUP_SIZE
+        self.handlers: Dict[str, UpdateHandler] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # Последние принятые update_id (Telegram повторяет доставку при таймауте или ошибке)
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        
+        # Метрики
+        self.received = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.processed = 0
+        self.unhandled = 0
+        self.errors = 0
+    
+    def register(self, kind: str, handler: UpdateHandler):
+        """Обработчик для поля обновления kind"""
+        self.handlers[kind] = handler
+    
+    def start(self):
+        """Запуск пула обработчиков"""
+        if self._tasks:
+            return
+            
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        print(f"[WEBHOOK] ✅ Обработчики обновлений запущены ({self.workers} шт.)")
+    
+    def submit(self, update: Dict) -> bool:
+        """
+        Постановка обновления в очередь без ожидания
+        False - очередь заполнена: webhook отвечает ошибкой, Telegram повторит доставку позже
+        """
+        if self._queue is None:
+            return False
+            
+        update_id = update.get("update_id")
+        if update_id in self._seen:
+            self.duplicates += 1
+            return True
+            
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+            
+        self.received += 1
+        if update_id is not None:
+            self._seen[update_id] = None
+            while len(self._seen) > self.dedup_size:
+                self._seen.popitem(last=False)
+        return True
+    
+    async def _worker(self):
+        """Разбор очереди: обработчик выбирается по первому известному полю обновления"""
+        while True:
+            update = await self._queue.get()
+            try:
+                await self.handle(update)
+            finally:
+                self._queue.task_done()
+    
+    async def handle(self, update: Dict):
+        """Обработка одного обновления; ошибки логируются, обновление уже подтверждено"""
+        kind = next((key for key in update if key in self.handlers), None)
+        if kind is None:
+            self.unhandled += 1
+            return
+            
+        try:
+            await self.handlers[kind](update[kind])
+            self.processed += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"[WEBHOOK] ❌ Ошибка обработки {kind} (update_id {update.get('update_id')}): {e}")
+    
+    def get_metrics(self) -> Dict:
+        """Метрики очереди обновлений"""
+        return {
+            "running": bool(self._tasks),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "workers": len(self._tasks),
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "unhandled": self.unhandled,
+            "errors": self.errors
+        }
+    
+    async def close(self, timeout: float = 10):
+        """Остановка: принятые обновления дорабатываются до timeout"""
+        if not self._tasks:
+            return
+            
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"[WEBHOOK] ⚠️ Не обработано обновлений: {self._queue.qsize()}")
+            
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        print("[WEBHOOK] Обработчики обновлений остановлены")
+
+# Глобальный диспетчер обновлений
+update_dispatcher = UpdateDispatcher()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Пул воркеров вывода подарков
+process_withdrawal только ставит вывод в таблицу withdrawals, передача подарка
+идет здесь вне транзакции БД: pending -> sending -> completed / failed.
+Частоту вызовов Telegram ограничивают общий bucket и bucket на получателя,
+FloodWait останавливает весь пул на указанное Telegram время
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Optional
+from config.settings import settings
+from models.database import db_manager
+from services.balance_service import balance_service
+from services.gift_transfer import TransferRejected, create_transfer_backend
+from services.outbox_dispatcher import outbox_dispatcher
+from utils.rate_limit import RateLimiter, flood_wait_seconds
+
+# Захват выводов с арендой: если процесс упадет во время передачи,
+# после аренды вывод заберет другой воркер
+CLAIM_SQL = """
+    UPDATE withdrawals w
+    SET status = 'sending',
+        attempts = w.attempts + 1,
+        next_attempt_at = NOW() + make_interval(secs => $2)
+    FROM (
+        SELECT id FROM withdrawals
+        WHERE status IN ('pending', 'sending') AND next_attempt_at <= NOW()
+        ORDER BY next_attempt_at, id
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    ) AS due, deposits d
+    WHERE w.id = due.id AND d.id = w.deposit_id
+    RETURNING w.id, w.deposit_id, w.owner_user_id, w.recipient_user_id, w.gift_value,
+              w.transaction_id, w.attempts, w.created_at, d.title, d.slug, d.message_id
+"""
+
+class WithdrawalWorker:
+    """Захват выводов из БД и передача подарков пулом воркеров"""
+    
+    def __init__(self, backend=None, workers: int = None,
+                 global_rate: float = None, recipient_rate: float = None):
+        self.backend = backend
+        self.workers = workers or settings.WITHDRAWAL_WORKERS
+        self.limiter = RateLimiter(
+            settings.WITHDRAWAL_GLOBAL_RATE if global_rate is None else global_rate,
+            settings.WITHDRAWAL_RECIPIENT_RATE if recipient_rate is None else recipient_rate
+        )
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._in_flight = 0
+        
+        # Метрики
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.stale = 0
+    
+    def wake(self):
+        """Сигнал после коммита: в очереди появились выводы"""
+        self._wakeup.set()
+    
+    def start(self, backend=None):
+        """Запуск захвата и воркеров"""
+        if self._tasks and not all(task.done() for task in self._tasks):
+            return
+            
+        self.backend = backend or self.backend or create_transfer_backend()
+        self._closing = False
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._claim_loop())]
+        self._tasks += [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        print(f"[WITHDRAW] ✅ Пул выводов запущен: воркеров {self.workers}, "
+              f"бэкенд {self.backend.name}")
+    
+    async def _claim_loop(self):
+        """
+        Захват ровно столько выводов, сколько воркеры возьмут сразу:
+        вывод не лежит в памяти дольше аренды, пока ждет лимита
+        """
+        while not self._closing:
+            free = self.workers - self._queue.qsize() - self._in_flight
+            claimed = 0
+            
+            if free > 0:
+                try:
+                    async with db_manager.pool.acquire() as conn:
+                        rows = await conn.fetch(CLAIM_SQL, free, settings.WITHDRAWAL_LEASE_SECONDS)
+                    claimed_at = time.monotonic()
+                    for row in rows:
+                        self._queue.put_nowait({**row, "claimed_at": claimed_at})
+                    claimed = len(rows)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"[WITHDRAW] ❌ Ошибка захвата выводов: {e}")
+                    
+            # Забрали полную порцию - вероятно, есть еще, сразу пробуем снова;
+            # иначе ждем нового вывода, свободного воркера или таймера опроса
+            if free > 0 and claimed == free:
+                continue
+            await self._wait(settings.WITHDRAWAL_POLL_INTERVAL)
+    
+    async def _wait(self, timeout: float):
+        """Ожидание пробуждения (новый вывод или освободившийся воркер)"""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+    
+    async def _worker(self):
+        """Воркер: лимит -> передача -> фиксация результата"""
+        while True:
+            withdrawal = await self._queue.get()
+            if withdrawal is None:
+                return
+                
+            self._in_flight += 1
+            try:
+                await self.process(withdrawal)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Вывод остается в sending и будет подобран после аренды
+                print(f"[WITHDRAW] ❌ Ошибка обработки вывода {withdrawal['id']}: {e}")
+            finally:
+                self._in_flight -= 1
+                self._wakeup.set()
+    
+    async def process(self, withdrawal: Dict):
+        """Передача одного подарка и запись результата"""
+        await self.limiter.acquire(withdrawal["recipient_user_id"])
+        
+        # Пока ждали лимита (FloodWait), аренда подошла к концу: вывод мог забрать
+        # другой процесс. Отдаем его обратно, чтобы не передать подарок дважды
+        if time.monotonic() - withdrawal["claimed_at"] > settings.WITHDRAWAL_LEASE_SECONDS / 2:
+            await self._retry(withdrawal, TimeoutError("Аренда истекла в ожидании лимита"),
+                              0, count_attempt=False)
+            return
+            
+        try:
+            note = await self.backend.transfer(withdrawal)
+        except TransferRejected as e:
+            await self._fail(withdrawal, e)
+            return
+        except Exception as e:
+            flood = flood_wait_seconds(e)
+            if flood is not None:
+                # FloodWait касается всего аккаунта: останавливаем пул, попытку не засчитываем
+                self.limiter.flood_wait(flood)
+                await self._retry(withdrawal, e, flood, count_attempt=False)
+            elif withdrawal["attempts"] >= settings.WITHDRAWAL_MAX_ATTEMPTS:
+                await self._fail(withdrawal, e)
+            else:
+                delay = min(
+                    settings.WITHDRAWAL_RETRY_BASE_SECONDS * 2 ** (withdrawal["attempts"] - 1),
+                    settings.WITHDRAWAL_RETRY_MAX_SECONDS
+                )
+                await self._retry(withdrawal, e, delay)
+            return
+            
+        await self._complete(withdrawal, note)
+    
+    async def _complete(self, withdrawal: Dict, note: Optional[str]):
+        """completed + транзакция вывода; леджер уже учел вывод при постановке в очередь"""
+        async with db_manager.pool.acquire() as conn:
+            async with conn.transaction():
+                # Сверка attempts: результат устаревшего захвата (после аренды) не записываем
+                updated = await conn.fetchval("""
+                    UPDATE withdrawals
+                    SET status = 'completed', completed_at = NOW(), last_error = NULL
+                    WHERE id = $1 AND status = 'sending' AND attempts = $2
+                    RETURNING id
+                """, withdrawal["id"], withdrawal["attempts"])
+                
+                if not updated:
+                    self.stale += 1
+                    return
+                    
+                await conn.execute("""
+                    UPDATE transactions
+                    SET status = 'completed', notes = notes || COALESCE(' ' || $2, '')
+                    WHERE id = $1
+                """, withdrawal["transaction_id"], note)
+                
+                await outbox_dispatcher.enqueue(
+                    conn, withdrawal["owner_user_id"],
+                    f"✅ Подарок '{withdrawal['title']}' отправлен пользователю "
+                    f"{withdrawal['recipient_user_id']}"
+                )
+                
+        outbox_dispatcher.wake()
+        self.completed += 1
+        print(f"[WITHDRAW] ✅ Вывод {withdrawal['id']} выполнен: {withdrawal['title']} -> "
+              f"{withdrawal['recipient_user_id']}")
+    
+    async def _retry(self, withdrawal: Dict, error: Exception, delay: float,
+                     count_attempt: bool = True):
+        """Возврат в pending с задержкой"""
+        async with db_manager.pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE withdrawals
+                SET status = 'pending',
+                    attempts = attempts - $4,
+                    next_attempt_at = NOW() + make_interval(secs => $3),
+                    last_error = $5
+                WHERE id = $1 AND status = 'sending' AND attempts = $2
+            """, withdrawal["id"], withdrawal["attempts"], float(delay),
+                0 if count_attempt else 1, str(error)[:500])
+                
+        self.retried += 1
+        print(f"[WITHDRAW] ⚠️ Вывод {withdrawal['id']} отложен на {delay:.0f} сек: {error}")
+    
+    async def _fail(self, withdrawal: Dict, error: Exception):
+        """failed: транзакция помечается неуспешной, подарок возвращается на баланс"""
+        async with db_manager.pool.acquire() as conn:
+            async with conn.transaction():
+                updated = await conn.fetchval("""
+                    UPDATE withdrawals
+                    SET status = 'failed', completed_at = NOW(), last_error = $3
+                    WHERE id = $1 AND status = 'sending' AND attempts = $2
+                    RETURNING id
+                """, withdrawal["id"], withdrawal["attempts"], str(error)[:500])
+                
+                if not updated:
+                    self.stale += 1
+                    return
+                    
+                await conn.execute("""
+                    UPDATE transactions SET status = 'failed' WHERE id = $1
+                """, withdrawal["transaction_id"])
+                
+                await balance_service.apply(
+                    conn, withdrawal["owner_user_id"], withdrawn=-withdrawal["gift_value"]
+                )
+                
+                await outbox_dispatcher.enqueue(
+                    conn, withdrawal["owner_user_id"],
+                    f"❌ Не удалось отправить подарок '{withdrawal['title']}'. "
+                    f"Подарок возвращен на ваш баланс"
+                )
+                
+        outbox_dispatcher.wake()
+        self.failed += 1
+        print(f"[WITHDRAW] ❌ Вывод {withdrawal['id']} не выполнен после "
+              f"{withdrawal['attempts']} попыток: {error}")
+    
+    def get_metrics(self) -> Dict:
+        """Метрики пула выводов"""
+        return {
+            "running": bool(self._tasks) and not all(task.done() for task in self._tasks),
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "in_flight": self._in_flight,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "stale": self.stale,
+            "rate_limiter": self.limiter.get_metrics()
+        }
+    
+    async def _release(self, withdrawals: List[Dict]):
+        """Возврат захваченных, но не начатых выводов в pending без потери попытки"""
+        async with db_manager.pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE withdrawals
+                SET status = 'pending', attempts = attempts - 1, next_attempt_at = NOW()
+                WHERE id = ANY($1::BIGINT[]) AND status = 'sending'
+            """, [withdrawal["id"] for withdrawal in withdrawals])
+    
+    async def close(self, timeout: float = 10):
+        """
+        Остановка: захват прекращается, не начатые выводы сразу возвращаются в pending,
+        воркеры доделывают текущие передачи до timeout (прерванные подберет аренда)
+        """
+        if not self._tasks or all(task.done() for task in self._tasks):
+            return
+            
+        self._closing = True
+        self._wakeup.set()
+        
+        not_started = []
+        while not self._queue.empty():
+            not_started.append(self._queue.get_nowait())
+        if not_started:
+            try:
+                await self._release(not_started)
+            except Exception as e:
+                print(f"[WITHDRAW] ⚠️ Не удалось вернуть {len(not_started)} выводов в очередь: {e}")
+                
+        for _ in range(self.workers):
+            self._queue.put_nowait(None)
+            
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            print("[WITHDRAW] ⚠️ Пул выводов остановлен, не дождавшись текущих передач")
+        self._tasks = []
+
+# Глобальный пул выводов
+withdrawal_worker = WithdrawalWorker()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Рассылка обновлений клиентам WebSocket по темам
+events - лента всех событий, event:<id> - одно событие и его ставки,
+balance:<user_id> - изменения баланса пользователя.
+Сообщение сериализуется один раз на публикацию и кладется в ограниченную очередь
+каждого подписчика; клиент, не успевающий разбирать очередь, отключается.
+Публикации уходят и подписчикам других воркеров через шину (cluster_bus)
+"""
+
+import asyncio
+import json
+from typing import Dict, Optional, Set
+from config.settings import settings
+from services.cluster_bus import KIND_WS, cluster_bus
+
+TOPIC_EVENTS = "events"
+
+# Коды закрытия: перегруженный клиент может переподключиться, сервер останавливается
+CLOSE_SLOW_CONSUMER = 1013
+CLOSE_GOING_AWAY = 1001
+
+def event_topic(event_id: int) -> str:
+    """Тема одного события"""
+    return f"event:{event_id}"
+
+def balance_topic(user_id: int) -> str:
+    """Тема баланса пользователя"""
+    return f"balance:{user_id}"
+
+def encode_message(message: Dict) -> str:
+    """JSON сообщения (даты и Decimal - строками)"""
+    return json.dumps(message, default=str, ensure_ascii=False, separators=(",", ":"))
+
+class WebSocketConnection:
+    """Подключенный клиент: подписки и очередь исходящих сообщений"""
+    
+    __slots__ = ("websocket", "user_id", "topics", "queue", "sender", "closed")
+    
+    def __init__(self, websocket, user_id: Optional[int], queue_size: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.topics: Set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.sender: Optional[asyncio.Task] = None
+        self.closed = False
+
+class WebSocketHub:
+    """Подписки клиентов на темы и рассылка без ожидания медленных получателей"""
+    
+    def __init__(self, queue_size: int = None, max_subscriptions: int = None):
+        self.queue_size = queue_size or settings.WS_SEND_QUEUE_SIZE
+        self.max_subscriptions = max_subscriptions or settings.WS_MAX_SUBSCRIPTIONS
+        self._connections: Set[WebSocketConnection] = set()
+        self._topics: Dict[str, Set[WebSocketConnection]] = {}
+        
+        # Метрики
+        self.published = 0
+        self.enqueued = 0
+        self.sent = 0
+        self.evicted = 0
+    
+    def connect(self, websocket, user_id: Optional[int] = None) -> WebSocketConnection:
+        """Регистрация принятого соединения и запуск его отправителя"""
+        connection = WebSocketConnection(websocket, user_id, self.queue_size)
+        connection.sender = asyncio.create_task(self._sender(connection))
+        self._connections.add(connection)
+        return connection
+    
+    def resolve_topic(self, connection: WebSocketConnection, topic) -> Optional[str]:
+        """
+        Тема из запроса клиента; None - тема неизвестна или недоступна
+        balance - только свой баланс и только с токеном
+        """
+        if topic == TOPIC_EVENTS:
+            return topic
+            
+        if not isinstance(topic, str):
+            return None
+            
+        kind, _, key = topic.partition(":")
+        if kind == "event" and key.isdigit():
+            return event_topic(int(key))
+            
+        if kind == "balance" and connection.user_id is not None:
+            if not key or key == str(connection.user_id):
+                return balance_topic(connection.user_id)
+                
+        return None
+    
+    def subscribe(self, connection: WebSocketConnection, topic: str) -> bool:
+        """Подписка; False - достигнут WS_MAX_SUBSCRIPTIONS"""
+        if connection.closed:
+            return False
+            
+        if topic not in connection.topics:
+            if len(connection.topics) >= self.max_subscriptions:
+                return False
+            connection.topics.add(topic)
+            self._topics.setdefault(topic, set()).add(connection)
+        return True
+    
+    def unsubscribe(self, connection: WebSocketConnection, topic: str):
+        """Отписка от темы"""
+        connection.topics.discard(topic)
+        subscribers = self._topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self._topics[topic]
+    
+    def publish(self, topic: str, message: Dict, relay: bool = True) -> int:
+        """
+        Рассылка подписчикам темы без ожидания; возвращает число локальных получателей
+        Вызывается после коммита изменений, поэтому клиенты не видят откатанных данных.
+        relay=False - только клиентам этого процесса (сообщение пришло из шины
+        или каждый процесс формирует его сам)
+        """
+        if relay:
+            cluster_bus.publish(KIND_WS, {"topic": topic, "message": message})
+            
+        subscribers = self._topics.get(topic)
+        self.published += 1
+        if not subscribers:
+            return 0
+            
+        text = encode_message({**message, "topic": topic})
+        overflowed = []
+        # Горячий цикл: отключенные клиенты уже сняты с тем, переполненные - после обхода
+        for connection in subscribers:
+            try:
+                connection.queue.put_nowait(text)
+            except asyncio.QueueFull:
+                overflowed.append(connection)
+                
+        for connection in overflowed:
+            self._evict(connection)
+            
+        delivered = len(subscribers) - len(overflowed) if overflowed else len(subscribers)
+        self.enqueued += delivered
+        return delivered
+    
+    def publish_remote(self, data: Dict):
+        """Публикация другого воркера - клиентам этого процесса"""
+        self.publish(data["topic"], data["message"], relay=False)
+    
+    def publish_balance(self, user_id: int, delta: int, reason: str, **details) -> int:
+        """Изменение баланса пользователя: delta в звездах и причина (bet, payout, deposit)"""
+        return self.publish(balance_topic(user_id), {
+            "type": "balance", "user_id": user_id, "delta": delta, "reason": reason, **details
+        })
+    
+    def send(self, connection: WebSocketConnection, message: Dict) -> bool:
+        """Сообщение одному клиенту (ответы на его запросы)"""
+        return self._enqueue(connection, encode_message(message))
+    
+    def _enqueue(self, connection: WebSocketConnection, text: str) -> bool:
+        """Постановка в очередь клиента; переполнена - клиент отключается"""
+        if connection.closed:
+            return False
+            
+        try:
+            connection.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            self._evict(connection)
+            return False
+            
+        self.enqueued += 1
+        return True
+    
+    def _evict(self, connection: WebSocketConnection):
+        """Очередь клиента переполнена: отключаем его, остальные не ждут"""
+        self.evicted += 1
+        print(f"[WS] ⚠️ Клиент не успевает получать сообщения, отключен "
+              f"(очередь {self.queue_size})")
+        self._detach(connection)
+        asyncio.create_task(self._close(connection, CLOSE_SLOW_CONSUMER, "slow consumer"))
+    
+    async def _sender(self, connection: WebSocketConnection):
+        """Отправка очереди клиента по одному сообщению"""
+        try:
+            while True:
+                text = await connection.queue.get()
+                await connection.websocket.send_text(text)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Соединение разорвано - подписки снимаются, приемник в endpoint завершится сам
+            self._detach(connection)
+    
+    def _detach(self, connection: WebSocketConnection):
+        """Снятие подписок и остановка отправителя (без await - вызывается из publish)"""
+        if connection.closed:
+            return
+            
+        connection.closed = True
+        for topic in list(connection.topics):
+            self.unsubscribe(connection, topic)
+        self._connections.discard(connection)
+        
+        if connection.sender is not None and connection.sender is not asyncio.current_task():
+            connection.sender.cancel()
+    
+    async def _close(self, connection: WebSocketConnection, code: int, reason: str = ""):
+        """Закрытие сокета с кодом; уже закрытый сокет игнорируется"""
+        try:
+            await connection.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+    
+    async def disconnect(self, connection: WebSocketConnection):
+        """Клиент отключился: подписки снимаются, отправитель останавливается"""
+        self._detach(connection)
+        if connection.sender is not None:
+            await asyncio.gather(connection.sender, return_exceptions=True)
+    
+    def get_metrics(self) -> Dict:
+        """Метрики рассылки"""
+        return {
+            "connections": len(self._connections),
+            "topics": len(self._topics),
+            "subscriptions": sum(len(subscribers) for subscribers in self._topics.values()),
+            "queued": sum(connection.queue.qsize() for connection in self._connections),
+            "published": self.published,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "evicted": self.evicted
+        }
+    
+    async def close(self):
+        """Остановка: все клиенты отключаются с кодом 1001"""
+        connections = list(self._connections)
+        for connection in connections:
+            self._detach(connection)
+            
+        await asyncio.gather(
+            *(self._close(connection, CLOSE_GOING_AWAY, "server shutdown") for connection in connections),
+            *(connection.sender for connection in connections if connection.sender is not None),
+            return_exceptions=True
+        )
+        if connections:
+            print(f"[WS] Клиенты отключены: {len(connections)}")
+
+# Глобальный хаб WebSocket
+ws_hub = WebSocketHub()
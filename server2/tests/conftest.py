@@ -0,0 +1,50 @@
+"""
+Общие настройки тестов: модули сервера импортируются от корня server2,
+как при запуске main_with_db.py. Тесты с SQL идут на отдельной БД
+из TEST_DATABASE_URL и без нее пропускаются
+"""
+
+import asyncio
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import settings  # noqa: E402
+from models.database import db_manager  # noqa: E402
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+@pytest.fixture
+def database(monkeypatch):
+    """
+    Запуск сценария scenario(conn) с db_manager на тестовой БД
+    rollback=True - сценарий в транзакции, которая откатывается;
+    иначе сценарий сам убирает за собой закоммиченные строки
+    """
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL не задан")
+    monkeypatch.setattr(settings, "DATABASE_URL", TEST_DATABASE_URL)
+    
+    def run(scenario, rollback: bool = True):
+        async def main():
+            await db_manager.initialize()
+            try:
+                async with db_manager.pool.acquire() as conn:
+                    if not rollback:
+                        return await scenario(conn)
+                        
+                    transaction = conn.transaction()
+                    await transaction.start()
+                    try:
+                        return await scenario(conn)
+                    finally:
+                        await transaction.rollback()
+            finally:
+                await db_manager.close()
+                db_manager.pool = None
+                
+        return asyncio.run(main())
+        
+    return run
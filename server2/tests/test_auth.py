@@ -0,0 +1,133 @@
+"""
+Тесты сессионных токенов (JWT HS256) и подписи initData Telegram WebApp
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+import pytest
+from fastapi import HTTPException
+from config.settings import settings
+from utils import auth
+from utils.auth import create_access_token, decode_access_token, ensure_user
+from utils.telegram import validate_telegram_init_data
+
+SECRET = "test-jwt-secret-0123456789abcdef"
+BOT_TOKEN = "123456:TEST-bot-token"
+USER = {"id": 777, "first_name": "Test", "username": "tester"}
+
+@pytest.fixture(autouse=True)
+def jwt_secret(monkeypatch):
+    monkeypatch.setattr(settings, "JWT_SECRET", SECRET)
+
+def sign_init_data(fields: dict, bot_token: str = BOT_TOKEN) -> str:
+    """initData так, как их подписывает Telegram"""
+    data_check_string = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    signature = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode({**fields, "hash": signature})
+
+def init_data_fields(auth_date: int = None) -> dict:
+    return {
+        "auth_date": str(auth_date or int(time.time())),
+        "query_id": "AAHdF6IQAAAAAN0XohDhrOrc",
+        "user": json.dumps(USER, separators=(",", ":"))
+    }
+
+def test_token_round_trip():
+    token = create_access_token(42)
+    claims = decode_access_token(token)
+    
+    assert claims["user_id"] == 42
+    assert claims["sub"] == "42"
+    assert claims["exp"] - claims["iat"] == settings.JWT_TTL
+
+def test_token_signed_with_other_secret_is_rejected():
+    token = create_access_token(42, secret="another-secret-0123456789abcdef")
+    
+    assert decode_access_token(token) is None
+
+def test_tampered_payload_is_rejected():
+    header, payload, signature = create_access_token(42).split(".")
+    claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    claims["sub"] = "43"
+    forged = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip("=")
+    
+    assert decode_access_token(f"{header}.{forged}.{signature}") is None
+
+def test_token_expires(monkeypatch):
+    token = create_access_token(42, ttl=60)
+    now = time.time()
+    
+    monkeypatch.setattr(auth.time, "time", lambda: now + 59)
+    assert decode_access_token(token)["user_id"] == 42
+    
+    monkeypatch.setattr(auth.time, "time", lambda: now + 61)
+    assert decode_access_token(token) is None
+
+def test_other_algorithm_is_rejected_even_with_valid_signature():
+    header = base64.urlsafe_b64encode(b'{"alg":"none","typ":"JWT"}').rstrip(b"=")
+    payload = base64.urlsafe_b64encode(
+        json.dumps({"sub": "42", "exp": time.time() + 60}).encode()
+    ).rstrip(b"=")
+    signature = base64.urlsafe_b64encode(
+        hmac.new(SECRET.encode(), header + b"." + payload, hashlib.sha256).digest()
+    ).rstrip(b"=")
+    
+    assert decode_access_token((header + b"." + payload + b"." + signature).decode()) is None
+
+@pytest.mark.parametrize("token", ["", "abc", "a.b", "a.b.c.d", "###.###.###"])
+def test_malformed_token_is_rejected(token):
+    assert decode_access_token(token) is None
+
+def test_ensure_user_rejects_other_user():
+    claims = {"user_id": 42}
+    
+    ensure_user(claims, "42")
+    ensure_user(None, 43)
+    with pytest.raises(HTTPException) as error:
+        ensure_user(claims, 43)
+    assert error.value.status_code == 403
+
+def test_init_data_with_valid_signature_returns_user():
+    init_data = sign_init_data(init_data_fields())
+    
+    assert validate_telegram_init_data(init_data, BOT_TOKEN) == USER
+
+def test_init_data_signed_for_other_bot_is_rejected():
+    init_data = sign_init_data(init_data_fields(), bot_token="654321:OTHER-bot-token")
+    
+    assert validate_telegram_init_data(init_data, BOT_TOKEN) is None
+
+def test_tampered_init_data_is_rejected():
+    init_data = sign_init_data(init_data_fields())
+    forged_user = urlencode({"user": json.dumps({**USER, "id": 1})})
+    
+    tampered = "&".join(
+        forged_user if part.startswith("user=") else part for part in init_data.split("&")
+    )
+    assert validate_telegram_init_data(tampered, BOT_TOKEN) is None
+
+def test_stale_init_data_is_rejected():
+    init_data = sign_init_data(init_data_fields(auth_date=int(time.time()) - 3600))
+    
+    assert validate_telegram_init_data(init_data, BOT_TOKEN, max_age=600) is None
+    assert validate_telegram_init_data(init_data, BOT_TOKEN, max_age=7200) == USER
+
+def test_init_data_without_hash_is_rejected():
+    init_data = urlencode(init_data_fields())
+    
+    assert validate_telegram_init_data(init_data, BOT_TOKEN) is None
+
+
+@pytest.mark.parametrize("secret", ["", "your-secret-key", "your-random-jwt-secret-key"])
+def test_missing_or_example_secret_refuses_tokens(monkeypatch, secret):
+    token = create_access_token(42)
+    monkeypatch.setattr(settings, "JWT_SECRET", secret)
+    
+    with pytest.raises(RuntimeError):
+        create_access_token(42)
+    assert decode_access_token(token) is None
@@ -0,0 +1,64 @@
+"""
+Тесты кэша аватаров на БД из TEST_DATABASE_URL (фикстура database)
+Bot API заменен функцией, которая записывает запрошенные id
+"""
+
+import pytest
+from config.settings import settings
+from services import avatar_service as avatar_module
+from services.avatar_service import AvatarService
+
+KNOWN_USER = 980001
+STRANGER = 980002
+
+@pytest.fixture
+def api_calls(monkeypatch):
+    calls = []
+    
+    async def fake_fetch(user_id):
+        calls.append(user_id)
+        return f"file-{user_id}"
+        
+    monkeypatch.setattr(settings, "BOT_TOKEN", "1:test")
+    monkeypatch.setattr(avatar_module, "fetch_user_avatar_file_id", fake_fetch)
+    return calls
+
+def test_unknown_users_are_neither_fetched_nor_stored(database, api_calls):
+    async def scenario(conn):
+        await conn.execute("INSERT INTO user_profiles (user_id) VALUES ($1)", KNOWN_USER)
+        try:
+            avatars = await AvatarService(ttl=60).get_avatars([KNOWN_USER, STRANGER])
+            rows = await conn.fetch("""
+                SELECT user_id, photo_file_id, cached_at IS NOT NULL AS checked
+                FROM user_profiles WHERE user_id = ANY($1::BIGINT[])
+            """, [KNOWN_USER, STRANGER])
+            return avatars, [tuple(row) for row in rows]
+        finally:
+            await conn.execute("DELETE FROM user_profiles WHERE user_id = $1", KNOWN_USER)
+            
+    avatars, rows = database(scenario, rollback=False)
+    
+    assert avatars == {KNOWN_USER: f"file-{KNOWN_USER}", STRANGER: None}
+    assert api_calls == [KNOWN_USER]
+    # Профиль для чужого id не создан - рассылки до него не дойдут
+    assert rows == [(KNOWN_USER, f"file-{KNOWN_USER}", True)]
+
+def test_fresh_file_id_is_served_from_db(database, api_calls):
+    async def scenario(conn):
+        await conn.execute("""
+            INSERT INTO user_profiles (user_id, photo_file_id, cached_at)
+            VALUES ($1, 'stored', NOW())
+        """, KNOWN_USER)
+        try:
+            service = AvatarService(ttl=60)
+            first = await service.get_avatar(KNOWN_USER)
+            second = await service.get_avatar(KNOWN_USER)
+            return first, second, service.get_metrics()
+        finally:
+            await conn.execute("DELETE FROM user_profiles WHERE user_id = $1", KNOWN_USER)
+            
+    first, second, metrics = database(scenario, rollback=False)
+    
+    assert first == second == "stored"
+    assert api_calls == []
+    assert (metrics["db_hits"], metrics["memory_hits"]) == (1, 1)
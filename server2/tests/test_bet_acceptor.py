@@ -0,0 +1,134 @@
+"""
+Тесты BetAcceptor: сбор пачек по событию и graceful shutdown
+Слой БД заменен обработчиком пачки, который записывает вызовы
+"""
+
+import asyncio
+from services.bet_acceptor import BetAcceptor, BetRequest
+
+RESTART_ERROR = "Сервер перезапускается, повторите ставку"
+
+class FakeBatchHandler:
+    """Вместо BettingService._process_bet_batch: запоминает пачки, отвечает по ставке на запрос"""
+    
+    def __init__(self, delay: float = 0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.batches = []
+    
+    async def __call__(self, event_id, batch):
+        self.batches.append((event_id, [request.user_id for request in batch]))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("db down")
+        return [{"success": True, "user_id": request.user_id} for request in batch]
+
+def make_request(user_id: int, event_id: int = 1) -> BetRequest:
+    return BetRequest(user_id, event_id, "A", 0, [user_id * 10])
+
+def test_concurrent_bets_on_one_event_form_one_batch():
+    async def scenario():
+        handler = FakeBatchHandler()
+        acceptor = BetAcceptor(handler, batch_size=50, tick_ms=20, idle_timeout=1)
+        results = await asyncio.gather(*(acceptor.submit(make_request(i)) for i in range(10)))
+        await acceptor.close()
+        return handler, acceptor, results
+        
+    handler, acceptor, results = asyncio.run(scenario())
+    
+    assert handler.batches == [(1, list(range(10)))]
+    assert [result["user_id"] for result in results] == list(range(10))
+    assert acceptor.get_metrics()["batches_processed"] == 1
+    assert acceptor.get_metrics()["max_batch_size"] == 10
+
+def test_batch_size_limit_splits_batches():
+    async def scenario():
+        handler = FakeBatchHandler()
+        acceptor = BetAcceptor(handler, batch_size=4, tick_ms=20, idle_timeout=1)
+        results = await asyncio.gather(*(acceptor.submit(make_request(i)) for i in range(10)))
+        await acceptor.close()
+        return handler, results
+        
+    handler, results = asyncio.run(scenario())
+    
+    assert [len(users) for _, users in handler.batches] == [4, 4, 2]
+    assert all(result["success"] for result in results)
+
+def test_events_are_batched_separately():
+    async def scenario():
+        handler = FakeBatchHandler()
+        acceptor = BetAcceptor(handler, batch_size=50, tick_ms=20, idle_timeout=1)
+        await asyncio.gather(*(acceptor.submit(make_request(i, event_id=i % 2 + 1))
+                               for i in range(6)))
+        active = acceptor.get_metrics()["active_events"]
+        await acceptor.close()
+        return handler, active
+        
+    handler, active = asyncio.run(scenario())
+    
+    assert sorted(handler.batches) == [(1, [0, 2, 4]), (2, [1, 3, 5])]
+    assert active == 2
+
+def test_handler_error_fails_every_bet_of_the_batch():
+    async def scenario():
+        acceptor = BetAcceptor(FakeBatchHandler(fail=True), batch_size=50, tick_ms=20,
+                               idle_timeout=1)
+        results = await asyncio.gather(*(acceptor.submit(make_request(i)) for i in range(3)))
+        
+        # Воркер переживает ошибку и принимает следующие ставки
+        acceptor.handler = FakeBatchHandler()
+        after = await acceptor.submit(make_request(99))
+        await acceptor.close()
+        return results, after
+        
+    results, after = asyncio.run(scenario())
+    
+    assert all(not result["success"] and "db down" in result["error"] for result in results)
+    assert after == {"success": True, "user_id": 99}
+
+def test_idle_worker_exits_and_is_recreated():
+    async def scenario():
+        handler = FakeBatchHandler()
+        acceptor = BetAcceptor(handler, batch_size=50, tick_ms=1, idle_timeout=0.05)
+        await acceptor.submit(make_request(1))
+        await asyncio.sleep(0.2)
+        idle_workers = acceptor.get_metrics()["active_events"]
+        
+        result = await acceptor.submit(make_request(2))
+        await acceptor.close()
+        return idle_workers, result
+        
+    idle_workers, result = asyncio.run(scenario())
+    
+    assert idle_workers == 0
+    assert result["success"]
+
+def test_close_drains_queued_bets_and_rejects_new_ones():
+    async def scenario():
+        handler = FakeBatchHandler(delay=0.05)
+        acceptor = BetAcceptor(handler, batch_size=2, tick_ms=1, idle_timeout=1)
+        pending = [asyncio.create_task(acceptor.submit(make_request(i))) for i in range(5)]
+        await asyncio.sleep(0.01)
+        
+        await acceptor.close()
+        queued = await asyncio.gather(*pending)
+        late = await acceptor.submit(make_request(100))
+        return handler, acceptor, queued, late
+        
+    handler, acceptor, queued, late = asyncio.run(scenario())
+    
+    # Ставки, принятые в очередь до close, проведены, а не отброшены
+    assert [result["user_id"] for result in queued] == list(range(5))
+    assert sum(len(users) for _, users in handler.batches) == 5
+    assert late == {"success": False, "error": RESTART_ERROR}
+    assert acceptor.get_metrics()["active_events"] == 0
+    assert acceptor.get_metrics()["queued_bets"] == 0
+
+def test_close_without_workers_is_noop():
+    async def scenario():
+        acceptor = BetAcceptor(FakeBatchHandler())
+        await acceptor.close()
+        return await acceptor.submit(make_request(1))
+        
+    assert asyncio.run(scenario()) == {"success": False, "error": RESTART_ERROR}
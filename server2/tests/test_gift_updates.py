@@ -0,0 +1,84 @@
+"""
+Тесты разбора подарков: raw-действие MessageActionStarGift(Unique) и message.gift
+Сообщения Pyrogram заменены простыми объектами с теми же полями
+"""
+
+import asyncio
+from types import SimpleNamespace
+import pytest
+from utils import gift_updates
+from utils.gift_updates import GiftUpdate, decode_gift, gift_filter
+
+class StubGiftAction:
+    """Имитация raw.types.MessageActionStarGiftUnique"""
+    
+    def __init__(self, gift, transfer_stars=None):
+        self.gift = gift
+        self.transfer_stars = transfer_stars
+
+@pytest.fixture(autouse=True)
+def raw_gift_actions(monkeypatch):
+    monkeypatch.setattr(gift_updates, "GIFT_ACTIONS", gift_updates.GIFT_ACTIONS + (StubGiftAction,))
+
+def raw_message(action, gift=None, message_id=1):
+    return SimpleNamespace(id=message_id, raw=SimpleNamespace(action=action), gift=gift)
+
+def unique_gift(gift_id=5, slug="PlushPepe-12", title="Plush Pepe", num=12):
+    return SimpleNamespace(id=gift_id, slug=slug, title=title, num=num)
+
+def message_gift(name="PlushPepe-12", title="Plush Pepe", collectible_id=12, transfer_price=25):
+    """Разобранный types.Gift"""
+    return SimpleNamespace(id=5, name=name, title=title, collectible_id=collectible_id,
+                           transfer_price=transfer_price)
+
+def fields(gift):
+    return (gift.gift_id, gift.slug, gift.title, gift.num, gift.transfer_price)
+
+def is_gift(message) -> bool:
+    return asyncio.run(gift_filter(None, message))
+
+def test_decodes_raw_unique_gift_action():
+    message = raw_message(StubGiftAction(unique_gift(), transfer_stars=25))
+    
+    assert fields(decode_gift(message)) == (5, "PlushPepe-12", "Plush Pepe", 12, 25)
+    assert is_gift(message)
+
+def test_raw_regular_gift_has_no_slug_and_price():
+    message = raw_message(StubGiftAction(SimpleNamespace(id=7)))
+    
+    # Такой депозит отклонит проверка данных в deposit_ingestor
+    assert fields(decode_gift(message)) == (7, "", "", 0, 0)
+
+def test_falls_back_to_message_gift_without_raw_action():
+    message = SimpleNamespace(id=2, raw=SimpleNamespace(action=object()), gift=message_gift())
+    
+    assert fields(decode_gift(message)) == (5, "PlushPepe-12", "Plush Pepe", 12, 25)
+    assert is_gift(message)
+
+def test_message_gift_without_raw_attribute():
+    message = SimpleNamespace(id=3, gift=message_gift(transfer_price=None))
+    
+    assert fields(decode_gift(message)) == (5, "PlushPepe-12", "Plush Pepe", 12, 0)
+
+def test_message_without_gift():
+    message = SimpleNamespace(id=4, raw=SimpleNamespace(action=None), gift=None, text="hi")
+    
+    assert decode_gift(message) is None
+    assert not is_gift(message)
+
+
+def test_broken_raw_action_falls_back_to_message_gift():
+    message = raw_message(StubGiftAction(None), gift=message_gift())
+    
+    assert fields(decode_gift(message)) == (5, "PlushPepe-12", "Plush Pepe", 12, 25)
+
+def test_raw_action_without_slug_falls_back_to_message_gift():
+    message = raw_message(StubGiftAction(SimpleNamespace(id=7)), gift=message_gift())
+    
+    assert fields(decode_gift(message)) == (5, "PlushPepe-12", "Plush Pepe", 12, 25)
+
+def test_gift_update_is_slots_dataclass():
+    gift = GiftUpdate(5, "PlushPepe-12", "Plush Pepe", 12, 25)
+    
+    assert gift == GiftUpdate(5, "PlushPepe-12", "Plush Pepe", 12, 25)
+    assert not hasattr(gift, "__dict__")
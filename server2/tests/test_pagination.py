@@ -0,0 +1,101 @@
+"""
+Тесты keyset-пагинации: курсоры, условие "после курсора" и обход страниц
+Обход страниц депозитов идет на БД из TEST_DATABASE_URL (фикстура database)
+"""
+
+from datetime import datetime, timezone
+import pytest
+from config.settings import settings
+from services.gift_service import gift_service
+from utils.pagination import (
+    build_page, clamp_limit, decode_cursor, encode_cursor, keyset_condition, page_limit
+)
+
+CREATED_AT = datetime(2026, 3, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(CREATED_AT, 42)
+    
+    # Курсор можно передать в query без экранирования
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+    assert decode_cursor(cursor) == (CREATED_AT, 42)
+
+def test_empty_cursor_means_first_page():
+    assert decode_cursor(None) is None
+    assert decode_cursor("") is None
+    assert keyset_condition("d", None, 3) == ("", [])
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "MjAyNg", encode_cursor(CREATED_AT, 1)[:-3]])
+def test_broken_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+def test_clamp_limit():
+    assert clamp_limit(None) == settings.DEFAULT_PAGE_SIZE
+    assert clamp_limit(0) == settings.DEFAULT_PAGE_SIZE
+    assert clamp_limit(-5) == settings.DEFAULT_PAGE_SIZE
+    assert clamp_limit(7) == 7
+    assert clamp_limit(settings.MAX_PAGE_SIZE + 1) == settings.MAX_PAGE_SIZE
+
+def test_page_limit_without_limit_and_cursor_means_whole_list():
+    assert page_limit(None, None) is None
+    assert page_limit(None, "cursor") == settings.DEFAULT_PAGE_SIZE
+    assert page_limit(7, None) == 7
+
+def test_keyset_condition_numbers_parameters_after_query_ones():
+    condition, args = keyset_condition("d", (CREATED_AT, 42), 3)
+    
+    assert condition == "AND (d.created_at, d.id) < ($3::TIMESTAMPTZ, $4::INTEGER)"
+    assert args == [CREATED_AT, 42]
+
+def test_build_page_sets_cursor_only_when_more_rows_exist():
+    rows = [{"id": i, "created_at": CREATED_AT} for i in (5, 4, 3)]
+    
+    page = build_page(rows, 2)
+    assert [row["id"] for row in page["items"]] == [5, 4]
+    assert decode_cursor(page["next_cursor"]) == (CREATED_AT, 4)
+    
+    last = build_page(rows[2:], 2)
+    assert [row["id"] for row in last["items"]] == [3]
+    assert last["next_cursor"] is None
+    
+    assert build_page(rows, None) == {"items": rows, "next_cursor": None}
+
+def test_deposit_pages_cover_every_row_once(database):
+    user_id = 990001
+    
+    async def scenario(conn):
+        # Три депозита с одинаковым created_at: порядок внутри решает id
+        await conn.execute("""
+            INSERT INTO deposits (telegram_user_id, title, slug, num, created_at)
+            SELECT $1, 'Gift', 'gift-' || i, i,
+                   $2::TIMESTAMPTZ + GREATEST(i - 3, 0) * INTERVAL '1 minute'
+            FROM generate_series(1, 7) AS i
+        """, user_id, CREATED_AT)
+        try:
+            expected = [row["id"] for row in await conn.fetch("""
+                SELECT id FROM deposits WHERE telegram_user_id = $1
+                ORDER BY created_at DESC, id DESC
+            """, user_id)]
+            
+            whole = await gift_service.get_user_deposits(user_id)
+            
+            seen, cursor, pages = [], None, 0
+            while True:
+                page = await gift_service.get_user_deposits(user_id, limit=3, cursor=cursor)
+                seen += [item["id"] for item in page["items"]]
+                pages += 1
+                cursor = page["next_cursor"]
+                if cursor is None:
+                    return expected, seen, pages, whole
+        finally:
+            await conn.execute("DELETE FROM deposits WHERE telegram_user_id = $1", user_id)
+            
+    expected, seen, pages, whole = database(scenario, rollback=False)
+    
+    assert len(expected) == 7
+    assert seen == expected
+    assert pages == 3
+    # Без limit и cursor - весь список, как у клиентов без пагинации
+    assert [item["id"] for item in whole["items"]] == expected
+    assert whole["next_cursor"] is None
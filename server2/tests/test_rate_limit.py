@@ -0,0 +1,159 @@
+"""
+Тесты TokenBucket и RateLimiter
+Время подменяется ручными часами, кроме ожидания в acquire
+"""
+
+import asyncio
+from types import SimpleNamespace
+import pytest
+from pyrogram.errors import FileMigrate, FloodWait
+from utils import rate_limit
+from utils.bot_api import BotAPIError
+from utils.rate_limit import RateLimiter, TokenBucket, flood_wait_seconds
+from utils.telegram_pool import PoolSession
+
+class FakeClock:
+    """time.monotonic, который двигается только вручную"""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self) -> float:
+        return self.now
+    
+    def advance(self, seconds: float):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", fake)
+    return fake
+
+def test_bucket_allows_burst_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    
+    for _ in range(3):
+        assert bucket.delay() == 0
+        bucket.take()
+        
+    assert bucket.delay() == pytest.approx(0.5)
+
+def test_bucket_refills_at_rate_and_caps_at_capacity(clock):
+    bucket = TokenBucket(rate=4, capacity=2)
+    bucket.take()
+    bucket.take()
+    
+    clock.advance(0.25)
+    assert bucket.delay() == 0
+    
+    clock.advance(10)
+    bucket.delay()
+    assert bucket.tokens == 2
+    assert bucket.is_idle
+
+def test_bucket_block_holds_requests_until_flood_wait_ends(clock):
+    bucket = TokenBucket(rate=1, capacity=5)
+    bucket.block(3)
+    
+    assert bucket.delay() == pytest.approx(3)
+    assert not bucket.is_idle
+    
+    clock.advance(2.5)
+    assert bucket.delay() == pytest.approx(0.5)
+    
+    clock.advance(0.5)
+    assert bucket.delay() == 0
+
+def test_limiter_limits_each_key_independently(clock):
+    limiter = RateLimiter(global_rate=0, key_rate=1, key_capacity=1)
+    
+    assert limiter.try_acquire("a")
+    assert not limiter.try_acquire("a")
+    assert limiter.try_acquire("b")
+    
+    clock.advance(1)
+    assert limiter.try_acquire("a")
+    assert limiter.get_metrics() == {
+        "acquired": 3, "throttled": 1, "flood_waits": 0, "tracked_keys": 2
+    }
+
+def test_limiter_global_bucket_applies_across_keys(clock):
+    limiter = RateLimiter(global_rate=2, key_rate=100, key_capacity=100)
+    
+    assert limiter.try_acquire(1)
+    assert limiter.try_acquire(2)
+    assert not limiter.try_acquire(3)
+    assert limiter.global_bucket.delay() == pytest.approx(0.5)
+
+def test_throttled_key_does_not_spend_global_tokens(clock):
+    limiter = RateLimiter(global_rate=2, key_rate=1, key_capacity=1)
+    
+    assert limiter.try_acquire("busy")
+    for _ in range(5):
+        assert not limiter.try_acquire("busy")
+        
+    # Отказы по одному ключу не съели общий лимит
+    assert limiter.try_acquire("other")
+
+def test_flood_wait_blocks_key_or_whole_process(clock):
+    limiter = RateLimiter(global_rate=10, key_rate=10, key_capacity=10)
+    
+    limiter.flood_wait(5, key="chat")
+    assert not limiter.try_acquire("chat")
+    assert limiter.try_acquire("another")
+    
+    limiter.flood_wait(2)
+    assert limiter.global_bucket.delay() == pytest.approx(2)
+    assert not limiter.try_acquire("another")
+    
+    clock.advance(5)
+    assert limiter.try_acquire("chat")
+    assert limiter.get_metrics()["flood_waits"] == 2
+
+def test_only_idle_keys_are_evicted(clock):
+    limiter = RateLimiter(global_rate=0, key_rate=1, key_capacity=1, max_keys=2)
+    
+    limiter.try_acquire("a")
+    limiter.try_acquire("b")
+    limiter.try_acquire("c")
+    # "a" еще ждет токен - его состояние нельзя потерять
+    assert limiter.get_metrics()["tracked_keys"] == 3
+    assert not limiter.try_acquire("a")
+    
+    # Простаивающие ключи выбрасываются, пока их не больше max_keys
+    clock.advance(5)
+    limiter.try_acquire("d")
+    assert list(limiter._buckets) == ["a", "d"]
+
+def test_acquire_waits_for_token():
+    async def scenario():
+        limiter = RateLimiter(global_rate=0, key_rate=20, key_capacity=1)
+        first = await limiter.acquire("user")
+        second = await limiter.acquire("user")
+        return limiter, first, second
+        
+    limiter, first, second = asyncio.run(scenario())
+    
+    assert first == 0
+    assert second == pytest.approx(0.05, abs=0.02)
+    assert limiter.get_metrics()["throttled"] == 1
+
+def test_flood_wait_seconds():
+    assert flood_wait_seconds(FloodWait(value=7)) == 7.0
+    assert flood_wait_seconds(BotAPIError("sendMessage", 429, "Too Many Requests", 3)) == 3.0
+    assert flood_wait_seconds(BotAPIError("sendMessage", 400, "Bad Request")) is None
+    assert flood_wait_seconds(RuntimeError("boom")) is None
+
+def test_other_rpc_errors_with_value_do_not_block_session():
+    # У FILE_MIGRATE_X в .value номер DC, а не секунды ожидания
+    session = PoolSession("worker-1", SimpleNamespace(is_connected=True), primary=False)
+    session.started = True
+    
+    session.record(100.0, FileMigrate(value=4))
+    assert session.available(100.0)
+    assert (session.errors, session.flood_waits) == (1, 0)
+    
+    session.record(100.0, FloodWait(value=4))
+    assert not session.available(103.9)
+    assert session.available(104.0)
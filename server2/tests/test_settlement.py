@@ -0,0 +1,194 @@
+"""
+Тесты расчета ставок (SETTLE_BETS_SQL) на настоящей PostgreSQL
+Сценарии идут в откатываемой транзакции на БД из TEST_DATABASE_URL (фикстура database)
+"""
+
+from datetime import date, timedelta
+from services.settlement_service import settlement_service
+
+async def create_event(conn) -> int:
+    return await conn.fetchval("""
+        INSERT INTO events (title, outcomes, coefficients, status, end_time)
+        VALUES ('Тестовое событие', '["A", "B"]', '[2.0, 1.5]', 'active',
+                NOW() + INTERVAL '1 hour')
+        RETURNING id
+    """)
+
+async def add_bet(conn, event_id: int, user_id: int, outcome_index: int,
+                  total_value: int, coefficient: float) -> int:
+    return await conn.fetchval("""
+        INSERT INTO bets (user_id, event_id, outcome, outcome_index, gift_ids,
+                          total_value, coefficient, potential_payout)
+        VALUES ($1, $2, $3, $4, '[]', $5, $6, $7)
+        RETURNING id
+    """, user_id, event_id, "AB"[outcome_index], outcome_index, total_value,
+        coefficient, int(total_value * coefficient))
+
+async def reserve_gift(conn, bet_id: int, user_id: int) -> int:
+    """Депозит пользователя, зарезервированный под ставку"""
+    deposit_id = await conn.fetchval("""
+        INSERT INTO deposits (telegram_user_id, title, slug, num)
+        VALUES ($1, 'Gift', $2, 10)
+        RETURNING id
+    """, user_id, f"gift-{bet_id}")
+    await conn.execute(
+        "INSERT INTO bet_gifts (bet_id, deposit_id) VALUES ($1, $2)", bet_id, deposit_id
+    )
+    return deposit_id
+
+async def bet_states(conn, event_id: int) -> dict:
+    rows = await conn.fetch(
+        "SELECT id, status, actual_payout FROM bets WHERE event_id = $1", event_id
+    )
+    return {row["id"]: (row["status"], row["actual_payout"]) for row in rows}
+
+async def total_won(conn, user_id: int) -> int:
+    return await conn.fetchval(
+        "SELECT COALESCE(SUM(total_won), 0) FROM user_balances WHERE user_id = $1", user_id
+    )
+
+def test_settle_pays_winners_and_credits_ledger(database):
+    async def scenario(conn):
+        event_id = await create_event(conn)
+        won_1 = await add_bet(conn, event_id, 1001, 0, 100, 2.0)
+        won_2 = await add_bet(conn, event_id, 1001, 0, 50, 2.0)
+        lost = await add_bet(conn, event_id, 1002, 1, 80, 1.5)
+        won_3 = await add_bet(conn, event_id, 1003, 0, 10, 2.0)
+        
+        summary = await settlement_service.settle_chunk(conn, event_id, 0, None)
+        states = await bet_states(conn, event_id)
+        balances = [await total_won(conn, user_id) for user_id in (1001, 1002, 1003)]
+        return summary, states, balances, (won_1, won_2, lost, won_3)
+        
+    summary, states, balances, (won_1, won_2, lost, won_3) = database(scenario)
+    
+    assert summary["winners_count"] == 3
+    assert summary["losers_count"] == 1
+    assert summary["total_payouts"] == 320
+    assert states == {won_1: ("won", 200), won_2: ("won", 100),
+                      lost: ("lost", 0), won_3: ("won", 20)}
+    # Выигрыши нескольких ставок пользователя сложены в одно начисление леджера
+    assert balances == [300, 0, 20]
+
+def test_settle_chunk_continues_with_remaining_pending_bets(database):
+    async def scenario(conn):
+        event_id = await create_event(conn)
+        other_event_id = await create_event(conn)
+        bet_ids = [await add_bet(conn, event_id, 2000 + i, i % 2, 10, 2.0) for i in range(5)]
+        other_bet = await add_bet(conn, other_event_id, 2100, 0, 10, 2.0)
+        
+        first = await settlement_service.settle_chunk(conn, event_id, 0, 2)
+        after_first = await bet_states(conn, event_id)
+        rest = await settlement_service.settle_chunk(conn, event_id, 0, None)
+        again = await settlement_service.settle_chunk(conn, event_id, 0, None)
+        other = await bet_states(conn, other_event_id)
+        return bet_ids, first, after_first, rest, again, other[other_bet]
+        
+    bet_ids, first, after_first, rest, again, other = database(scenario)
+    
+    # Пачка берет самые ранние pending-ставки
+    assert first["winners_count"] + first["losers_count"] == 2
+    assert [after_first[bet_id][0] for bet_id in bet_ids] == [
+        "won", "lost", "pending", "pending", "pending"
+    ]
+    assert rest["winners_count"] + rest["losers_count"] == 3
+    assert (again["winners_count"], again["losers_count"], again["total_payouts"]) == (0, 0, 0)
+    assert other == ("pending", None)
+
+def test_lost_bets_release_reserved_gifts(database):
+    async def scenario(conn):
+        event_id = await create_event(conn)
+        won = await add_bet(conn, event_id, 3001, 0, 10, 2.0)
+        lost = await add_bet(conn, event_id, 3002, 1, 10, 1.5)
+        pending = await add_bet(conn, event_id, 3003, 1, 10, 1.5)
+        deposits = {bet_id: await reserve_gift(conn, bet_id, 3000 + i)
+                    for i, bet_id in enumerate((won, lost, pending), start=1)}
+        
+        await settlement_service.settle_chunk(conn, event_id, 0, 2)
+        rows = await conn.fetch(
+            "SELECT deposit_id, is_active FROM bet_gifts WHERE deposit_id = ANY($1)",
+            list(deposits.values())
+        )
+        active = {row["deposit_id"]: row["is_active"] for row in rows}
+        reserved = {bet_id: active[deposit_id] for bet_id, deposit_id in deposits.items()}
+        return reserved, won, lost, pending
+        
+    reserved, won, lost, pending = database(scenario)
+    
+    # Резерв снимается только с рассчитанных проигравших ставок
+    assert reserved == {won: True, lost: False, pending: True}
+
+def test_settlement_accumulates_leaderboard_windows(database):
+    async def scenario(conn):
+        first_event = await create_event(conn)
+        await add_bet(conn, first_event, 4001, 0, 100, 2.0)
+        await add_bet(conn, first_event, 4001, 1, 50, 1.5)
+        await settlement_service.settle_chunk(conn, first_event, 0, None)
+        
+        second_event = await create_event(conn)
+        await add_bet(conn, second_event, 4001, 1, 30, 1.5)
+        await settlement_service.settle_chunk(conn, second_event, 1, None)
+        
+        rows = await conn.fetch("""
+            SELECT period, period_start, total_bets, won_bets, total_winnings, total_wagered
+            FROM leaderboard_stats WHERE user_id = 4001
+        """)
+        today = await conn.fetchval("SELECT (NOW() AT TIME ZONE 'UTC')::DATE")
+        return {row["period"]: tuple(row)[1:] for row in rows}, today
+        
+    windows, today = database(scenario)
+    
+    # Строка на каждое окно; повторный расчет прибавляется к той же строке
+    assert set(windows) == {"day", "week", "all"}
+    assert windows["day"] == (today, 3, 2, 245, 180)
+    assert windows["week"] == (today - timedelta(days=today.weekday()), 3, 2, 245, 180)
+    assert windows["all"] == (date(1970, 1, 1), 3, 2, 245, 180)
+
+def test_settlement_chunks_add_up_in_event_stats(database):
+    async def scenario(conn):
+        event_id = await create_event(conn)
+        for i in range(5):
+            await add_bet(conn, event_id, 5000 + i, i % 2, 20, 2.0)
+        # Строку счетчиков создает прием ставок
+        await conn.execute("""
+            INSERT INTO event_stats (event_id, total_bets, unique_users, total_volume)
+            VALUES ($1, 5, 5, 100)
+        """, event_id)
+        
+        await settlement_service.settle_chunk(conn, event_id, 0, 2)
+        await settlement_service.settle_chunk(conn, event_id, 0, None)
+        return await conn.fetchrow("""
+            SELECT total_bets, winners_count, losers_count, total_payouts
+            FROM event_stats WHERE event_id = $1
+        """, event_id)
+        
+    stats = database(scenario)
+    
+    assert tuple(stats) == (5, 3, 2, 120)
+
+def test_settlement_writes_one_notification_per_user(database):
+    notice = "🏁 Событие «Тест» завершено. Результат: A"
+    
+    async def scenario(conn):
+        event_id = await create_event(conn)
+        await add_bet(conn, event_id, 6001, 0, 100, 2.0)
+        await add_bet(conn, event_id, 6001, 0, 25, 2.0)
+        await add_bet(conn, event_id, 6002, 1, 40, 1.5)
+        silent_event = await create_event(conn)
+        await add_bet(conn, silent_event, 6003, 0, 10, 2.0)
+        
+        await settlement_service.settle_chunk(conn, event_id, 0, None, notice)
+        await settlement_service.settle_chunk(conn, silent_event, 0, None)
+        rows = await conn.fetch("""
+            SELECT chat_id, kind, status, payload->>'text' AS text FROM outbox
+            WHERE chat_id IN (6001, 6002, 6003) ORDER BY chat_id
+        """)
+        return [tuple(row) for row in rows]
+        
+    rows = database(scenario)
+    
+    # Несколько ставок пользователя сведены в одно уведомление, без notice строк нет
+    assert rows == [
+        (6001, "bet_result", "pending", f"{notice}\n🎉 Выигрыш: +250 ⭐"),
+        (6002, "bet_result", "pending", f"{notice}\nСтавка не сыграла"),
+    ]
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Сессионные токены пользователей
+/api/auth/telegram проверяет подпись initData и выдает короткоживущий JWT (HS256, JWT_SECRET).
+Дальше запросы проверяют токен в памяти, без обращения к БД и к Telegram
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+from typing import Dict, Optional
+from fastapi import Header, HTTPException
+from config.settings import settings
+
+# Заголовок токена один и тот же - кодируем один раз
+JWT_HEADER = base64.urlsafe_b64encode(
+    json.dumps({"alg": "HS256", "typ": "JWT"}, separators=(",", ":")).encode()
+).rstrip(b"=")
+
+def _b64encode(data: bytes) -> bytes:
+    """base64url без выравнивания, как в JWT"""
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+def _b64decode(data: bytes) -> bytes:
+    """Обратное преобразование с восстановлением выравнивания"""
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+def _secret(secret: Optional[str]) -> str:
+    """Ключ подписи; JWT_SECRET не задан или из примера - токены не выдаются и не принимаются"""
+    if secret:
+        return secret
+    if not settings.jwt_secret_configured():
+        raise RuntimeError("JWT_SECRET не задан или взят из примера")
+    return settings.JWT_SECRET
+
+def _sign(signing_input: bytes, secret: str) -> bytes:
+    """Подпись HMAC-SHA256"""
+    return hmac.new(secret.encode(), signing_input, hashlib.sha256).digest()
+
+def create_access_token(user_id: int, ttl: int = None, secret: str = None) -> str:
+    """Токен пользователя: sub - user_id, exp - через ttl секунд (JWT_TTL)"""
+    now = int(time.time())
+    payload = {"sub": str(user_id), "iat": now, "exp": now + (ttl or settings.JWT_TTL)}
+    
+    signing_input = JWT_HEADER + b"." + _b64encode(
+        json.dumps(payload, separators=(",", ":")).encode()
+    )
+    signature = _b64encode(_sign(signing_input, _secret(secret)))
+    return (signing_input + b"." + signature).decode()
+
+def decode_access_token(token: str, secret: str = None) -> Optional[Dict]:
+    """Claims токена; None - подпись не сходится, формат неверный или срок истек"""
+    try:
+        header, payload, signature = token.encode().split(b".")
+        
+        expected = _sign(header + b"." + payload, _secret(secret))
+        if not hmac.compare_digest(_b64decode(signature), expected):
+            return None
+            
+        # Токены с другим алгоритмом не принимаем, даже если подпись совпала
+        if json.loads(_b64decode(header)).get("alg") != "HS256":
+            return None
+            
+        claims = json.loads(_b64decode(payload))
+        if claims.get("exp", 0) <= time.time():
+            return None
+            
+        claims["user_id"] = int(claims["sub"])
+        return claims
+        
+    except (ValueError, KeyError, TypeError):
+        return None
+    except RuntimeError as e:
+        print(f"[AUTH] ❌ Токен отклонен: {e}")
+        return None
+
+# Поля initData, которые сохраняются в user_profiles
+PROFILE_FIELDS = ("first_name", "last_name", "username", "photo_url", "is_premium")
+
+def profile_hash(user_data: Dict) -> str:
+    """SHA-256 полей профиля: совпал с сохраненным - перезаписывать нечего"""
+    fields = {field: user_data.get(field) for field in PROFILE_FIELDS}
+    fields["is_premium"] = bool(fields["is_premium"])
+    return hashlib.sha256(
+        json.dumps(fields, sort_keys=True, ensure_ascii=False).encode()
+    ).hexdigest()
+
+async def get_current_user(authorization: Optional[str] = Header(None)) -> Optional[Dict]:
+    """
+    Пользователь из заголовка Authorization: Bearer <token>
+    Неверный токен - 401; без токена - None, пока AUTH_REQUIRED=false (старые клиенты)
+    """
+    if not authorization:
+        if settings.AUTH_REQUIRED:
+            raise HTTPException(status_code=401, detail="Требуется авторизация")
+        return None
+        
+    scheme, _, token = authorization.partition(" ")
+    claims = decode_access_token(token.strip()) if scheme.lower() == "bearer" else None
+    if not claims:
+        raise HTTPException(status_code=401, detail="Недействительный или просроченный токен")
+        
+    return claims
+
+def ensure_user(current_user: Optional[Dict], user_id) -> None:
+    """Запрос от имени другого пользователя - 403"""
+    if current_user is None:
+        return
+        
+    try:
+        same = int(user_id) == current_user["user_id"]
+    except (TypeError, ValueError):
+        same = False
+        
+    if not same:
+        raise HTTPException(status_code=403, detail="Нет доступа к данным другого пользователя")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Общий клиент Telegram Bot API
+Один httpx.AsyncClient на процесс: keep-alive пул соединений к api.telegram.org
+(HTTP/2, если установлен h2), таймауты, повторы и ограничение параллельности.
+Открывается и закрывается в lifespan приложения
+"""
+
+import asyncio
+from typing import Any, Dict, Optional
+import httpx
+from config.settings import settings
+
+try:
+    import h2  # noqa: F401 - нужен httpx для HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Методы, повтор которых после потерянного ответа ничего не дублирует; остальные
+# (sendMessage, createInvoiceLink, ...) повторяются только если запрос не дошел до сервера
+IDEMPOTENT_METHODS = {
+    "getMe", "getChat", "getFile", "getUpdates", "getUserProfilePhotos", "getWebhookInfo",
+    "setWebhook", "deleteWebhook", "answerPreCheckoutQuery", "answerCallbackQuery"
+}
+
+# Ошибки до отправки запроса: соединение не установлено
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+class BotAPIError(Exception):
+    """Ответ Bot API с ok=false"""
+    
+    def __init__(self, method: str, error_code: int, description: str,
+                 retry_after: Optional[float] = None):
+        super().__init__(f"{error_code} {description}")
+        self.method = method
+        self.error_code = error_code
+        self.description = description
+        self.retry_after = retry_after
+
+class BotAPIClient:
+    """Пул соединений к Bot API с повторами временных ошибок"""
+    
+    def __init__(self, base_url: str = None, timeout: float = None, retries: int = None,
+                 concurrency: int = None, http2: bool = None):
+        self.base_url = (base_url or settings.BOT_API_URL).rstrip("/")
+        self.timeout = settings.BOT_API_TIMEOUT if timeout is None else timeout
+        self.retries = settings.BOT_API_RETRIES if retries is None else retries
+        self.concurrency = concurrency or settings.BOT_API_CONCURRENCY
+        self.http2 = settings.BOT_API_HTTP2 if http2 is None else http2
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        
+        # Метрики
+        self.requests = 0
+        self.retried = 0
+        self.errors = 0
+    
+    async def start(self):
+        """Открытие пула соединений"""
+        if self._client is not None:
+            return
+            
+        http2 = self.http2 and HTTP2_AVAILABLE
+        if self.http2 and not HTTP2_AVAILABLE:
+            print("[BOT_API] ⚠️ Пакет h2 не установлен, используется HTTP/1.1")
+            
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=http2,
+            timeout=httpx.Timeout(self.timeout, connect=settings.BOT_API_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency,
+                keepalive_expiry=settings.BOT_API_KEEPALIVE_EXPIRY
+            )
+        )
+        print(f"[BOT_API] ✅ Клиент Bot API открыт ({'HTTP/2' if http2 else 'HTTP/1.1'}, "
+              f"до {self.concurrency} соединений)")
+    
+    async def call(self, method: str, payload: Dict = None, bot_token: str = None) -> Any:
+        """
+        Вызов метода Bot API, возвращает поле result
+        5xx, 429 и сетевые ошибки повторяются до BOT_API_RETRIES раз; для методов
+        вне IDEMPOTENT_METHODS из сетевых - только ошибки соединения.
+        ok=false с другими кодами - сразу BotAPIError
+        """
+        bot_token = bot_token or settings.BOT_TOKEN
+        if not bot_token:
+            raise BotAPIError(method, 0, "BOT_TOKEN не настроен")
+            
+        if self._client is None:
+            # Вызов вне lifespan (скрипты) - открываем пул по требованию
+            await self.start()
+            
+        url = f"/bot{bot_token}/{method}"
+        attempt = 0
+        
+        while True:
+            attempt += 1
+            try:
+                async with self._semaphore:
+                    self.requests += 1
+                    response = await self._client.post(url, json=payload or {})
+                    
+                data = response.json()
+                if data.get("ok"):
+                    return data.get("result")
+                    
+                error = BotAPIError(
+                    method, data.get("error_code", response.status_code),
+                    data.get("description", "Неизвестная ошибка"),
+                    (data.get("parameters") or {}).get("retry_after")
+                )
+                retryable = response.status_code == 429 or response.status_code >= 500
+                
+            except httpx.TransportError as e:
+                # Обрыв после отправки: запрос мог выполниться, повтор продублирует сообщение
+                error = e
+                retryable = method in IDEMPOTENT_METHODS or isinstance(e, CONNECT_ERRORS)
+            except ValueError as e:
+                # Не JSON (например, HTML-страница прокси) - как временная ошибка сервера
+                error = BotAPIError(method, response.status_code, f"Некорректный ответ: {e}")
+                retryable = response.status_code >= 500
+                
+            delay = getattr(error, "retry_after", None) or 0.5 * 2 ** (attempt - 1)
+            # Долгий flood control не пережидаем внутри запроса пользователя
+            if not retryable or attempt > self.retries or delay > self.timeout:
+                self.errors += 1
+                raise error
+                
+            self.retried += 1
+            print(f"[BOT_API] ⚠️ {method}: {error!r}, повтор через {delay} сек")
+            await asyncio.sleep(delay)
+    
+    def get_metrics(self) -> Dict:
+        """Метрики клиента"""
+        return {
+            "open": self._client is not None,
+            "requests": self.requests,
+            "retried": self.retried,
+            "errors": self.errors
+        }
+    
+    async def close(self):
+        """Закрытие пула соединений"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            print("[BOT_API] Клиент Bot API закрыт")
+
+# Глобальный клиент Bot API
+bot_api = BotAPIClient()
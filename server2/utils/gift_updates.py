@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Разбор входящих подарков из обновлений Pyrogram
+gift_filter отсекает все, кроме сообщений с подарком, до запуска обработчика;
+decode_gift читает поля подарка из message.gift (types.Gift форка Kurigram, как и прежний
+обработчик), а если клиент отдает raw-сообщение с MessageActionStarGiftUnique - напрямую
+из него без разбора в types. В стоковом Pyrogram 2.0.x нет ни того, ни другого
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+from pyrogram import filters, raw
+
+# Действия с подарком в raw-сообщении; в версиях Pyrogram без звездных подарков типов нет -
+# тогда остается разбор по message.gift
+GIFT_ACTIONS = tuple(
+    getattr(raw.types, name) for name in ("MessageActionStarGift", "MessageActionStarGiftUnique")
+    if hasattr(raw.types, name)
+)
+
+@dataclass(slots=True)
+class GiftUpdate:
+    """Поля подарка, нужные для депозита"""
+    
+    gift_id: int
+    slug: str
+    title: str
+    num: int
+    transfer_price: int
+
+def _gift_action(message):
+    """Действие с подарком из raw-сообщения или None"""
+    action = getattr(getattr(message, "raw", None), "action", None)
+    if GIFT_ACTIONS and isinstance(action, GIFT_ACTIONS):
+        return action
+    return None
+
+def _decode_action(action) -> GiftUpdate:
+    """Поля подарка из raw-действия MessageActionStarGift(Unique)"""
+    gift = action.gift
+    return GiftUpdate(
+        gift.id,
+        getattr(gift, "slug", None) or "",
+        getattr(gift, "title", None) or "",
+        getattr(gift, "num", None) or 0,
+        getattr(action, "transfer_stars", None) or 0
+    )
+
+def _decode_message_gift(gift) -> GiftUpdate:
+    """Поля подарка из разобранного types.Gift"""
+    return GiftUpdate(
+        getattr(gift, "id", None) or 0,
+        getattr(gift, "name", None) or "",
+        getattr(gift, "title", None) or "",
+        getattr(gift, "collectible_id", None) or 0,
+        getattr(gift, "transfer_price", None) or 0
+    )
+
+def decode_gift(message) -> Optional[GiftUpdate]:
+    """
+    Подарок из сообщения; None - подарка нет.
+    Обычный (не коллекционный) подарок приходит без slug и цены передачи -
+    такой депозит отклонит проверка данных в deposit_ingestor
+    """
+    decoded = None
+    action = _gift_action(message)
+    if action is not None:
+        try:
+            decoded = _decode_action(action)
+        except AttributeError as e:
+            # Схема raw-типов другого слоя - читаем разобранный message.gift
+            print(f"[GIFT] ⚠️ Не удалось разобрать raw-подарок, message_id {message.id}: {e}")
+        if decoded is not None and decoded.slug:
+            return decoded
+            
+    gift = getattr(message, "gift", None)
+    if gift is None:
+        return decoded
+    return _decode_message_gift(gift)
+
+async def _is_gift(_, __, message) -> bool:
+    """
+    Проверка фильтра: сообщение с подарком
+    Асинхронная - синхронные фильтры Pyrogram выполняет в пуле потоков
+    """
+    return _gift_action(message) is not None or getattr(message, "gift", None) is not None
+
+# Фильтр обработчика депозитов: остальные сообщения обработчик не будят
+gift_filter = filters.create(_is_gift, "GiftFilter")
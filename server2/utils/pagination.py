@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Keyset-пагинация по (created_at, id)
+Курсор непрозрачный для клиента: base64 от позиции последней строки страницы
+"""
+
+import base64
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from config.settings import settings
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Курсор, указывающий на последнюю отданную строку"""
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """Разбор курсора; ValueError для поврежденного значения"""
+    if not cursor:
+        return None
+        
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise ValueError("Некорректный курсор")
+
+def clamp_limit(limit: Optional[int]) -> int:
+    """Размер страницы в допустимых пределах"""
+    if not limit or limit <= 0:
+        return settings.DEFAULT_PAGE_SIZE
+    return min(limit, settings.MAX_PAGE_SIZE)
+
+def page_limit(limit: Optional[int], cursor: Optional[str]) -> Optional[int]:
+    """
+    Размер страницы запроса; None - весь список одним ответом
+    (ни limit, ни cursor не переданы - так запрашивают клиенты без пагинации)
+    """
+    if limit is None and not cursor:
+        return None
+    return clamp_limit(limit)
+
+def fetch_limit(limit: Optional[int]) -> Optional[int]:
+    """LIMIT для запроса страницы: на строку больше, чтобы узнать о продолжении"""
+    return None if limit is None else limit + 1
+
+def keyset_condition(alias: str, cursor: Optional[Tuple[datetime, int]], first_param: int) -> Tuple[str, list]:
+    """
+    SQL-условие "строго после курсора" для сортировки created_at DESC, id DESC
+    Возвращает фрагмент для WHERE и его параметры
+    """
+    if cursor is None:
+        return "", []
+        
+    prefix = f"{alias}." if alias else ""
+    condition = (
+        f"AND ({prefix}created_at, {prefix}id) < "
+        f"(${first_param}::TIMESTAMPTZ, ${first_param + 1}::INTEGER)"
+    )
+    return condition, list(cursor)
+
+def build_page(rows: List[Dict], limit: Optional[int]) -> Dict:
+    """Страница из limit + 1 строк: лишняя строка означает, что есть продолжение"""
+    if limit is None:
+        return {"items": rows, "next_cursor": None}
+        
+    has_more = len(rows) > limit
+    items = rows[:limit]
+    
+    next_cursor = None
+    if has_more and items:
+        last = items[-1]
+        next_cursor = encode_cursor(last["created_at"], last["id"])
+        
+    return {
+        "items": items,
+        "next_cursor": next_cursor
+    }
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Ограничение частоты запросов
+Token bucket на ключ (получатель, пользователь) и общий bucket процесса
+с учетом FloodWait от Telegram
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+from pyrogram.errors import FloodWait
+from utils.bot_api import BotAPIError
+
+def flood_wait_seconds(error: Exception) -> Optional[float]:
+    """
+    Сколько ждать по FloodWait (MTProto) или 429 с retry_after (Bot API); None - не flood
+    .value есть и у других RPCError (FILE_MIGRATE_X, PHONE_MIGRATE_X - номер DC),
+    поэтому смотрим на тип ошибки
+    """
+    if isinstance(error, FloodWait):
+        return float(error.value)
+    if isinstance(error, BotAPIError) and error.retry_after is not None:
+        return float(error.retry_after)
+    return None
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity"""
+    
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+    
+    def _refill(self, now: float):
+        """Начисление токенов за прошедшее время"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    def delay(self, now: float = None) -> float:
+        """Сколько ждать до свободного токена (0 - можно сейчас)"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        wait = max(self.blocked_until - now, 0.0)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+    
+    def take(self):
+        """Списание токена (после delay() == 0)"""
+        self.tokens -= 1
+    
+    def block(self, seconds: float):
+        """FloodWait: ни одного запроса ближайшие seconds, затем пустой bucket"""
+        now = time.monotonic()
+        self._refill(now)
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+    
+    @property
+    def is_idle(self) -> bool:
+        """Bucket полон и не заблокирован - его можно выбросить без потери состояния"""
+        return self.delay() == 0 and self.tokens >= self.capacity
+
+class RateLimiter:
+    """
+    Общий bucket плюс bucket на ключ (global_rate <= 0 - без общего лимита)
+    Токен списывается из обоих сразу, только когда свободны оба:
+    ожидание по одному получателю не расходует общий лимит
+    """
+    
+    def __init__(self, global_rate: float, key_rate: float,
+                 key_capacity: float = 1, max_keys: int = 10000):
+        self.global_bucket = TokenBucket(global_rate) if global_rate > 0 else None
+        self.key_rate = key_rate
+        self.key_capacity = key_capacity
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        
+        # Метрики
+        self.acquired = 0
+        self.throttled = 0
+        self.flood_waits = 0
+    
+    def _bucket(self, key: Hashable) -> TokenBucket:
+        """Bucket ключа; при переполнении выбрасываются самые давние"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.key_rate, self.key_capacity)
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.max_keys:
+                oldest_key, oldest = next(iter(self._buckets.items()))
+                if not oldest.is_idle:
+                    break
+                del self._buckets[oldest_key]
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+    
+    def _delay(self, key: Hashable) -> float:
+        """Ожидание до токена в обоих bucket"""
+        # Новый bucket создается до замера времени, иначе первое начисление уйдет в минус
+        bucket = self._bucket(key)
+        now = time.monotonic()
+        wait = bucket.delay(now)
+        if self.global_bucket:
+            wait = max(wait, self.global_bucket.delay(now))
+        return wait
+    
+    def delay(self, key: Optional[Hashable] = None) -> float:
+        """Сколько ждать токена без его списания (key=None - только общий bucket)"""
+        if key is not None:
+            return self._delay(key)
+        return self.global_bucket.delay() if self.global_bucket else 0.0
+    
+    def _take(self, key: Hashable):
+        """Списание токена из обоих bucket"""
+        self._buckets[key].take()
+        if self.global_bucket:
+            self.global_bucket.take()
+        self.acquired += 1
+    
+    def try_acquire(self, key: Hashable) -> bool:
+        """Токен без ожидания; False - лимит исчерпан"""
+        if self._delay(key) > 0:
+            self.throttled += 1
+            return False
+        self._take(key)
+        return True
+    
+    async def acquire(self, key: Hashable) -> float:
+        """Ожидание токена; возвращает, сколько секунд пришлось ждать"""
+        waited = 0.0
+        while True:
+            wait = self._delay(key)
+            if wait <= 0:
+                self._take(key)
+                return waited
+            if not waited:
+                self.throttled += 1
+            await asyncio.sleep(wait)
+            waited += wait
+    
+    def flood_wait(self, seconds: float, key: Optional[Hashable] = None):
+        """FloodWait: блокируем ключ или (по умолчанию) весь процесс"""
+        self.flood_waits += 1
+        if key is not None:
+            self._bucket(key).block(seconds)
+        elif self.global_bucket:
+            self.global_bucket.block(seconds)
+    
+    def get_metrics(self) -> dict:
+        """Метрики ограничителя"""
+        return {
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "flood_waits": self.flood_waits,
+            "tracked_keys": len(self._buckets)
+        }
@@ -2,62 +2,45 @@
 """
 Утилиты для работы с Telegram API
 Вынесено из main.py для переиспользования
+Вызовы Bot API идут через общий клиент utils.bot_api
 """
 
 import asyncio
-import httpx
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import parse_qsl
 from typing import Optional, Dict, Any
 from config.settings import settings
+from utils.bot_api import BotAPIError, bot_api
 
-async def send_telegram_message(client, user_id: int, message: str) -> bool:
-    """Отправка сообщения пользователю через Pyrogram"""
-    try:
-        if not client or not client.is_connected:
-            print(f"[TELEGRAM] ⚠️ Клиент не подключен")
-            return False
-        
-        await client.send_message(user_id, message)
-        print(f"[TELEGRAM] ✅ Сообщение отправлено пользователю {user_id}")
-        return True
+async def fetch_user_avatar_file_id(user_id: int, bot_token: str = None) -> Optional[str]:
+    """
+    file_id аватара через Bot API; None - у пользователя нет фото.
+    Ошибки пробрасываются, чтобы кэш аватаров не запомнил сбой как "нет фото"
+    """
+    result = await bot_api.call(
+        "getUserProfilePhotos", {"user_id": user_id, "limit": 1}, bot_token
+    )
+    
+    photos = (result or {}).get("photos")
+    if photos and len(photos) > 0 and len(photos[0]) > 0:
+        largest_photo = photos[0][-1]
+        return largest_photo.get("file_id")
         
-    except Exception as e:
-        print(f"[TELEGRAM] ❌ Ошибка отправки сообщения: {e}")
-        return False
+    return None
 
 async def get_user_avatar_file_id(user_id: int, bot_token: str = None) -> Optional[str]:
     """
-    Получение file_id аватара пользователя через Bot API
+    Получение file_id аватара пользователя через Bot API (без кэша, см. avatar_service)
     Адаптировано из main.py строки 133-167
     """
-    if not bot_token:
-        bot_token = settings.BOT_TOKEN
-        
-    if not bot_token:
+    if not (bot_token or settings.BOT_TOKEN):
         return None
         
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"https://api.telegram.org/bot{bot_token}/getUserProfilePhotos",
-                json={
-                    "user_id": user_id,
-                    "limit": 1
-                }
-            )
-            
-            if response.status_code != 200:
-                return None
-                
-            data = response.json()
-            if not data.get("ok") or not data.get("result", {}).get("photos"):
-                return None
-                
-            photos = data["result"]["photos"]
-            if photos and len(photos) > 0 and len(photos[0]) > 0:
-                largest_photo = photos[0][-1]
-                return largest_photo.get("file_id")
-                
-        return None
+        return await fetch_user_avatar_file_id(user_id, bot_token)
         
     except Exception as e:
         print(f"[TELEGRAM] ❌ Ошибка получения аватара для {user_id}: {e}")
@@ -68,15 +51,10 @@ async def create_payment_invoice(gift_ids: list, user_id: int, bot_token: str =
     Создание invoice для оплаты Telegram Stars
     Адаптировано из main.py строки 802-868
     """
-    if not bot_token:
-        bot_token = settings.BOT_TOKEN
-        
-    if not bot_token:
+    if not (bot_token or settings.BOT_TOKEN):
         return {"success": False, "error": "BOT_TOKEN не настроен"}
     
     try:
-        import time
-        
         total_stars = len(gift_ids) * 25
         timestamp = int(time.time())
         payload = f"withdrawal_{user_id}_{timestamp}_{','.join(map(str, gift_ids))}"
@@ -106,25 +84,21 @@ async def create_payment_invoice(gift_ids: list, user_id: int, bot_token: str =
             "is_flexible": False
         }
         
-        async with httpx.AsyncClient() as client:
-            url = f"https://api.telegram.org/bot{bot_token}/createInvoiceLink"
-            response = await client.post(url, json=invoice_data)
-            result = await response.json()
-            
-            if response.status_code == 200 and result.get('ok'):
-                return {
-                    "success": True,
-                    "invoice_url": result["result"],
-                    "total_stars": total_stars,
-                    "payload": payload
-                }
-            else:
-                print(f"[TELEGRAM] ❌ Ошибка создания invoice: {result}")
-                return {
-                    "success": False, 
-                    "error": f"Не удалось создать invoice: {result.get('description', 'Неизвестная ошибка')}"
-                }
-                
+        invoice_url = await bot_api.call("createInvoiceLink", invoice_data, bot_token)
+        
+        return {
+            "success": True,
+            "invoice_url": invoice_url,
+            "total_stars": total_stars,
+            "payload": payload
+        }
+        
+    except BotAPIError as e:
+        print(f"[TELEGRAM] ❌ Ошибка создания invoice: {e}")
+        return {
+            "success": False, 
+            "error": f"Не удалось создать invoice: {e.description}"
+        }
     except Exception as e:
         print(f"[TELEGRAM] ❌ Исключение при создании invoice: {e}")
         return {
@@ -132,26 +106,59 @@ async def create_payment_invoice(gift_ids: list, user_id: int, bot_token: str =
             "error": f"Ошибка сервера: {str(e)}"
         }
 
-def validate_telegram_init_data(init_data: str) -> Optional[Dict]:
+async def answer_pre_checkout_query(query_id: str, ok: bool, error_message: str = None,
+                                    bot_token: str = None):
+    """Ответ на pre_checkout_query: Telegram ждет его не дольше 10 секунд"""
+    payload = {"pre_checkout_query_id": query_id, "ok": ok}
+    if not ok:
+        payload["error_message"] = error_message or "Оплата недоступна"
+    await bot_api.call("answerPreCheckoutQuery", payload, bot_token)
+
+async def set_webhook(url: str, secret_token: str, allowed_updates: list,
+                      max_connections: int = 40, bot_token: str = None):
+    """Регистрация webhook бота с секретом в заголовке X-Telegram-Bot-Api-Secret-Token"""
+    await bot_api.call("setWebhook", {
+        "url": url,
+        "secret_token": secret_token,
+        "allowed_updates": allowed_updates,
+        "max_connections": max_connections
+    }, bot_token)
+
+def validate_telegram_init_data(init_data: str, bot_token: str = None,
+                                max_age: int = None) -> Optional[Dict]:
     """
-    Валидация данных от Telegram WebApp
-    TODO: Реализовать проверку подписи
+    Проверка подписи initData Telegram WebApp, возвращает данные пользователя
+    hash = HMAC-SHA256(HMAC-SHA256("WebAppData", BOT_TOKEN), отсортированные пары key=value);
+    initData старше INIT_DATA_MAX_AGE секунд не принимается
     """
     try:
-        # Упрощенная версия - в продакшене нужна проверка HMAC
-        from urllib.parse import parse_qs, unquote
-        
-        parsed = parse_qs(init_data)
+        bot_token = bot_token or settings.BOT_TOKEN
+        max_age = settings.INIT_DATA_MAX_AGE if max_age is None else max_age
         
-        if 'user' not in parsed:
+        if not bot_token:
+            print("[TELEGRAM] ❌ BOT_TOKEN не настроен, initData не проверить")
             return None
             
-        import json
-        user_data = json.loads(unquote(parsed['user'][0]))
+        fields = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
+        received_hash = fields.pop("hash", "")
         
-        return user_data
+        data_check_string = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+        secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+        expected_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+        
+        if not hmac.compare_digest(received_hash, expected_hash):
+            print("[TELEGRAM] ⚠️ Неверная подпись initData")
+            return None
+            
+        if max_age and time.time() - int(fields.get("auth_date", 0)) > max_age:
+            print("[TELEGRAM] ⚠️ initData устарели")
+            return None
+            
+        if "user" not in fields:
+            return None
+            
+        return json.loads(fields["user"])
         
     except Exception as e:
         print(f"[TELEGRAM] ❌ Ошибка валидации init_data: {e}")
         return None
-
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Пул сессий Pyrogram
+Основная сессия (PYROGRAM_SESSION_STRING) принимает обновления - входящие подарки;
+дополнительные (PYROGRAM_EXTRA_SESSION_STRINGS) запускаются с no_updates=True
+и берут на себя исходящие вызовы: отправку сообщений и загрузку файлов.
+Без дополнительных сессий все вызовы идут через основную, как раньше
+"""
+
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+from pyrogram import Client
+from config.settings import settings
+from utils.rate_limit import flood_wait_seconds
+
+# Виды работы: обновления только на основной сессии, остальное - на дополнительных
+KIND_UPDATES = "updates"
+KIND_SEND = "send"
+KIND_DOWNLOAD = "download"
+
+# Окно расчета пропускной способности сессии (секунды)
+THROUGHPUT_WINDOW = 60
+
+T = TypeVar("T")
+
+class PoolSession:
+    """Клиент пула со счетчиками вызовов и блокировкой по FloodWait"""
+    
+    def __init__(self, name: str, client: Client, primary: bool):
+        self.name = name
+        self.client = client
+        self.primary = primary
+        self.started = False
+        self.blocked_until = 0.0
+        self.last_error: Optional[str] = None
+        # Моменты завершения вызовов за последние THROUGHPUT_WINDOW секунд
+        self._completed: deque = deque()
+        
+        # Метрики
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.flood_waits = 0
+    
+    @property
+    def connected(self) -> bool:
+        """Сессия запущена и соединение живо"""
+        return self.started and self.client.is_connected
+    
+    def available(self, now: float) -> bool:
+        """Можно отдавать работу: подключена и не ждет FloodWait"""
+        return self.connected and self.blocked_until <= now
+    
+    def record(self, now: float, error: Exception = None):
+        """Учет завершенного вызова"""
+        self.calls += 1
+        self._completed.append(now)
+        
+        if error is None:
+            return
+            
+        self.errors += 1
+        self.last_error = str(error)
+        seconds = flood_wait_seconds(error)
+        if seconds is not None:
+            # Сессия отдыхает, работа уходит на остальные
+            self.flood_waits += 1
+            self.blocked_until = max(self.blocked_until, now + seconds)
+    
+    def throughput(self, now: float) -> float:
+        """Вызовов в секунду за последнее окно"""
+        while self._completed and self._completed[0] <= now - THROUGHPUT_WINDOW:
+            self._completed.popleft()
+        return round(len(self._completed) / THROUGHPUT_WINDOW, 3)
+    
+    def get_metrics(self, now: float) -> Dict:
+        """Состояние и счетчики сессии"""
+        return {
+            "name": self.name,
+            "primary": self.primary,
+            "connected": self.connected,
+            "flood_wait": round(max(self.blocked_until - now, 0.0), 1),
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "errors": self.errors,
+            "flood_waits": self.flood_waits,
+            "calls_per_sec": self.throughput(now),
+            "last_error": self.last_error
+        }
+
+class TelegramClientPool:
+    """Основная сессия для обновлений плюс дополнительные для исходящих вызовов"""
+    
+    def __init__(self, session_strings: List[str] = None, workers: int = None,
+                 max_transmissions: int = None):
+        if session_strings is None:
+            session_strings = [settings.PYROGRAM_SESSION_STRING] + settings.PYROGRAM_EXTRA_SESSION_STRINGS
+        self.session_strings = [session for session in session_strings if session]
+        self.workers = workers or settings.PYROGRAM_WORKERS
+        self.max_transmissions = max_transmissions or settings.PYROGRAM_MAX_TRANSMISSIONS
+        self.sessions: List[PoolSession] = []
+        
+        # Метрики: вызовы по видам работы и вызовы, ушедшие на основную сессию за неимением других
+        self.routed: Dict[str, int] = {}
+        self.fallbacks = 0
+    
+    def _create_client(self, index: int, session_string: str, primary: bool) -> Client:
+        """
+        Клиент Pyrogram для сессии
+        workers - обработчики обновлений, нужны только основной сессии;
+        max_concurrent_transmissions - одновременные загрузки/выгрузки файлов
+        """
+        return Client(
+            name=f"gift_zona_{index}_{int(time.time())}",
+            api_id=settings.API_ID,
+            api_hash=settings.API_HASH,
+            session_string=session_string,
+            workdir="/tmp",
+            no_updates=not primary,
+            takeout=False,
+            sleep_threshold=60,
+            workers=self.workers if primary else 1,
+            max_concurrent_transmissions=self.max_transmissions
+        )
+    
+    async def start(self) -> bool:
+        """
+        Запуск всех сессий; False - основная сессия не настроена или не подключилась.
+        Дополнительная сессия с ошибкой пропускается, ее работу берут остальные
+        """
+        if self.sessions:
+            return self.primary is not None
+            
+        if not self.session_strings:
+            print("[TELEGRAM] ⚠️ PYROGRAM_SESSION_STRING не настроен")
+            return False
+            
+        for index, session_string in enumerate(self.session_strings):
+            primary = index == 0
+            session = PoolSession(
+                "primary" if primary else f"extra_{index}",
+                self._create_client(index, session_string, primary),
+                primary
+            )
+            
+            try:
+                await session.client.start()
+                session.started = True
+                me = await session.client.get_me()
+                print(f"[TELEGRAM] ✅ Сессия {session.name} подключена как: "
+                      f"{me.first_name} (@{me.username}, ID: {me.id})")
+            except Exception as e:
+                session.last_error = str(e)
+                print(f"[TELEGRAM] ❌ Ошибка подключения сессии {session.name}: {e}")
+                if primary:
+                    return False
+                    
+            self.sessions.append(session)
+            
+        return True
+    
+    @property
+    def primary(self) -> Optional[Client]:
+        """Клиент основной сессии (обработчики обновлений регистрируются на нем)"""
+        if self.sessions and self.sessions[0].started:
+            return self.sessions[0].client
+        return None
+    
+    @property
+    def is_connected(self) -> bool:
+        """Основная сессия на связи"""
+        return bool(self.sessions) and self.sessions[0].connected
+    
+    def session_for(self, kind: str) -> PoolSession:
+        """
+        Сессия для вида работы: обновления - основная, остальное - наименее загруженная
+        из доступных дополнительных, при их отсутствии - основная
+        """
+        now = time.monotonic()
+        if kind != KIND_UPDATES:
+            extra = [session for session in self.sessions[1:] if session.available(now)]
+            if extra:
+                return min(extra, key=lambda session: session.in_flight)
+                
+            if len(self.sessions) > 1:
+                self.fallbacks += 1
+                
+        if self.sessions and self.sessions[0].connected:
+            return self.sessions[0]
+        raise ConnectionError("Telegram клиент не подключен")
+    
+    async def run(self, kind: str, call: Callable[[Client], Awaitable[T]]) -> T:
+        """
+        Вызов call(client) на сессии, выбранной по виду работы
+        Ошибки (в т.ч. FloodWait) пробрасываются; сессия с FloodWait
+        не получает новую работу, пока не истечет ожидание
+        """
+        session = self.session_for(kind)
+        self.routed[kind] = self.routed.get(kind, 0) + 1
+        
+        session.in_flight += 1
+        try:
+            result = await call(session.client)
+        except Exception as e:
+            session.record(time.monotonic(), e)
+            raise
+        finally:
+            session.in_flight -= 1
+            
+        session.record(time.monotonic())
+        return result
+    
+    async def send_message(self, chat_id: int, text: str):
+        """Отправка сообщения через сессию для исходящих"""
+        await self.run(KIND_SEND, lambda client: client.send_message(chat_id, text))
+    
+    async def download_media(self, message, **kwargs):
+        """Загрузка файла через сессию для исходящих"""
+        return await self.run(KIND_DOWNLOAD, lambda client: client.download_media(message, **kwargs))
+    
+    def get_metrics(self) -> Dict:
+        """Состояние пула и каждой сессии"""
+        now = time.monotonic()
+        return {
+            "sessions": [session.get_metrics(now) for session in self.sessions],
+            "connected": sum(1 for session in self.sessions if session.connected),
+            "routed": dict(self.routed),
+            "fallbacks": self.fallbacks
+        }
+    
+    async def stop(self):
+        """Остановка всех запущенных сессий"""
+        for session in self.sessions:
+            if not session.connected:
+                continue
+                
+            try:
+                await session.client.stop()
+                print(f"[TELEGRAM] ✅ Сессия {session.name} остановлена")
+            except Exception as e:
+                print(f"[TELEGRAM] ⚠️ Ошибка остановки сессии {session.name}: {e}")
+                
+        self.sessions = []
+
+# Глобальный пул сессий Telegram
+telegram_pool = TelegramClientPool()